@@ -43,7 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'emails.middleware.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'emails.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -92,6 +94,27 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Permission sets are cached per user (emails/permissions.py).  With more than
+# one server process use a shared backend, eg. memcached, so every process
+# sees when permissions change.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+PERMISSION_CACHE_TIMEOUT = 300
+
+AUTHENTICATION_BACKENDS = ['emails.permissions.CachedModelBackend']
+
+# Threads the async API views (emails/async_api.py) run their queries in, per worker
+ASYNC_DB_THREADS = config('ASYNC_DB_THREADS', default=4, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -130,5 +153,43 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Where collectstatic puts the files, with hashed names and .gz/.br copies (see emails/storage.py).
+# emails.middleware.StaticFilesMiddleware serves them from here.
+STATIC_ROOT = config('STATIC_ROOT', default=os.path.join(BASE_DIR, 'staticfiles'))
+STATICFILES_STORAGE = 'emails.storage.CompressedManifestStaticFilesStorage'
+
+# The release being deployed (a version number or commit), part of every page's ETag so browsers
+# don't keep pages rendered by the previous release (see emails/conditional.py)
+BUILD_VERSION = config('BUILD_VERSION', default='')
+
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
-LOGIN_REDIRECT_URL = '/emails'
\ No newline at end of file
+LOGIN_REDIRECT_URL = '/emails'
+
+# Record queries and time per view, see emails/querystats.py
+QUERY_STATS = config('QUERY_STATS', default=False, cast=bool)
+QUERY_STATS_FLUSH_INTERVAL = 10
+
+# The changes API holds back changes younger than this, for transactions still committing (see emails/changes.py)
+CHANGES_SETTLE_SECONDS = 2
+
+# How often each server process checks the change log for names to update in its typeahead index (see emails/typeahead.py)
+TYPEAHEAD_REFRESH_SECONDS = 1
+
+# How often each server process checks the change log for translations to re-read into its translation memory (see emails/translation_memory.py)
+TRANSLATION_MEMORY_REFRESH_SECONDS = 1
+
+# How alike two translations must be (0.5 to 1, share of word runs in common) to count as near-duplicates (see emails/duplicates.py)
+DUPLICATE_THRESHOLD = 0.8
+
+# Outgoing mail, sent from the queue by the send_queued_emails command (see emails/outbox.py)
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
+# Where the file based backend writes messages
+EMAIL_FILE_PATH = config('EMAIL_FILE_PATH', default=os.path.join(BASE_DIR, 'sent_emails'))
+EMAIL_QUEUE_BATCH_SIZE = 500
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
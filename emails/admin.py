@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, EmailTranslation, Email
+from .models import ApiToken, Category, EmailTranslation, Email, OutboundMessage
 
 class EmailTranslationInline(admin.TabularInline):
 	model = EmailTranslation
@@ -10,6 +10,17 @@ class EmailAdmin(admin.ModelAdmin):
 
 	inlines = [EmailTranslationInline]
 
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+	list_display = ('name', 'user', 'created')
+	readonly_fields = ('key',)
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+	list_display = ('to_address', 'subject', 'status', 'attempts', 'next_attempt', 'sent_at')
+	list_filter = ('status',)
+	raw_id_fields = ('translation',)
+
 # Register your models here.
 admin.site.register(Category)
 admin.site.register(EmailTranslation)
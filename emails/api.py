@@ -0,0 +1,306 @@
+from functools import wraps
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import changes, exporter, merge, translation_memory, typeahead
+from .models import ApiToken, Change, Email, EmailTranslation
+from .pagination import decode_cursor, keyset_paginate
+
+'''
+JSON API for integrations.  Nothing in it changes the catalog.
+
+Clients authenticate with an "Authorization: Token <key>" header (see ApiToken)
+or a logged in session.  Every call runs a fixed number of queries: one for
+the token, the user's permissions (unless cached, see permissions.py), one for
+the emails and one for their translations.
+
+async_api.py serves the same views to ASGI clients without tying up a thread
+per request.
+'''
+
+MAX_BATCH = 100
+PAGE_SIZE = 50
+# The email list is ordered on these, and its cursors hold their values
+LIST_KEYS = ('name_eng', 'id')
+LANGUAGE_NAMES = dict(EmailTranslation.LANGUAGES)
+
+
+def error(message, status):
+    response = JsonResponse({'error': message}, status=status)
+    if status == 401:
+        response['WWW-Authenticate'] = 'Token'
+    return response
+
+
+def token_user(request):
+    '''
+    Returns the user for the request's API token, None if there is no token
+    header, or False if the token is not valid.
+    '''
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header:
+        return None
+    scheme, _, key = header.partition(' ')
+    if scheme.lower() != 'token' or not key.strip():
+        return False
+    token = ApiToken.objects.select_related('user').filter(key=key.strip(), user__is_active=True).first()
+    return token.user if token else False
+
+
+def api_permission_required(perm):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            user = token_user(request)
+            if user is False:
+                return error('Invalid token.', 401)
+            if user is None:
+                user = request.user
+                if not user.is_authenticated:
+                    return error('Authentication credentials were not provided.', 401)
+            if not user.has_perm(perm):
+                return error('You do not have permission to do this.', 403)
+            request.api_user = user
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def requested_language(request):
+    '''
+    Returns the ?lang= code ('' when not given), or None if it is not a known language.
+    '''
+    lang = request.GET.get('lang', '').upper()
+    if lang and lang not in LANGUAGE_NAMES:
+        return None
+    return lang
+
+
+def serialize_emails(ids, lang=''):
+    '''
+    Returns {id: email dict} for the emails in ids that exist, in two queries.
+    '''
+    emails = {}
+    rows = Email.objects.filter(pk__in=ids).values('id', 'name_eng', 'name_esp', 'category_id', 'category__name')
+    for row in rows:
+        emails[row['id']] = {
+            'id': row['id'],
+            'name_eng': row['name_eng'],
+            'name_esp': row['name_esp'],
+            'category': {'id': row['category_id'], 'name': row['category__name']} if row['category_id'] else None,
+            'translations': [],
+        }
+    if emails:
+        translations = EmailTranslation.objects.filter(email_id__in=list(emails))
+        if lang:
+            translations = translations.filter(language=lang)
+        rows = translations.order_by('email_id', 'id').values('email_id', 'language', 'content', 'content_html')
+        for row in rows:
+            emails[row['email_id']]['translations'].append({
+                'language': row['language'],
+                'language_name': LANGUAGE_NAMES.get(row['language'], ''),
+                'content': row['content'],
+                'content_html': row['content_html'],
+            })
+    return emails
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def email_detail(request, pk):
+    lang = requested_language(request)
+    if lang is None:
+        return error('Unknown language.', 400)
+    email = serialize_emails([pk], lang).get(pk)
+    if email is None:
+        return error('Email not found.', 404)
+    if lang and not email['translations']:
+        return error('This email has no %s translation.' % LANGUAGE_NAMES[lang], 404)
+    return JsonResponse(email)
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def email_batch(request):
+    '''
+    ?ids=1,2,3 returns up to MAX_BATCH emails in the order asked for, and the
+    ids that were not found.
+    '''
+    lang = requested_language(request)
+    if lang is None:
+        return error('Unknown language.', 400)
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()]
+    except ValueError:
+        return error('ids must be a comma separated list of email ids.', 400)
+    if not ids:
+        return error('ids must be a comma separated list of email ids.', 400)
+    if len(ids) > MAX_BATCH:
+        return error('At most %d ids can be fetched at once.' % MAX_BATCH, 400)
+
+    ids = list(dict.fromkeys(ids))
+    emails = serialize_emails(ids, lang)
+    return JsonResponse({
+        'emails': [emails[pk] for pk in ids if pk in emails],
+        'missing': [pk for pk in ids if pk not in emails],
+    })
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def email_list(request):
+    '''
+    Every email ordered by English name, ?per_page= (up to MAX_BATCH) at a
+    time.  "next" is the ?after= cursor of the following page, or null.
+    '''
+    lang = requested_language(request)
+    if lang is None:
+        return error('Unknown language.', 400)
+    try:
+        per_page = int(request.GET.get('per_page', PAGE_SIZE))
+    except ValueError:
+        return error('per_page must be a number.', 400)
+    if not 1 <= per_page <= MAX_BATCH:
+        return error('per_page must be between 1 and %d.' % MAX_BATCH, 400)
+
+    after = request.GET.get('after')
+    if after and decode_cursor(after, Email, LIST_KEYS) is None:
+        return error('after must be the next cursor of a page.', 400)
+
+    page = keyset_paginate(Email.objects.only('id', 'name_eng'), LIST_KEYS, after=after, per_page=per_page)
+    ids = [email.id for email in page.object_list]
+    emails = serialize_emails(ids, lang)
+    return JsonResponse({
+        'emails': [emails[pk] for pk in ids if pk in emails],
+        'next': page.next_cursor,
+    })
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def autocomplete(request):
+    '''
+    ?q= returns up to ?limit= (default 10) emails, and categories for users
+    who may see them, whose name or a word in it starts with q.  Answered
+    from this process's typeahead index without touching the catalog
+    tables (see typeahead.py).
+    '''
+    try:
+        limit = int(request.GET.get('limit', typeahead.LIMIT))
+    except ValueError:
+        return error('limit must be a number.', 400)
+    if not 1 <= limit <= typeahead.MAX_LIMIT:
+        return error('limit must be between 1 and %d.' % typeahead.MAX_LIMIT, 400)
+    kinds = [Change.EMAIL]
+    if request.api_user.has_perm('emails.view_category'):
+        kinds.append(Change.CATEGORY)
+    url_names = {Change.EMAIL: 'email_detail', Change.CATEGORY: 'category_detail'}
+    results = typeahead.index().search(request.GET.get('q', ''), limit, kinds)
+    return JsonResponse({'results': [
+        {'type': kind, 'id': pk, 'label': label, 'detail': detail, 'url': reverse(url_names[kind], args=(pk,))}
+        for kind, pk, label, detail in results
+    ]})
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def translation_suggestions(request):
+    '''
+    ?source= (English text) and ?language= return, for each sentence of
+    source, up to ?limit= (default 3) sentences of other emails that read
+    alike and how they were translated into language.  ?exclude=<email id>
+    leaves out sentences only that email uses.  Answered from this process's
+    translation memory (see translation_memory.py).
+    '''
+    language = request.GET.get('language', '')
+    if language not in dict(EmailTranslation.LANGUAGES) or language == translation_memory.SOURCE_LANGUAGE:
+        return error('language must be a language to translate into.', 400)
+    try:
+        limit = int(request.GET.get('limit', translation_memory.LIMIT))
+        exclude = int(request.GET['exclude']) if request.GET.get('exclude') else None
+    except ValueError:
+        return error('limit and exclude must be numbers.', 400)
+    if not 1 <= limit <= translation_memory.MAX_LIMIT:
+        return error('limit must be between 1 and %d.' % translation_memory.MAX_LIMIT, 400)
+    source = request.GET.get('source', '')
+    if len(source) > EmailTranslation._meta.get_field('content').max_length:
+        return error('source is too long.', 400)
+    suggestions = translation_memory.memory().suggest(source, language, limit, exclude)
+    return JsonResponse({'suggestions': [
+        {'sentence': sentence, 'matches': [
+            {'source': source, 'translation': target, 'similarity': similarity, 'emails': emails}
+            for similarity, source, target, emails in matches
+        ]}
+        for sentence, matches in suggestions
+    ]})
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def change_feed(request):
+    '''
+    ?since=<seq> returns up to ?limit= (default 500) changes after seq,
+    oldest first, with "next", the since= of the following request, and
+    "more", whether it has changes waiting already.  Without since, returns
+    no changes and the current position, to start following from now.
+    '''
+    if 'since' not in request.GET:
+        return JsonResponse({'changes': [], 'next': changes.latest_seq(), 'more': False})
+    try:
+        since = int(request.GET['since'])
+        limit = int(request.GET.get('limit', changes.PAGE_SIZE))
+    except ValueError:
+        return error('since and limit must be numbers.', 400)
+    if since < 0 or not 1 <= limit <= changes.MAX_PAGE_SIZE:
+        return error('since must be at least 0 and limit between 1 and %d.' % changes.MAX_PAGE_SIZE, 400)
+    page, more = changes.since(since, limit)
+    return JsonResponse({'changes': page, 'next': page[-1]['seq'] if page else since, 'more': more})
+
+
+@require_GET
+@api_permission_required('emails.view_email')
+def export_catalog(request, file_format):
+    '''
+    Streams every category, email and translation as csv, jsonl or a zip
+    with one CSV per language.
+    '''
+    if file_format not in exporter.FORMATS:
+        return error('Unknown export format.', 404)
+    content_type, extension = exporter.FORMATS[file_format]
+    response = StreamingHttpResponse(exporter.export(file_format), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="emails-%s.%s"' % (
+        timezone.now().strftime('%Y%m%d'), extension)
+    return response
+
+
+@csrf_exempt
+@require_POST
+@api_permission_required('emails.view_email')
+def email_merge(request, pk, language):
+    '''
+    Renders the email's translation into language once per recipient in the
+    request body: CSV with a header row, a JSON list of objects or JSON lines,
+    as given by the Content-Type (or ?format=csv|json|jsonl).  Streams one JSON
+    line per recipient, see merge.render_stream().
+
+    The body is read as the response is sent (CSV and JSON lines a line at a
+    time), so it isn't limited by DATA_UPLOAD_MAX_MEMORY_SIZE.  Exempt from
+    CSRF checks because it only reads.
+    '''
+    language = language.upper()
+    if language not in LANGUAGE_NAMES:
+        return error('Unknown language.', 400)
+    file_format = request.GET.get('format') or merge.CONTENT_TYPES.get(request.content_type)
+    if file_format not in merge.READERS:
+        return error('Send the recipients as text/csv, application/json or application/x-ndjson.', 415)
+    translation = EmailTranslation.objects.only('id', 'content').filter(email_id=pk, language=language).first()
+    if translation is None:
+        return error('This email has no %s translation.' % LANGUAGE_NAMES[language], 404)
+
+    template = merge.compiled(translation)
+    records = merge.READERS[file_format](request)
+    return StreamingHttpResponse(merge.render_stream(template, records), content_type='application/x-ndjson')
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from .search import ensure_index
+    ensure_index(using=using)
 
 
 class EmailsConfig(AppConfig):
     name = 'emails'
+
+    def ready(self):
+        from . import signals
+        post_migrate.connect(create_search_index, sender=self)
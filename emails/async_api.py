@@ -0,0 +1,74 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import api
+
+'''
+The read-only JSON API (api.py) as async views, for ASGI deployments.
+
+Under ASGI Django runs every sync view in one shared thread, so a slow query
+holds up every other request.  These views wait for the database in a fixed
+pool of ASYNC_DB_THREADS threads instead: any number of requests can be in
+flight on one worker, and those waiting for a database thread wait in the
+event loop without taking a thread or a connection of their own.
+
+Django 3.2 has no async ORM, so each view runs its whole sync counterpart
+(authentication, permission check and queries) in a pool thread, in one hop.
+'''
+
+DB_THREADS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_DB_THREADS', DB_THREADS),
+                thread_name_prefix='emails-db',
+            )
+    return _executor
+
+
+def _call(func, args, kwargs):
+    # The pool threads live on between requests, so they look after their
+    # connections the way Django does at the start and end of a request
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def in_db_thread(func, *args, **kwargs):
+    '''
+    Run func(*args, **kwargs) in the database thread pool and return its result.
+    With ASYNC_DB_THREADS = 0 it runs in Django's shared sync thread instead,
+    on the same connection as sync views (which tests that roll back need).
+    '''
+    if not getattr(settings, 'ASYNC_DB_THREADS', DB_THREADS):
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor(), context.run, _call, func, args, kwargs)
+
+
+async def email_detail(request, pk):
+    return await in_db_thread(api.email_detail, request, pk)
+
+
+async def email_batch(request):
+    return await in_db_thread(api.email_batch, request)
+
+
+async def email_list(request):
+    return await in_db_thread(api.email_list, request)
@@ -0,0 +1,229 @@
+import collections
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import Permission, User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from . import seed
+from .models import Category, Email
+
+'''
+Times every view in urls.py, and the email create/update saves, against
+seeded catalogs of several sizes.
+
+Each size is seeded inside a transaction that is rolled back afterwards, so
+run() leaves the database as it found it; the benchmark_views command runs it
+on a throwaway test database.  Results can be saved as a JSON baseline and
+later runs compared against it.
+'''
+
+DEFAULT_SIZES = ('2x10x6', '10x50x6', '20x250x6')
+REPEAT = 5
+# A view has regressed if its median time grows by more than this, or it runs more queries
+TOLERANCE = 0.25
+USERNAME = 'benchmark'
+# Recipients sent to the mail merge view
+RECIPIENTS = 1000
+
+
+# A request body that isn't form data
+RawBody = collections.namedtuple('RawBody', 'content_type content')
+
+
+class Rollback(Exception):
+    pass
+
+
+def parse_size(size):
+    '''
+    'CATEGORIESxEMAILSxLANGUAGES', eg. '10x50x6' is 500 emails with 6 translations each.
+    '''
+    try:
+        categories, emails, languages = (int(part) for part in size.lower().split('x'))
+    except ValueError:
+        raise ValueError('Sizes look like 10x50x6 (categories x emails per category x languages), not %r.' % size)
+    if categories < 1 or emails < 1 or not 1 <= languages <= len(seed.LANGUAGE_CODES):
+        raise ValueError('Size %r is out of range.' % size)
+    return categories, emails, languages
+
+
+def email_post_data(email, translations, prefix='emailtranslation_set'):
+    data = {
+        'name_eng': email.name_eng,
+        'name_esp': email.name_esp,
+        'category': email.category_id or '',
+        prefix + '-TOTAL_FORMS': len(translations),
+        prefix + '-INITIAL_FORMS': len([t for t in translations if t.pk]),
+        prefix + '-MIN_NUM_FORMS': 0,
+        prefix + '-MAX_NUM_FORMS': 1000,
+    }
+    for i, translation in enumerate(translations):
+        data['%s-%d-id' % (prefix, i)] = translation.pk or ''
+        data['%s-%d-language' % (prefix, i)] = translation.language
+        data['%s-%d-content' % (prefix, i)] = translation.content
+    return data
+
+
+def scenarios(email, category):
+    '''
+    (name, method, url, data) for every view.  data may be a function of the
+    run number, for saves that must differ each time, or a RawBody.
+
+    The async API views are left out: they read through their own connections,
+    which can't see a catalog seeded in a transaction that is rolled back.
+    '''
+    translations = list(email.emailtranslation_set.order_by('pk'))
+    language = translations[0].language if translations else 'EN'
+    word = email.name_eng.split()[0]
+    english = next((translation.content for translation in translations if translation.language == 'EN'), word)
+    target = next((translation.language for translation in translations if translation.language != 'EN'), 'FR')
+    recipients = RawBody('text/csv', 'first_name,order_number\n' + ''.join(
+        'Recipient %d,%d\n' % (i, 1000 + i) for i in range(RECIPIENTS)))
+
+    def update(run):
+        translations[0].content = 'Changed %d' % run
+        return email_post_data(email, translations)
+
+    def create(run):
+        new = Email(name_eng='Benchmark %d' % run, name_esp='Benchmark %d' % run, category=category)
+        return email_post_data(new, [type(translation)(language=translation.language, content=translation.content)
+            for translation in translations])
+
+    return [
+        ('index', 'get', reverse('index'), None),
+        ('email_create', 'get', reverse('email_create'), None),
+        ('email_create (save)', 'post', reverse('email_create'), create),
+        ('email_update', 'get', reverse('email_update', args=(email.pk,)), None),
+        ('email_update (save)', 'post', reverse('email_update', args=(email.pk,)), update),
+        ('translation_editor', 'get', reverse('translation_editor', args=(email.pk,)), None),
+        ('translation_save', 'post', reverse('translation_save', args=(email.pk, language)),
+            lambda run: {'%s-content' % language: 'Saved %d' % run}),
+        ('category_create', 'get', reverse('category_create'), None),
+        ('category_update', 'get', reverse('category_update', args=(category.pk,)), None),
+        ('all_emails', 'get', reverse('all_emails'), None),
+        ('all_emails (filtered)', 'get', reverse('all_emails') + '?name=%s' % word, None),
+        ('search', 'get', reverse('search') + '?q=%s' % word, None),
+        ('all_categories', 'get', reverse('all_categories'), None),
+        ('email_detail', 'get', reverse('email_detail', args=(email.pk,)), None),
+        ('category_detail', 'get', reverse('category_detail', args=(category.pk,)), None),
+        ('query_stats', 'get', reverse('query_stats'), None),
+        ('email_history', 'get', reverse('email_history', args=(email.pk,)) + '?language=%s&revision=1' % language, None),
+        ('email_send', 'get', reverse('email_send', args=(email.pk,)), None),
+        ('outbox', 'get', reverse('outbox'), None),
+        ('coverage', 'get', reverse('coverage'), None),
+        ('coverage_export', 'get', reverse('coverage_export'), None),
+        ('duplicates', 'get', reverse('duplicates'), None),
+        ('api_email_batch', 'get', reverse('api_email_batch') + '?ids=%d' % email.pk, None),
+        ('api_email_detail', 'get', reverse('api_email_detail', args=(email.pk,)), None),
+        ('api_email_list', 'get', reverse('api_email_list'), None),
+        ('api_email_merge', 'post', reverse('api_email_merge', args=(email.pk, language)), recipients),
+        ('api_autocomplete', 'get', reverse('api_autocomplete') + '?q=%s' % word[:2], None),
+        ('api_changes', 'get', reverse('api_changes') + '?since=0', None),
+        ('api_translation_memory', 'get', reverse('api_translation_memory') + '?' + urlencode(
+            {'language': target, 'source': english, 'exclude': email.pk}), None),
+        ('api_export', 'get', reverse('api_export', args=('jsonl',)), None),
+    ]
+
+
+def time_request(client, method, url, data):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        if isinstance(data, RawBody):
+            response = getattr(client, method)(url, data.content, content_type=data.content_type)
+        else:
+            response = getattr(client, method)(url, data)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise AssertionError('%s %s returned %d' % (method.upper(), url, response.status_code))
+    return elapsed, len(queries)
+
+
+def measure(repeat=REPEAT):
+    '''
+    Runs every scenario repeat times (after one warm-up run) on the current
+    data and returns {name: {'median_ms', 'max_ms', 'queries'}}.
+    '''
+    user = User.objects.create_user(USERNAME, is_staff=True)
+    user.user_permissions.add(*Permission.objects.filter(content_type__app_label='emails'))
+    client = Client()
+    client.force_login(user)
+
+    # An email near the middle of the list, in the largest category
+    email = Email.objects.select_related('category').order_by('name_eng', 'pk')[Email.objects.count() // 2]
+    category = email.category or Category.objects.first()
+    results = {}
+    for name, method, url, data in scenarios(email, category):
+        times = []
+        for run in range(repeat + 1):
+            elapsed, queries = time_request(client, method, url, data(run) if callable(data) else data)
+            times.append(elapsed)
+        times = times[1:]
+        results[name] = {
+            'median_ms': round(statistics.median(times) * 1000, 2),
+            'max_ms': round(max(times) * 1000, 2),
+            'queries': queries,
+        }
+    return results
+
+
+def run(sizes=DEFAULT_SIZES, repeat=REPEAT, seed_value=0, progress=None):
+    '''
+    Returns {size: {'emails': n, 'seconds_to_seed': s, 'views': measure()}}.
+    '''
+    results = {}
+    for size in sizes:
+        categories, emails, languages = parse_size(size)
+        try:
+            with transaction.atomic():
+                if progress:
+                    progress('Seeding %s' % size)
+                stats = seed.seed_catalog(categories, emails, seed.LANGUAGE_CODES[:languages], seed_value)
+                if progress:
+                    progress('Measuring %s' % size)
+                results[size] = {
+                    'emails': stats.emails_created,
+                    'seconds_to_seed': round(stats.elapsed, 2),
+                    'views': measure(repeat),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    '''
+    Returns (size, view, what, baseline value, new value) for every view
+    that got slower or runs more queries than in baseline.
+    '''
+    regressions = []
+    for size, result in results.items():
+        for view, numbers in result['views'].items():
+            before = baseline.get(size, {}).get('views', {}).get(view)
+            if before is None:
+                continue
+            if numbers['queries'] > before['queries']:
+                regressions.append((size, view, 'queries', before['queries'], numbers['queries']))
+            if numbers['median_ms'] > before['median_ms'] * (1 + tolerance):
+                regressions.append((size, view, 'median_ms', before['median_ms'], numbers['median_ms']))
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
@@ -0,0 +1,42 @@
+from django.utils import timezone
+
+from .signals import row_signals_muted, send_bulk_deleted
+
+
+def bulk_create(model, objs, batch_size=None, **lookup):
+    '''
+    bulk_create() that returns the saved rows with their pks.  Backends that
+    can't return ids from a bulk insert (eg. MySQL) read back the newest
+    len(objs) rows matching lookup, which are the new ones as long as nothing
+    else inserts matching rows at the same time.
+    '''
+    objs = list(objs)
+    created = model.objects.bulk_create(objs, batch_size=batch_size)
+    if not created or created[0].pk is not None:
+        return created
+    newest = list(model.objects.filter(**lookup).order_by('-pk')[:len(objs)])
+    newest.reverse()
+    return newest
+
+
+def bulk_update(model, objs, fields, batch_size=None):
+    '''
+    bulk_update() that moves updated_at on, like TrackedModel.save().
+    '''
+    now = timezone.now()
+    for obj in objs:
+        obj.updated_at = now
+    model.objects.bulk_update(objs, list(fields) + ['updated_at'], batch_size=batch_size)
+
+
+def bulk_delete(model, instances):
+    '''
+    Delete instances in one query and report them through bulk_deleted
+    instead of a post_delete per row.
+    '''
+    instances = [instance for instance in instances if instance.pk is not None]
+    if not instances:
+        return
+    with row_signals_muted():
+        model.objects.filter(pk__in=[instance.pk for instance in instances]).delete()
+    send_bulk_deleted(model, instances)
@@ -0,0 +1,95 @@
+import datetime
+
+from django.conf import settings
+from django.db.models import BigIntegerField, DateTimeField, ExpressionWrapper, Subquery, Value
+from django.db.models.functions import Coalesce, Now
+
+from .models import Change
+
+'''
+The change log behind the changes API.
+
+signals.py adds a Change row for every create, update and delete of a
+category, email or translation, in the same transaction as the write, with
+one insert per save or bulk write.  Change.seq only grows, so a client that
+remembers the last seq it has seen asks for what came after it and does work
+in proportion to what changed.
+
+Side effects of deletes aren't logged separately: deleting a category leaves
+its emails without one, and deleting an email leaves its translations
+without one.  Clients apply those themselves.
+
+A transaction that started earlier can commit a lower seq after a later one
+has been read.  So since() stops short of the first change younger than
+CHANGES_SETTLE_SECONDS, and everything after it waits too, giving writes
+still in flight that long to commit.  created is stamped by the database
+clock, so app servers with skewed clocks agree on what is settled.
+
+created is when the row was inserted, not when its transaction committed.
+A transaction that runs for longer than CHANGES_SETTLE_SECONDS after
+logging a change (a big import_emails batch, say) can commit it after
+clients have moved past its seq.  Keep CHANGES_SETTLE_SECONDS above the
+longest write transaction, or have clients re-sync after such jobs.
+'''
+
+SETTLE_SECONDS = 2
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+
+def log(entity, *operations):
+    '''
+    log(entity, (operation, ids), ...) writes the changes in one insert.
+    '''
+    entries = [Change(entity=entity, object_id=pk, operation=operation, created=Now())
+        for operation, ids in operations for pk in ids if pk is not None]
+    if entries:
+        Change.objects.bulk_create(entries)
+
+
+def log_saved(entity, created=(), updated=()):
+    log(entity, (Change.CREATE, [instance.pk for instance in created]),
+        (Change.UPDATE, [instance.pk for instance in updated]))
+
+
+def log_deleted(entity, ids):
+    log(entity, (Change.DELETE, ids))
+
+
+def latest_seq():
+    return Change.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+
+def since(seq, limit=PAGE_SIZE):
+    '''
+    Returns (changes after seq, whether there are more), oldest first, as dicts.
+    '''
+    settle = getattr(settings, 'CHANGES_SETTLE_SECONDS', SETTLE_SECONDS)
+    settled = ExpressionWrapper(Now() - datetime.timedelta(seconds=settle), output_field=DateTimeField())
+    # The first change still settling, and the ones after it, wait for the next call
+    unsettled = Subquery(Change.objects.filter(seq__gt=seq, created__gt=settled).order_by('seq').values('seq')[:1])
+    rows = (Change.objects.filter(seq__gt=seq, seq__lt=Coalesce(unsettled, Value(2 ** 63 - 1),
+            output_field=BigIntegerField()))
+        .order_by('seq').values('seq', 'entity', 'object_id', 'operation', 'created')[:limit + 1])
+    rows = list(rows)
+    return [
+        {'seq': row['seq'], 'entity': row['entity'], 'id': row['object_id'], 'op': row['operation'],
+            'at': row['created'].isoformat()}
+        for row in rows[:limit]
+    ], len(rows) > limit
+
+
+def touched(seq):
+    '''
+    ({entity: set of ids}, seq of the last change read) for everything logged
+    after seq, for in-process indexes that re-read what changed.
+    '''
+    ids = {Change.CATEGORY: set(), Change.EMAIL: set(), Change.TRANSLATION: set()}
+    more = True
+    while more:
+        page, more = since(seq, MAX_PAGE_SIZE)
+        for change in page:
+            ids[change['entity']].add(change['id'])
+        if page:
+            seq = page[-1]['seq']
+    return ids, seq
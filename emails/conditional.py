@@ -0,0 +1,117 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db.models import BigIntegerField, Case, Count, DateTimeField, F, IntegerField, Max, Value, When
+
+from . import counters
+from .models import Category, Counter, Email, EmailTranslation
+
+'''
+Validators for conditional GET of the read-only pages.
+
+Each page has a state: a few values, read in one small query, that change
+whenever something the page shows changes.  That is the latest updated_at of
+the rows it shows (TrackedModel moves it on every save and bulk write) and
+how many there are, which catches deletes; for whole tables the count comes
+from counters.py rather than a COUNT(*) on every request.  A page's ETag is a
+hash of its state, its URL, who is looking (their username and permissions
+decide the menu and links) and the build (see build_version()), so a browser
+that still has the page gets 304 Not Modified instead of the page.
+
+Writes that skip save() and bulk.bulk_update() (queryset.update()) don't move
+updated_at, and pages stay cached until something else changes.
+'''
+
+
+def latest(*times):
+    times = [time for time in times if time is not None]
+    return max(times) if times else None
+
+
+# The counters.py total that counts each model's rows
+ROW_COUNTERS = {Category: 'categories', Email: 'emails', EmailTranslation: 'translations'}
+
+
+def table_state(*models):
+    '''
+    [(latest updated_at, row count)] of each model, in one query.  Neither
+    scans the table: the latest updated_at is read off its index and the
+    count is the model's counter, which signals.py keeps in step.
+    '''
+    latest_parts = [model.objects.order_by()
+        .annotate(part=Value(i, output_field=IntegerField())).values('part')
+        .annotate(last=Max('updated_at'), count=Value(None, output_field=BigIntegerField()))
+        .values_list('part', 'last', 'count')
+        for i, model in enumerate(models)]
+    count_part = (Counter.objects.order_by()
+        .filter(scope=counters.TOTAL, key__in=[ROW_COUNTERS[model] for model in models])
+        .annotate(part=Case(*[When(key=ROW_COUNTERS[model], then=Value(i)) for i, model in enumerate(models)],
+            output_field=IntegerField()), last=Value(None, output_field=DateTimeField()), count=F('value'))
+        .values_list('part', 'last', 'count'))
+    state = [[None, 0] for model in models]
+    for part, last, count in latest_parts[0].union(*latest_parts[1:], count_part, all=True):
+        if count is None:
+            state[part][0] = last
+        else:
+            state[part][1] = count
+    return [tuple(model_state) for model_state in state]
+
+
+def email_state(pk):
+    '''
+    The email, its category and its translations.  None if there is no such email.
+    '''
+    return (Email.objects.filter(pk=pk).order_by()
+        .values_list('updated_at', 'category__updated_at')
+        .annotate(translations=Max('emailtranslation__updated_at'), count=Count('emailtranslation'))
+        .first())
+
+
+def category_state(pk):
+    '''
+    The category, its emails and their translations.  None if there is no such category.
+    '''
+    return (Category.objects.filter(pk=pk).order_by()
+        .values_list('updated_at')
+        .annotate(emails=Max('email__updated_at'), count=Count('email', distinct=True),
+            translations=Max('email__emailtranslation__updated_at'), translation_count=Count('email__emailtranslation'))
+        .first())
+
+
+def last_modified(state):
+    '''
+    The latest of the times in state, for the Last-Modified header.
+    '''
+    flat = []
+    for value in state:
+        flat.extend(value if isinstance(value, tuple) else [value])
+    return latest(*[value for value in flat if hasattr(value, 'tzinfo')])
+
+
+@functools.lru_cache(maxsize=None)
+def manifest_hash(location):
+    '''
+    Hash of the staticfiles manifest collectstatic wrote to location, '' before
+    the first collectstatic.  Read once per process; deploys restart it.
+    '''
+    read_manifest = getattr(staticfiles_storage, 'read_manifest', None)
+    content = read_manifest() if read_manifest else None
+    return hashlib.sha1(content.encode('utf-8')).hexdigest() if content else ''
+
+
+def build_version():
+    '''
+    A deploy can change a page (its templates, the hashed names of its CSS and
+    JavaScript) without changing its state.  settings.BUILD_VERSION, set to
+    the release being deployed, and the staticfiles manifest tell the builds apart.
+    '''
+    return getattr(settings, 'BUILD_VERSION', ''), manifest_hash(getattr(staticfiles_storage, 'location', None))
+
+
+def etag(request, state):
+    user = request.user
+    key = repr((build_version(), user.pk, user.get_username(), sorted(user.get_all_permissions()),
+        request.get_full_path(), state))
+    return '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
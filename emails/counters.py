@@ -0,0 +1,201 @@
+import collections
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+from .models import Category, Counter, Email, EmailTranslation
+
+'''
+Counter rows are (scope, key) -> value:
+    total/emails, total/translations,
+    total/categories                       row counts
+    language/<code>                        translations per language
+    category/<id> or category/none         emails per category
+    email/<id>                             translations per email
+Changes are collected as a collections.Counter of {(scope, key): delta} and
+written with apply() inside the caller's transaction.
+'''
+
+TOTAL = 'total'
+LANGUAGE = 'language'
+CATEGORY = 'category'
+EMAIL = 'email'
+
+NO_CATEGORY = 'none'
+
+
+def category_key(category_id):
+    return NO_CATEGORY if category_id is None else str(category_id)
+
+
+def new_deltas():
+    return collections.Counter()
+
+
+def add_email(deltas, category_id, sign=1):
+    deltas[(TOTAL, 'emails')] += sign
+    deltas[(CATEGORY, category_key(category_id))] += sign
+
+
+def add_category(deltas, sign=1):
+    deltas[(TOTAL, 'categories')] += sign
+
+
+def add_translation(deltas, email_id, language, sign=1):
+    deltas[(TOTAL, 'translations')] += sign
+    deltas[(LANGUAGE, language or '')] += sign
+    if email_id is not None:
+        deltas[(EMAIL, str(email_id))] += sign
+
+
+def _increment(scope, key, delta):
+    if Counter.objects.filter(scope=scope, key=key).update(value=F('value') + delta):
+        return
+    try:
+        with transaction.atomic():
+            Counter.objects.create(scope=scope, key=key, value=delta)
+    except IntegrityError:
+        # Somebody created it first
+        Counter.objects.filter(scope=scope, key=key).update(value=F('value') + delta)
+
+
+def apply(deltas):
+    '''
+    Add deltas to the counters in at most three queries, however many there are.
+    '''
+    changes = {name: delta for name, delta in deltas.items() if delta}
+    if not changes:
+        return
+    if len(changes) == 1:
+        (scope, key), delta = changes.popitem()
+        _increment(scope, key, delta)
+        return
+
+    def matching(names):
+        condition = Q()
+        for scope, key in names:
+            condition |= Q(scope=scope, key=key)
+        return condition
+
+    with transaction.atomic():
+        existing = set(Counter.objects.filter(matching(changes)).values_list('scope', 'key'))
+        if existing:
+            Counter.objects.filter(matching(existing)).update(value=F('value') + Case(
+                *[When(scope=scope, key=key, then=Value(changes[(scope, key)])) for scope, key in existing],
+                output_field=models.BigIntegerField()
+            ))
+        missing = sorted(set(changes) - existing)
+        if missing:
+            try:
+                with transaction.atomic():
+                    Counter.objects.bulk_create([Counter(scope=scope, key=key, value=changes[(scope, key)])
+                        for scope, key in missing])
+            except IntegrityError:
+                for scope, key in missing:
+                    _increment(scope, key, changes[(scope, key)])
+
+
+def forget_email(email_id):
+    Counter.objects.filter(scope=EMAIL, key=str(email_id)).delete()
+
+
+def forget_category(category_id):
+    '''
+    The category's emails have been set to no category, so move its count over.
+    '''
+    with transaction.atomic():
+        deltas = new_deltas()
+        add_category(deltas, -1)
+        counter = Counter.objects.select_for_update().filter(scope=CATEGORY, key=str(category_id)).first()
+        if counter is not None:
+            counter.delete()
+            deltas[(CATEGORY, NO_CATEGORY)] += counter.value
+        apply(deltas)
+
+
+def translation_count(email_id):
+    counter = Counter.objects.filter(scope=EMAIL, key=str(email_id)).first()
+    return counter.value if counter else 0
+
+
+def dashboard_stats():
+    '''
+    Everything the index page shows, read from the counters in two queries.
+    '''
+    values = {(counter.scope, counter.key): counter.value
+        for counter in Counter.objects.filter(scope__in=[TOTAL, LANGUAGE, CATEGORY])}
+
+    language_names = dict(EmailTranslation.LANGUAGES)
+    per_language = [(language_names.get(key, 'Unspecified'), value)
+        for (scope, key), value in sorted(values.items())
+        if scope == LANGUAGE and value]
+
+    category_ids = [int(key) for (scope, key), value in values.items()
+        if scope == CATEGORY and key != NO_CATEGORY and value]
+    categories = Category.objects.in_bulk(category_ids) if category_ids else {}
+    per_category = sorted(
+        ((categories[category_id], values[(CATEGORY, str(category_id))])
+            for category_id in category_ids if category_id in categories),
+        key=lambda item: item[0].name
+    )
+    if values.get((CATEGORY, NO_CATEGORY)):
+        per_category.append(('No category', values[(CATEGORY, NO_CATEGORY)]))
+
+    return {
+        'num_emails': values.get((TOTAL, 'emails'), 0),
+        'num_emailtranslations': values.get((TOTAL, 'translations'), 0),
+        'translations_per_language': per_language,
+        'emails_per_category': per_category,
+    }
+
+
+def actual_counts():
+    counts = {
+        (TOTAL, 'emails'): Email.objects.count(),
+        (TOTAL, 'translations'): EmailTranslation.objects.count(),
+        (TOTAL, 'categories'): Category.objects.count(),
+    }
+    for row in EmailTranslation.objects.order_by().values('language').annotate(n=Count('id')):
+        counts[(LANGUAGE, row['language'] or '')] = row['n']
+    for row in Email.objects.order_by().values('category').annotate(n=Count('id')):
+        counts[(CATEGORY, category_key(row['category']))] = row['n']
+    rows = EmailTranslation.objects.filter(email__isnull=False).order_by().values('email').annotate(n=Count('id'))
+    for row in rows.iterator():
+        counts[(EMAIL, str(row['email']))] = row['n']
+    return counts
+
+
+def reconcile(dry_run=False):
+    '''
+    Recount everything from the source tables and fix any counters that drifted.
+    Returns a list of (scope, key, stored, actual) for the counters that were wrong.
+    '''
+    with transaction.atomic():
+        actual = actual_counts()
+        stored = {(counter.scope, counter.key): counter
+            for counter in Counter.objects.select_for_update().iterator()}
+
+        drift = []
+        for name in set(actual) | set(stored):
+            stored_value = stored[name].value if name in stored else 0
+            actual_value = actual.get(name, 0)
+            if stored_value != actual_value:
+                drift.append(name + (stored_value, actual_value))
+        drift.sort()
+
+        if not dry_run:
+            to_update, to_create, to_delete = [], [], []
+            for scope, key, stored_value, actual_value in drift:
+                counter = stored.get((scope, key))
+                if counter is None:
+                    to_create.append(Counter(scope=scope, key=key, value=actual_value))
+                elif actual_value:
+                    counter.value = actual_value
+                    to_update.append(counter)
+                else:
+                    to_delete.append(counter.pk)
+            Counter.objects.bulk_create(to_create, batch_size=1000)
+            Counter.objects.bulk_update(to_update, ['value'], batch_size=1000)
+            for start in range(0, len(to_delete), 500):
+                Counter.objects.filter(pk__in=to_delete[start:start + 500]).delete()
+        return drift
@@ -0,0 +1,136 @@
+import csv
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Email, EmailTranslation
+
+'''
+Which emails are translated into which languages.
+
+Both the email x language matrix and the completion summary come from one
+conditional-aggregation query over the email/translation join, grouped by
+email (one page of the matrix) or by category (the summary).  Translations
+are unique per (email, language), so counting them counts emails.
+
+The summary and the pages are cached under a version that signals.py bumps
+whenever an email or translation changes.
+'''
+
+LANGUAGES = EmailTranslation.LANGUAGES
+VERSION_KEY = 'emails:coverage:version'
+CACHE_TIMEOUT = 60 * 60
+
+
+def language_counts(prefix=''):
+    return {'%s%s' % (prefix, code): Count('emailtranslation', filter=Q(emailtranslation__language=code))
+        for code, name in LANGUAGES}
+
+
+def matrix(queryset=None):
+    '''
+    Emails annotated with has_<code> (0 or 1) for every language and
+    translated, the number of languages they have.
+    '''
+    queryset = Email.objects.all() if queryset is None else queryset
+    return queryset.annotate(
+        translated=Count('emailtranslation__language', distinct=True),
+        **language_counts('has_'),
+    )
+
+
+def flags(email):
+    '''
+    [(code, translated)] for an email from matrix(), in LANGUAGES order.
+    '''
+    return [(code, bool(getattr(email, 'has_' + code))) for code, _ in LANGUAGES]
+
+
+def missing_only(queryset):
+    return queryset.filter(translated__lt=len(LANGUAGES))
+
+
+def percent(part, whole):
+    return round(100 * part / whole, 1) if whole else 0.0
+
+
+class CategoryCoverage:
+    def __init__(self, category_id, name, emails, translated):
+        self.category_id = category_id
+        self.name = name
+        self.emails = emails
+        # [(code, emails translated, percent)] in LANGUAGES order
+        self.languages = [(code, translated[code], percent(translated[code], emails)) for code, _ in LANGUAGES]
+        self.complete = percent(sum(translated.values()), emails * len(LANGUAGES))
+
+
+def summary():
+    '''
+    Returns (per category, overall) CategoryCoverage, in one query.
+    '''
+    rows = (Email.objects.order_by().values('category_id', 'category__name')
+        .annotate(emails=Count('id', distinct=True), **language_counts()))
+    categories = []
+    totals = {code: 0 for code, _ in LANGUAGES}
+    total_emails = 0
+    for row in rows:
+        translated = {code: row[code] for code, _ in LANGUAGES}
+        categories.append(CategoryCoverage(row['category_id'], row['category__name'] or 'No category',
+            row['emails'], translated))
+        total_emails += row['emails']
+        for code in totals:
+            totals[code] += translated[code]
+    categories.sort(key=lambda category: (category.category_id is None, category.name))
+    return categories, CategoryCoverage(None, 'All emails', total_emails, totals)
+
+
+# Caching
+
+def version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def forget():
+    '''
+    Invalidate everything cached, now and again when the current transaction
+    commits, so nothing read in between stays cached.
+    '''
+    def bump():
+        if not cache.add(VERSION_KEY, 1, None):
+            cache.incr(VERSION_KEY)
+    bump()
+    transaction.on_commit(bump)
+
+
+def cached(name, compute):
+    '''
+    compute() cached until the next change to emails or translations.
+    '''
+    key = 'emails:coverage:%s:%s' % (version(), name)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, CACHE_TIMEOUT)
+    return value
+
+
+# Export
+
+def export_csv(chunk_size=None):
+    '''
+    Streams the whole matrix as CSV, one aggregate query per chunk_size emails.
+    '''
+    # exporter imports signals.py (through importer and bulk), which imports this module
+    from .exporter import CHUNK_SIZE, Buffer, in_range, pk_ranges
+    chunk_size = chunk_size or CHUNK_SIZE
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'name_eng', 'category'] + [name for code, name in LANGUAGES] + ['languages'])
+    rows = matrix(Email.objects.order_by('pk')).values_list(
+        'pk', 'name_eng', 'category__name', *['has_' + code for code, _ in LANGUAGES], 'translated')
+    for after, up_to in pk_ranges(Email.objects.all(), chunk_size):
+        for row in in_range(rows, after, up_to):
+            pk, name, category, *flags, translated = row
+            writer.writerow([pk, name, category or ''] + ['yes' if flag else 'no' for flag in flags] + [translated])
+        yield buffer.pop()
@@ -0,0 +1,201 @@
+import hashlib
+import re
+import struct
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import Email, EmailTranslation, TranslationSignature
+
+'''
+Near-duplicate translations.
+
+Comparing every translation with every other one costs n² comparisons.
+Instead each translation gets a MinHash signature once: its content is cut
+into overlapping runs of SHINGLE_WORDS words (shingles), and for each of
+NUM_HASHES hash functions the signature keeps the smallest hash of any
+shingle.  Two signatures agree in about the same share of places as the two
+shingle sets overlap (their Jaccard similarity).
+
+Locality-sensitive hashing then finds the pairs worth comparing: the
+signature is cut into bands of `rows` values, and translations with an
+identical band land in the same bucket.  Similar translations share a bucket
+in at least one band with high probability, different ones rarely do, so the
+work grows with the number of translations rather than the number of pairs.
+Candidates are checked against the threshold and joined into groups.
+
+Signatures are stored in TranslationSignature.  reindex() signs the
+translations saved since they were last signed (their updated_at moved on),
+so re-running the find_duplicates command only signs what changed.
+'''
+
+NUM_HASHES = 128
+SHINGLE_WORDS = 3
+THRESHOLD = 0.8
+# A pair at the threshold becomes a candidate with at least this probability
+RECALL = 0.95
+BATCH_SIZE = 1000
+# Groups shown on the report page
+REPORT_GROUPS = 100
+WORDS = re.compile(r'\w+')
+SIGNATURE = struct.Struct('<%dI' % NUM_HASHES)
+# One XOR mask per hash function; XOR with a random mask permutes the 64-bit shingle hashes
+MASKS = [int.from_bytes(hashlib.blake2b(b'minhash %d' % i, digest_size=8).digest(), 'big')
+    for i in range(NUM_HASHES)]
+
+DuplicateGroup = namedtuple('DuplicateGroup', 'language similarity keep others')
+
+
+def shingles(text):
+    words = WORDS.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(text):
+    '''
+    The packed signature of text, b'' if it has no words.
+    '''
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in shingles(text)]
+    if not hashes:
+        return b''
+    # The top 32 bits of each minimum are plenty to tell minimums apart
+    return SIGNATURE.pack(*[min([h ^ mask for h in hashes]) >> 32 for mask in MASKS])
+
+
+def similarity(a, b):
+    '''
+    Estimated Jaccard similarity of the texts behind two signatures.
+    '''
+    return sum(x == y for x, y in zip(SIGNATURE.unpack(a), SIGNATURE.unpack(b))) / NUM_HASHES
+
+
+def lsh_rows(threshold):
+    '''
+    Signature values per band: the most that still makes a pair at the
+    threshold a candidate with probability RECALL.  More rows per band
+    means fewer candidates to check.
+    '''
+    rows = 1
+    for r in range(1, NUM_HASHES + 1):
+        bands = NUM_HASHES // r
+        if 1 - (1 - threshold ** r) ** bands >= RECALL:
+            rows = r
+    return rows
+
+
+def threshold_setting():
+    return getattr(settings, 'DUPLICATE_THRESHOLD', THRESHOLD)
+
+
+# Signing
+
+def stale():
+    '''
+    Translations that have no signature or were saved after it was made.
+    '''
+    return EmailTranslation.objects.filter(
+        Q(signature__isnull=True) | Q(signature__updated_at__lt=F('updated_at')))
+
+
+def reindex(full=False, batch_size=BATCH_SIZE):
+    '''
+    Signs the stale translations, or all of them if full.  Returns how many were signed.
+    '''
+    if full:
+        TranslationSignature.objects.all().delete()
+    translations = stale().only('id', 'language', 'content', 'updated_at').order_by('pk')
+    signed = 0
+    last_pk = 0
+    while True:
+        batch = list(translations.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return signed
+        with transaction.atomic():
+            TranslationSignature.objects.filter(translation__in=batch).delete()
+            TranslationSignature.objects.bulk_create([
+                TranslationSignature(translation_id=translation.pk, language=translation.language,
+                    minhash=minhash(translation.content), updated_at=translation.updated_at)
+                for translation in batch])
+        signed += len(batch)
+        last_pk = batch[-1].pk
+
+
+# Grouping
+
+def find_groups(language, threshold=None):
+    '''
+    [(similarity, [translation ids])] of the groups of near-duplicate
+    translations in language, biggest first.  similarity is the lowest
+    estimate between a member and the first one.
+    '''
+    threshold = threshold or threshold_setting()
+    rows = lsh_rows(threshold)
+    width = rows * SIGNATURE.size // NUM_HASHES
+    signatures = {pk: bytes(signature) for pk, signature in TranslationSignature.objects
+        .filter(language=language, translation__email__isnull=False).exclude(minhash=b'')
+        .values_list('translation_id', 'minhash').iterator()}
+
+    parent = {}
+
+    def find(pk):
+        root = pk
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while pk != root:
+            parent[pk], pk = root, parent[pk]
+        return root
+
+    # One band at a time, so only one band's buckets are in memory
+    for band in range(NUM_HASHES // rows):
+        buckets = defaultdict(list)
+        for pk, signature in signatures.items():
+            buckets[signature[band * width:(band + 1) * width]].append(pk)
+        for members in buckets.values():
+            # Join everything close enough to the first member, then start
+            # again from the first one left over
+            while len(members) > 1:
+                first, rest = members[0], []
+                for pk in members[1:]:
+                    if find(pk) == find(first):
+                        continue
+                    if similarity(signatures[first], signatures[pk]) >= threshold:
+                        parent[find(pk)] = find(first)
+                    else:
+                        rest.append(pk)
+                members = rest
+
+    groups = defaultdict(list)
+    for pk in parent:
+        groups[find(pk)].append(pk)
+    result = []
+    for root, members in groups.items():
+        members = sorted(set(members) | {root})
+        lowest = min(similarity(signatures[members[0]], signatures[pk]) for pk in members[1:])
+        result.append((lowest, members))
+    result.sort(key=lambda group: (-len(group[1]), -group[0], group[1][0]))
+    return result
+
+
+def suggest(language, groups):
+    '''
+    DuplicateGroups for find_groups() results, in two queries.  The
+    translation to keep is the one whose email has the most translations,
+    then the oldest; the others could be merged into it.
+    '''
+    ids = [pk for similarity, members in groups for pk in members]
+    translations = EmailTranslation.objects.select_related('email__category').in_bulk(ids)
+    sizes = dict(Email.objects.filter(pk__in={t.email_id for t in translations.values()}).order_by()
+        .annotate(n=Count('emailtranslation')).values_list('pk', 'n'))
+    result = []
+    for estimate, members in groups:
+        members = [translations[pk] for pk in members if pk in translations]
+        if len(members) < 2:
+            continue
+        members.sort(key=lambda t: (-sizes.get(t.email_id, 0), t.email.created_at, t.email_id))
+        result.append(DuplicateGroup(language, estimate, members[0], members[1:]))
+    return result
@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import zipfile
+
+from .importer import CSV_FIELDS
+from .models import Category, Email, EmailTranslation
+
+'''
+Streaming export of the whole catalog, used by the export view and the
+export_emails command.  Each generator yields bytes as soon as it has them.
+
+Rows are read in primary key ranges of chunk_size with one joined query per
+range, so memory stays bounded even on MySQL, where the driver reads a whole
+result set into memory before Django sees the first row.  The CSV and JSONL
+formats can be read back by import_emails.
+'''
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'zip': ('application/zip', 'zip'),
+}
+
+
+def pk_ranges(queryset, chunk_size):
+    '''
+    Yields (after, up_to) so that queryset.filter(pk__gt=after, pk__lte=up_to)
+    walks the queryset chunk_size rows at a time.  up_to is None for the last range.
+    '''
+    after = 0
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        up_to = pks.filter(pk__gt=after)[chunk_size - 1:chunk_size].first()
+        yield after, up_to
+        if up_to is None:
+            return
+        after = up_to
+
+
+def in_range(queryset, after, up_to, field='pk'):
+    queryset = queryset.filter(**{field + '__gt': after})
+    if up_to is not None:
+        queryset = queryset.filter(**{field + '__lte': up_to})
+    return queryset
+
+
+class Buffer:
+    '''
+    Write-only file object that hands back what was written since the last pop().
+    Having no seek() makes zipfile write a streamable archive.
+    '''
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def email_rows(chunk_size=CHUNK_SIZE):
+    '''
+    Yields (email id, category, name_eng, name_esp, language, content) for every
+    translation, and one row with language and content None for emails without any.
+    '''
+    rows = Email.objects.order_by('pk', 'emailtranslation__pk').values_list(
+        'pk', 'category__name', 'name_eng', 'name_esp', 'emailtranslation__language', 'emailtranslation__content')
+    for after, up_to in pk_ranges(Email.objects.all(), chunk_size):
+        yield from in_range(rows, after, up_to).iterator(chunk_size=chunk_size)
+
+
+def export_csv(chunk_size=CHUNK_SIZE):
+    buffer = Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for count, (pk, category, name_eng, name_esp, language, content) in enumerate(email_rows(chunk_size), start=1):
+        writer.writerow([category or '', name_eng, name_esp, language or '', content or ''])
+        if count % chunk_size == 0:
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def export_jsonl(chunk_size=CHUNK_SIZE):
+    buffer = Buffer()
+    for after, up_to in pk_ranges(Category.objects.all(), chunk_size):
+        for name in in_range(Category.objects.order_by('pk'), after, up_to).values_list('name', flat=True):
+            buffer.write(json.dumps({'category': name}) + '\n')
+        yield buffer.pop()
+
+    current = None
+    count = 0
+    for pk, category, name_eng, name_esp, language, content in email_rows(chunk_size):
+        if current is None or current['id'] != pk:
+            if current is not None:
+                buffer.write(json.dumps(current) + '\n')
+            current = {'id': pk, 'category': category, 'name_eng': name_eng, 'name_esp': name_esp, 'translations': []}
+        if content is not None:
+            current['translations'].append({'language': language, 'content': content})
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.pop()
+    if current is not None:
+        buffer.write(json.dumps(current) + '\n')
+    yield buffer.pop()
+
+
+def export_zip(chunk_size=CHUNK_SIZE):
+    '''
+    A zip with one CSV per language, in the import_emails format.
+    '''
+    buffer = Buffer()
+    translations = EmailTranslation.objects.filter(email__isnull=False).order_by('pk').values_list(
+        'email__category__name', 'email__name_eng', 'email__name_esp', 'content')
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for language, name in EmailTranslation.LANGUAGES:
+            in_language = EmailTranslation.objects.filter(email__isnull=False, language=language)
+            with archive.open('%s-%s.csv' % (language, name.lower()), 'w') as entry:
+                text = io.TextIOWrapper(entry, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                writer.writerow(CSV_FIELDS)
+                for after, up_to in pk_ranges(in_language, chunk_size):
+                    rows = in_range(translations.filter(language=language), after, up_to)
+                    for category, name_eng, name_esp, content in rows.iterator(chunk_size=chunk_size):
+                        writer.writerow([category or '', name_eng, name_esp, language, content])
+                    text.flush()
+                    yield buffer.pop()
+                text.flush()
+                text.detach()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def export(file_format, chunk_size=CHUNK_SIZE):
+    return {
+        'csv': export_csv,
+        'jsonl': export_jsonl,
+        'zip': export_zip,
+    }[file_format](chunk_size)
@@ -1,10 +1,175 @@
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.forms import ModelForm
-from django.forms.models import inlineformset_factory
+from django.forms.models import BaseInlineFormSet, inlineformset_factory
 
-from .models import Email
+from .bulk import bulk_create, bulk_delete, bulk_update
+from .merge import validate_placeholders
+from .models import Email, EmailTranslation, Category
+from .signals import send_bulk_saved
 
 class EmailForm(ModelForm):
 	class Meta:
 		model = Email
 		fields = '__all__'
 
+class LoadedObjectField(forms.ModelChoiceField):
+	'''
+	Hidden id field of a model formset form.  Finds the object among the ones the
+	formset has already loaded, where the default field runs a query per form.
+	'''
+	def __init__(self, formset, *args, **kwargs):
+		self.formset = formset
+		super().__init__(*args, **kwargs)
+
+	def to_python(self, value):
+		if value in self.empty_values:
+			return None
+		try:
+			obj = self.formset._existing_object(self.formset.model._meta.pk.to_python(value))
+		except ValidationError:
+			obj = None
+		if obj is None:
+			raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+		return obj
+
+class EmailTranslationForm(ModelForm):
+	def validate_unique(self):
+		# BaseEmailTranslationFormSet checks the languages of all the forms at
+		# once instead of one query per form
+		pass
+
+class BaseEmailTranslationFormSet(BaseInlineFormSet):
+	def validate_unique(self):
+		'''
+		Every translation of the email is a form in the formset, so languages
+		that are used twice can be found without asking the database.
+		'''
+		forms_by_language = {}
+		for form in self.forms:
+			if not form.is_valid() or form in self.deleted_forms:
+				continue
+			if form.instance.pk is None and not form.has_changed():
+				continue
+			forms_by_language.setdefault(form.cleaned_data.get('language'), []).append(form)
+		names = dict(EmailTranslation.LANGUAGES)
+		errors = []
+		for language, forms in forms_by_language.items():
+			if len(forms) < 2:
+				continue
+			message = 'There is already a %s translation.' % names.get(language, 'Unspecified')
+			for form in forms[1:]:
+				form.add_error('language', message)
+			errors.append(ValidationError(
+				'There is more than one %(language)s translation.',
+				code='unique_language',
+				params={'language': names.get(language, 'Unspecified')},
+			))
+		if errors:
+			raise ValidationError(errors)
+
+	def add_fields(self, form, index):
+		super().add_fields(form, index)
+		name = self.model._meta.pk.name
+		field = form.fields[name]
+		form.fields[name] = LoadedObjectField(self, field.queryset, initial=field.initial,
+			required=False, widget=field.widget)
+
+	def save_translations(self):
+		'''
+		Save only the translations that were added, changed or deleted, with one
+		query each for the inserts, updates and deletes, in a single transaction.
+		Returns (created, updated, deleted).
+		'''
+		# commit=False sorts the forms into new/changed/deleted without writing anything
+		self.save(commit=False)
+		created = list(self.new_objects)
+		updated = [translation for translation, changed_fields in self.changed_objects]
+		moved = [translation for translation, changed_fields in self.changed_objects if 'language' in changed_fields]
+		deleted = list(self.deleted_objects)
+		for translation in created + updated:
+			translation.email = self.instance
+			translation.render_content()
+
+		with transaction.atomic():
+			# Deletes first, so a language can be removed and added again in one save
+			bulk_delete(EmailTranslation, deleted)
+			if len(moved) > 1:
+				# Translations can swap languages, which the unique index checks row
+				# by row; park them on codes no language uses before the real update
+				languages = [translation.language for translation in moved]
+				for i, translation in enumerate(moved):
+					translation.language = '%02d' % i
+				EmailTranslation.objects.bulk_update(moved, ['language'])
+				for translation, language in zip(moved, languages):
+					translation.language = language
+			if updated:
+				bulk_update(EmailTranslation, updated, ['language', 'content', 'content_html', 'placeholders'])
+			if created:
+				created = bulk_create(EmailTranslation, created, email=self.instance)
+			send_bulk_saved(EmailTranslation, created=created, updated=updated)
+		return created, updated, deleted
+
+EmailTranslationFormSet = inlineformset_factory(
+	Email,
+	EmailTranslation,
+	form=EmailTranslationForm,
+	formset=BaseEmailTranslationFormSet,
+	fields=('language', 'content',)
+	)
+
+class EmailTranslationContentForm(ModelForm):
+	'''
+	Edits the content of one translation; the email and language come from the URL.
+	'''
+	class Meta:
+		model = EmailTranslation
+		fields = ('content',)
+		widgets = {'content': forms.Textarea(attrs={'rows': 6, 'class': 'form-control'})}
+
+class EmailFilterForm(forms.Form):
+	name = forms.CharField(required=False, max_length=100)
+	category = forms.ModelChoiceField(
+		queryset=Category.objects.order_by('name'),
+		required=False,
+		empty_label='All categories'
+		)
+
+class CoverageFilterForm(forms.Form):
+	category = forms.ModelChoiceField(
+		queryset=Category.objects.order_by('name'),
+		required=False,
+		empty_label='All categories'
+		)
+	missing = forms.BooleanField(label='Only emails missing a language', required=False)
+
+class DuplicatesForm(forms.Form):
+	language = forms.ChoiceField(choices=EmailTranslation.LANGUAGES)
+	threshold = forms.FloatField(
+		label='Similarity',
+		min_value=0.5,
+		max_value=1.0,
+		required=False,
+		widget=forms.NumberInput(attrs={'step': '0.05', 'class': 'form-control ml-2'})
+		)
+
+class SearchForm(forms.Form):
+	q = forms.CharField(label='Search', max_length=200)
+	lang = forms.ChoiceField(
+		label='Language',
+		choices=(('', 'All languages'),) + EmailTranslation.LANGUAGES,
+		required=False
+		)
+
+class SendEmailForm(forms.Form):
+	translation = forms.TypedChoiceField(label='Language', coerce=int)
+	subject = forms.CharField(max_length=255, validators=[validate_placeholders],
+		help_text='Can use the same {{ placeholders }} as the email.')
+	recipients = forms.FileField(
+		help_text='A CSV file with an "email" column and a column for each placeholder.')
+
+	def __init__(self, translations, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.fields['translation'].choices = [(translation.pk, translation.get_language_display())
+			for translation in translations]
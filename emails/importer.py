@@ -0,0 +1,257 @@
+import csv
+import json
+import time
+
+from django.db import transaction
+
+from .bulk import bulk_create, bulk_update
+from .models import Category, Email, EmailTranslation
+from .signals import send_bulk_saved
+
+'''
+Bulk import of categories, emails and translations, used by the import_emails command.
+
+Input is read one record at a time and written in batches, so memory use
+depends on the batch size and not on the size of the file.  A record is a
+dict with these keys (CSV files use them as column names):
+
+    category    category name, created if it doesn't exist
+    name_eng    email name in English (records without one only create the category)
+    name_esp    email name in Spanish
+    language    translation language code, eg. FR
+    content     translation text
+
+JSONL records may instead give a list of {"language", "content"} objects
+as "translations".  Records with the same name_eng in one batch are merged.
+'''
+
+CSV_FIELDS = ('category', 'name_eng', 'name_esp', 'language', 'content')
+LANGUAGE_CODES = {code for code, name in EmailTranslation.LANGUAGES}
+NAME_MAX_LENGTH = Email._meta.get_field('name_eng').max_length
+CONTENT_MAX_LENGTH = EmailTranslation._meta.get_field('content').max_length
+MAX_REPORTED_ERRORS = 20
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None or 'name_eng' not in reader.fieldnames:
+        raise InvalidRecord('The CSV header must include the columns: %s' % ', '.join(CSV_FIELDS))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, InvalidRecord('Invalid JSON: %s' % e)
+
+
+def clean_record(data):
+    if isinstance(data, InvalidRecord):
+        raise data
+    if not isinstance(data, dict):
+        raise InvalidRecord('Expected an object.')
+
+    def text(key):
+        value = data.get(key)
+        return '' if value is None else str(value).strip()
+
+    record = {
+        'category': text('category'),
+        'name_eng': text('name_eng'),
+        'name_esp': text('name_esp'),
+        'translations': [],
+    }
+    if not record['name_eng']:
+        if not record['category']:
+            raise InvalidRecord('name_eng is required.')
+        return record
+    for key in ('category', 'name_eng', 'name_esp'):
+        if len(record[key]) > NAME_MAX_LENGTH:
+            raise InvalidRecord('%s is longer than %d characters.' % (key, NAME_MAX_LENGTH))
+
+    translations = data.get('translations')
+    if translations is None:
+        translations = [data] if data.get('content') else []
+    elif not isinstance(translations, list):
+        raise InvalidRecord('translations must be a list.')
+    for translation in translations:
+        if not isinstance(translation, dict):
+            raise InvalidRecord('Each translation must be an object.')
+        language = str(translation.get('language') or 'EN').strip().upper()
+        content = str(translation.get('content') or '')
+        if language not in LANGUAGE_CODES:
+            raise InvalidRecord('Unknown language %r.' % language)
+        if not content:
+            raise InvalidRecord('Translation content is empty.')
+        if len(content) > CONTENT_MAX_LENGTH:
+            raise InvalidRecord('content is longer than %d characters.' % CONTENT_MAX_LENGTH)
+        record['translations'].append((language, content))
+    return record
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.errors = []
+        self.categories_created = 0
+        self.emails_created = 0
+        self.emails_updated = 0
+        self.translations_created = 0
+        self.translations_updated = 0
+        self.translations_unchanged = 0
+        self.started = time.monotonic()
+        self.elapsed = 0
+
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+
+class EmailImporter:
+    '''
+    With upsert=True, emails are matched to existing ones by name_eng and
+    their translations are created or updated by language; otherwise every
+    email in the input is created.  With dry_run=True each batch is rolled
+    back after it is written.
+    '''
+    def __init__(self, batch_size=1000, upsert=False, dry_run=False):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.dry_run = dry_run
+        self.category_ids = {}
+        self.stats = ImportStats()
+
+    def run(self, rows, progress=None):
+        '''
+        rows is an iterable of (line number, data) as produced by read_csv/read_jsonl.
+        progress, if given, is called with the stats after each batch.
+        '''
+        batch = []
+        for line_number, data in rows:
+            self.stats.rows += 1
+            try:
+                batch.append(clean_record(data))
+            except InvalidRecord as e:
+                self.stats.skipped += 1
+                if len(self.stats.errors) < MAX_REPORTED_ERRORS:
+                    self.stats.errors.append((line_number, str(e)))
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+                if progress:
+                    progress(self.stats)
+        if batch:
+            self.write_batch(batch)
+        self.stats.elapsed = time.monotonic() - self.stats.started
+        return self.stats
+
+    def write_batch(self, batch):
+        with transaction.atomic():
+            self.write_categories({record['category'] for record in batch if record['category']})
+            self.write_emails(batch)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+    def write_categories(self, names):
+        missing = [name for name in names if name not in self.category_ids]
+        if not missing:
+            return
+        for pk, name in Category.objects.filter(name__in=missing).order_by('-pk').values_list('pk', 'name'):
+            self.category_ids[name] = pk
+        to_create = [Category(name=name) for name in missing if name not in self.category_ids]
+        if not to_create:
+            return
+        created = bulk_create(Category, to_create, self.batch_size,
+            name__in=[category.name for category in to_create])
+        self.stats.categories_created += len(created)
+        for category in created:
+            # In a dry run the category is rolled back with the batch
+            self.category_ids[category.name] = None if self.dry_run else category.pk
+        send_bulk_saved(Category, created=created)
+
+    def write_emails(self, batch):
+        merged = {}
+        for record in batch:
+            if not record['name_eng']:
+                continue
+            email = merged.setdefault(record['name_eng'], {'name_esp': '', 'category': '', 'translations': {}})
+            email['name_esp'] = record['name_esp'] or email['name_esp']
+            email['category'] = record['category'] or email['category']
+            email['translations'].update(record['translations'])
+        if not merged:
+            return
+
+        existing = {}
+        if self.upsert:
+            for email in Email.objects.filter(name_eng__in=list(merged)).order_by('-pk'):
+                existing[email.name_eng] = email
+
+        to_create, updated = [], []
+        for name, values in merged.items():
+            category_id = self.category_ids.get(values['category']) if values['category'] else None
+            email = existing.get(name)
+            if email is None:
+                to_create.append(Email(name_eng=name, name_esp=values['name_esp'], category_id=category_id))
+                continue
+            # Blank fields leave an existing email as it is
+            name_esp = values['name_esp'] or email.name_esp
+            category_id = category_id if values['category'] else email.category_id
+            if (name_esp, category_id) != (email.name_esp, email.category_id):
+                email.name_esp, email.category_id = name_esp, category_id
+                updated.append(email)
+
+        created = []
+        if to_create:
+            created = bulk_create(Email, to_create, self.batch_size,
+                name_eng__in=[email.name_eng for email in to_create])
+        if updated:
+            bulk_update(Email, updated, ['name_esp', 'category'], self.batch_size)
+        self.stats.emails_created += len(created)
+        self.stats.emails_updated += len(updated)
+        send_bulk_saved(Email, created=created, updated=updated)
+
+        emails = {email.name_eng: email for email in list(existing.values()) + created}
+        self.write_translations(merged, emails)
+
+    def write_translations(self, merged, emails):
+        existing = {}
+        if self.upsert:
+            email_ids = [email.pk for name, email in emails.items() if merged[name]['translations']]
+            for translation in EmailTranslation.objects.filter(email_id__in=email_ids).order_by('-pk'):
+                existing[(translation.email_id, translation.language)] = translation
+
+        to_create, updated = [], []
+        for name, values in merged.items():
+            email_id = emails[name].pk
+            for language, content in values['translations'].items():
+                translation = existing.get((email_id, language))
+                if translation is None:
+                    translation = EmailTranslation(email_id=email_id, language=language, content=content)
+                    translation.render_content()
+                    to_create.append(translation)
+                elif translation.content != content:
+                    translation.content = content
+                    translation.render_content()
+                    updated.append(translation)
+                else:
+                    self.stats.translations_unchanged += 1
+
+        created = []
+        if to_create:
+            created = bulk_create(EmailTranslation, to_create, self.batch_size,
+                email_id__in={translation.email_id for translation in to_create})
+        if updated:
+            bulk_update(EmailTranslation, updated, ['content', 'content_html', 'placeholders'], self.batch_size)
+        self.stats.translations_created += len(created)
+        self.stats.translations_updated += len(updated)
+        send_bulk_saved(EmailTranslation, created=created, updated=updated)
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from emails import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Time every view and the email saves against seeded catalogs of several sizes, '
+        'on a throwaway test database, and compare the results with a saved baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(benchmark.DEFAULT_SIZES),
+            help='Comma separated catalog sizes, CATEGORIESxEMAILSxLANGUAGES, eg. 10x50x6 for 500 emails.')
+        parser.add_argument('--repeat', type=int, default=benchmark.REPEAT,
+            help='Requests per view and size.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline',
+            help='JSON file with earlier results to compare with.')
+        parser.add_argument('--save-baseline',
+            help='Write the results to this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=benchmark.TOLERANCE,
+            help='How much slower than the baseline a view may get, eg. 0.25 for 25%%.')
+        parser.add_argument('--fail-on-regression', action='store_true',
+            help='Exit with an error if any view regressed.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Delete a leftover test database without asking.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        try:
+            for size in sizes:
+                benchmark.parse_size(size)
+        except ValueError as e:
+            raise CommandError(e)
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = benchmark.load(options['baseline'])
+            except (OSError, ValueError) as e:
+                raise CommandError(e)
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'])
+        try:
+            results = benchmark.run(sizes, options['repeat'], options['seed'], progress=self.progress)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        if options['save_baseline']:
+            benchmark.save(results, options['save_baseline'])
+            self.stdout.write(self.style.SUCCESS('Saved the results to %s.' % options['save_baseline']))
+        if baseline is not None:
+            regressions = benchmark.compare(results, baseline, options['tolerance'])
+            for size, view, what, before, after in regressions:
+                self.stdout.write(self.style.WARNING('%s %s: %s went from %s to %s' % (size, view, what, before, after)))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS('No regressions against %s.' % options['baseline']))
+            elif options['fail_on_regression']:
+                raise CommandError('%d regressions against %s.' % (len(regressions), options['baseline']))
+
+    def progress(self, message):
+        if self.verbosity >= 2:
+            self.stdout.write(message)
+
+    def report(self, results):
+        for size, result in results.items():
+            self.stdout.write('\n%s: %d emails, seeded in %.1fs' % (size, result['emails'], result['seconds_to_seed']))
+            self.stdout.write('%-24s %10s %10s %8s' % ('view', 'median ms', 'max ms', 'queries'))
+            for view, numbers in result['views'].items():
+                self.stdout.write('%-24s %10.1f %10.1f %8d' % (
+                    view, numbers['median_ms'], numbers['max_ms'], numbers['queries']))
@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emails import exporter
+
+
+class Command(BaseCommand):
+    help = 'Export every category, email and translation as CSV, JSONL or a zip with one CSV per language.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exporter.FORMATS), default='jsonl')
+        parser.add_argument('-o', '--output', default='-',
+            help='File to write, or - for standard output.')
+        parser.add_argument('--chunk-size', type=int, default=exporter.CHUNK_SIZE,
+            help='Rows read per query.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        if options['output'] == '-':
+            if options['format'] == 'zip' and sys.stdout.isatty():
+                raise CommandError('Use --output to write the zip to a file.')
+            output = sys.stdout.buffer
+        else:
+            try:
+                output = open(options['output'], 'wb')
+            except OSError as e:
+                raise CommandError(e)
+
+        size = 0
+        try:
+            for data in exporter.export(options['format'], options['chunk_size']):
+                output.write(data)
+                size += len(data)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS('Wrote %d bytes to %s.' % (size, options['output'])))
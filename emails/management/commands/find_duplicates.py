@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from emails import duplicates
+from emails.models import EmailTranslation
+
+
+class Command(BaseCommand):
+    help = ('Sign the translations changed since the last run and list groups of near-duplicate '
+        'translations in each language, with the one to keep first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float,
+            help='How alike translations must be, from 0.5 to 1 (default DUPLICATE_THRESHOLD, 0.8).')
+        parser.add_argument('--language', action='append', choices=[code for code, name in EmailTranslation.LANGUAGES],
+            help='Only this language (can be repeated).')
+        parser.add_argument('--full', action='store_true',
+            help='Sign every translation again, not just the changed ones.')
+        parser.add_argument('--reindex-only', action='store_true',
+            help="Only sign the changed translations, don't list duplicates.")
+
+    def handle(self, *args, **options):
+        threshold = options['threshold'] or duplicates.threshold_setting()
+        if not 0.5 <= threshold <= 1:
+            raise CommandError('--threshold must be between 0.5 and 1.')
+        signed = duplicates.reindex(full=options['full'])
+        self.stdout.write('Signed %d translations.' % signed)
+        if options['reindex_only']:
+            return
+
+        total = 0
+        for language in options['language'] or [code for code, name in EmailTranslation.LANGUAGES]:
+            for group in duplicates.suggest(language, duplicates.find_groups(language, threshold)):
+                total += 1
+                self.stdout.write('%s %d%% keep #%d %s' % (
+                    language, round(group.similarity * 100), group.keep.email_id, group.keep.email))
+                for translation in group.others:
+                    self.stdout.write('    merge #%d %s' % (translation.email_id, translation.email))
+        self.stdout.write(self.style.SUCCESS('%d groups of near-duplicates.' % total))
@@ -0,0 +1,76 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emails.importer import EmailImporter, InvalidRecord, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = ('Import categories, emails and translations from a CSV or JSONL file. '
+        'CSV columns: category, name_eng, name_esp, language, content (one translation per row).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for standard input.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+            help='Input format. Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Records written per transaction.')
+        parser.add_argument('--upsert', action='store_true',
+            help='Update emails that already exist with the same English name instead of adding new ones.')
+        parser.add_argument('--dry-run', action='store_true',
+            help='Validate and write everything, then roll it back.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        path = options['path']
+        file_format = options['format']
+        if file_format is None:
+            if path.endswith('.csv'):
+                file_format = 'csv'
+            elif path.endswith('.jsonl') or path.endswith('.json'):
+                file_format = 'jsonl'
+            else:
+                raise CommandError('Use --format to say whether the input is csv or jsonl.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        # utf-8-sig drops the byte order mark Excel starts its CSV files with,
+        # which would otherwise stick to the first column's name
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        else:
+            try:
+                stream = open(path, encoding='utf-8-sig', newline='')
+            except OSError as e:
+                raise CommandError(e)
+
+        importer = EmailImporter(
+            batch_size=options['batch_size'],
+            upsert=options['upsert'],
+            dry_run=options['dry_run'],
+        )
+        reader = read_csv if file_format == 'csv' else read_jsonl
+        try:
+            with stream:
+                stats = importer.run(reader(stream), progress=self.progress)
+        except InvalidRecord as e:
+            raise CommandError(e)
+
+        for line_number, message in stats.errors:
+            self.stderr.write('Line %d skipped: %s' % (line_number, message))
+        if stats.skipped > len(stats.errors):
+            self.stderr.write('... and %d more skipped lines.' % (stats.skipped - len(stats.errors)))
+
+        summary = ('%d rows in %.1fs (%.0f rows/s): %d categories, %d emails and %d translations created, '
+            '%d emails and %d translations updated, %d translations unchanged, %d rows skipped.') % (
+            stats.rows, stats.elapsed, stats.rows_per_second(),
+            stats.categories_created, stats.emails_created, stats.translations_created,
+            stats.emails_updated, stats.translations_updated, stats.translations_unchanged, stats.skipped)
+        if options['dry_run']:
+            summary = 'Dry run, nothing was saved. ' + summary
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def progress(self, stats):
+        if self.verbosity >= 2:
+            self.stdout.write('%d rows read' % stats.rows)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emails import merge
+from emails.models import EmailTranslation
+
+
+class Command(BaseCommand):
+    help = 'Render a translation once per recipient in a CSV, JSON or JSON lines file, as JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email_id', type=int)
+        parser.add_argument('language', help='Language code, eg. FR.')
+        parser.add_argument('recipients', help='File of recipients, or - for standard input.')
+        parser.add_argument('--format', choices=sorted(merge.READERS),
+            help='Format of the recipients file; taken from its extension by default.')
+        parser.add_argument('-o', '--output', default='-',
+            help='File to write, or - for standard output.')
+
+    def handle(self, *args, **options):
+        language = options['language'].upper()
+        translation = EmailTranslation.objects.filter(email_id=options['email_id'], language=language).first()
+        if translation is None:
+            raise CommandError('Email %s has no %s translation.' % (options['email_id'], language))
+        file_format = options['format'] or os.path.splitext(options['recipients'])[1].lstrip('.').lower()
+        if file_format not in merge.READERS:
+            raise CommandError('Use --format to say whether the recipients are csv, json or jsonl.')
+
+        try:
+            recipients = sys.stdin.buffer if options['recipients'] == '-' else open(options['recipients'], 'rb')
+            output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        except OSError as e:
+            raise CommandError(e)
+
+        template = merge.compiled(translation)
+        try:
+            for data in merge.render_stream(template, merge.READERS[file_format](recipients)):
+                output.write(data)
+        finally:
+            for f in (recipients, output):
+                if f not in (sys.stdin.buffer, sys.stdout.buffer):
+                    f.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS('Wrote %s.' % options['output']))
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from emails import revisions
+
+
+class Command(BaseCommand):
+    help = 'Delete old revisions of translation content, keeping the latest few of each email and language.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+            help='Delete revisions older than this many days.')
+        parser.add_argument('--keep', type=int, default=10,
+            help='Revisions of each email and language kept however old they are.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['keep'] < 1:
+            raise CommandError('--days must be at least 0 and --keep at least 1.')
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = revisions.prune(before, options['keep'])
+        self.stdout.write(self.style.SUCCESS('Deleted %d revisions.' % deleted))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from emails import querystats
+
+
+class Command(BaseCommand):
+    help = 'Show the queries and time per view recorded by QueryStatsMiddleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', default='queries',
+            choices=('queries', 'max_queries', 'db_time', 'total_time', 'requests'),
+            help='Sort by this total, largest first.')
+        parser.add_argument('--reset', action='store_true',
+            help='Delete the recorded stats after showing them.')
+
+    def handle(self, *args, **options):
+        stats = querystats.view_stats('-' + options['order'])
+        if not stats:
+            self.stdout.write('Nothing recorded yet.')
+        else:
+            self.stdout.write('%-30s %9s %10s %8s %8s %10s %10s' % (
+                'view', 'requests', 'queries', 'avg', 'max', 'db ms', 'total ms'))
+        for row in stats:
+            self.stdout.write('%-30s %9d %10d %8.1f %8d %10.1f %10.1f' % (
+                row.url_name, row.requests, row.queries, row.avg_queries, row.max_queries,
+                row.avg_db_ms, row.avg_total_ms))
+        if options['reset']:
+            querystats.reset()
+            self.stdout.write(self.style.SUCCESS('Stats reset.'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from emails import search
+
+
+class Command(BaseCommand):
+    help = 'Create the full-text search indexes if missing and re-index every email and translation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        search.ensure_index()
+        if not search.keeps_own_index():
+            self.stdout.write(self.style.SUCCESS('The database maintains the full-text indexes itself.'))
+            return
+        with transaction.atomic():
+            count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed %d emails and translations.' % count))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from emails import counters
+
+
+class Command(BaseCommand):
+    help = 'Recount emails and translations and repair any dashboard counters that have drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+            help='Report drift without changing anything.')
+
+    def handle(self, *args, **options):
+        drift = counters.reconcile(dry_run=options['dry_run'])
+        for scope, key, stored, actual in drift:
+            self.stdout.write('%s:%s stored %s, actual %s' % (scope, key, stored, actual))
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('All counters are correct.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING('%d counters have drifted.' % len(drift)))
+        else:
+            self.stdout.write(self.style.SUCCESS('Repaired %d counters.' % len(drift)))
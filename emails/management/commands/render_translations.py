@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from emails.models import EmailTranslation
+
+
+class Command(BaseCommand):
+    help = 'Fill in the stored HTML and placeholders of translations that have no HTML (or, with --all, rebuild all of it).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+            help='Re-render every translation, eg. after changing how content is rendered.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        translations = EmailTranslation.objects.only('content', 'content_html', 'placeholders').order_by('pk')
+        if not options['all']:
+            translations = translations.filter(content_html='')
+
+        count = 0
+        last_pk = 0
+        while True:
+            # Walk the table by primary key so each batch is a short transaction
+            batch = list(translations.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            for translation in batch:
+                translation.render_content()
+            with transaction.atomic():
+                EmailTranslation.objects.bulk_update(batch, ['content_html', 'placeholders'])
+            count += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS('Rendered %d translations.' % count))
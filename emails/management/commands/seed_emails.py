@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from emails import seed
+
+
+class Command(BaseCommand):
+    help = ('Add a reproducible synthetic catalog: --categories categories with --emails '
+        'emails each, translated into --languages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--emails', type=int, default=100,
+            help='Emails per category.')
+        parser.add_argument('--languages', default=','.join(seed.LANGUAGE_CODES),
+            help='Comma separated language codes to translate every email into.')
+        parser.add_argument('--seed', type=int, default=0,
+            help='The same seed always gives the same catalog.')
+        parser.add_argument('--batch-size', type=int, default=500,
+            help='Emails written per transaction.')
+        parser.add_argument('--upsert', action='store_true',
+            help='Update emails that already exist instead of adding them again.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        languages = [code.strip().upper() for code in options['languages'].split(',') if code.strip()]
+        unknown = set(languages) - set(seed.LANGUAGE_CODES)
+        if unknown:
+            raise CommandError('Unknown languages: %s' % ', '.join(sorted(unknown)))
+        if options['categories'] < 1 or options['emails'] < 0:
+            raise CommandError('--categories must be at least 1 and --emails at least 0.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        stats = seed.seed_catalog(
+            categories=options['categories'],
+            emails=options['emails'],
+            languages=languages,
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            upsert=options['upsert'],
+            progress=self.progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            '%d categories, %d emails and %d translations created, %d translations updated in %.1fs.' % (
+            stats.categories_created, stats.emails_created, stats.translations_created,
+            stats.translations_updated, stats.elapsed)))
+
+    def progress(self, stats):
+        if self.verbosity >= 2:
+            self.stdout.write('%d records written' % stats.rows)
@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from emails import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails that are due, a batch at a time over one connection per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+            default=getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', outbox.BATCH_SIZE),
+            help='Messages claimed and sent per connection.')
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running, checking for due messages every --sleep seconds.')
+        parser.add_argument('--sleep', type=float, default=5)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        claimed_total = sent_total = 0
+        while True:
+            claimed, sent = outbox.send_due(options['batch_size'])
+            claimed_total += claimed
+            sent_total += sent
+            if claimed:
+                self.stdout.write('Sent %d of %d.' % (sent, claimed))
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+        failed = claimed_total - sent_total
+        self.stdout.write(self.style.SUCCESS('Sent %d emails.' % sent_total))
+        if failed:
+            self.stdout.write(self.style.WARNING('%d failed and will be retried later, or have been given up on.' % failed))
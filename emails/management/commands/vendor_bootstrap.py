@@ -0,0 +1,42 @@
+import base64
+import hashlib
+import os
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# The release the templates were written against, and the integrity hash the
+# CDN link had before the CSS was served from the app
+URL = 'https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/css/bootstrap.min.css'
+INTEGRITY = 'sha384-MCw98/SFnGE8fJT3GXwEOngsV7Zt27NXFoaoApmYm81iuXoPkFOJwJ8ERdknLPMO'
+OUTPUT = os.path.join(settings.BASE_DIR, 'emails', 'static', 'emails', 'css', 'bootstrap.css')
+
+
+def integrity(data):
+    return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode()
+
+
+class Command(BaseCommand):
+    help = 'Replace emails/css/bootstrap.css with Bootstrap 4.1.3, checked against its published sha384 hash.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-file', help='Use a bootstrap.min.css already downloaded instead of the CDN.')
+        parser.add_argument('-o', '--output', default=OUTPUT)
+
+    def handle(self, *args, **options):
+        if options['from_file']:
+            with open(options['from_file'], 'rb') as f:
+                data = f.read()
+        else:
+            try:
+                with urllib.request.urlopen(URL, timeout=30) as response:
+                    data = response.read()
+            except OSError as e:
+                raise CommandError('Could not download %s: %s' % (URL, e))
+        if integrity(data) != INTEGRITY:
+            raise CommandError('The file is not Bootstrap 4.1.3: its hash is %s, not %s.' % (integrity(data), INTEGRITY))
+        with open(options['output'], 'wb') as f:
+            f.write(data)
+        self.stdout.write(self.style.SUCCESS('Wrote %s (%d bytes). Run collectstatic to serve it.'
+            % (options['output'], len(data))))
@@ -0,0 +1,197 @@
+import codecs
+import csv
+import json
+import re
+import threading
+
+from django.core.exceptions import ValidationError
+
+'''
+Mail merge: personalised copies of a translation for a list of recipients.
+
+Translation content can hold placeholders, {{ first_name }}, with an optional
+fallback used when the recipient has no value (or an empty or null one),
+{{ first_name|there }}.  Names
+are letters, digits and underscores.  EmailTranslation.save() stores the names
+a translation uses (see placeholders()), and the content field rejects
+anything else between {{ and }}.
+
+Each translation is compiled once into a str.format_map() template, so
+rendering a recipient is one C-level format call.  compiled() keeps the
+templates of recent translations; signals.py forgets one when it is saved.
+
+Recipients are dicts, read from CSV (one column per placeholder), a JSON list
+or JSON lines.  render_stream() turns them into JSON lines:
+    {"row": 1, "content": "Hi Ana, ..."}
+    {"row": 2, "error": "Missing order_number."}
+'''
+
+PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|([^{}]*?)\s*)?\}\}')
+MAX_CACHED = 1000
+# Rows rendered per chunk of output
+CHUNK_ROWS = 500
+
+
+class MergeError(Exception):
+    pass
+
+
+def placeholders(text):
+    '''
+    The placeholder names in text, each once, in order of appearance.
+    '''
+    return list(dict.fromkeys(match.group(1) for match in PLACEHOLDER.finditer(text)))
+
+
+def validate_placeholders(text):
+    leftover = PLACEHOLDER.sub('', text)
+    if '{{' in leftover or '}}' in leftover:
+        bad = re.findall(r'\{\{[^}]{0,30}\}?\}?|\}\}', leftover)
+        raise ValidationError(
+            'Placeholders look like {{ first_name }} or {{ first_name|fallback }}. Check: %(bad)s',
+            code='invalid_placeholder', params={'bad': ', '.join(bad)})
+
+
+class MergeTemplate:
+    def __init__(self, text):
+        self.text = text
+        pieces = []
+        self.defaults = {}
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            literal = text[position:match.start()]
+            pieces.append(literal.replace('{', '{{').replace('}', '}}'))
+            name, default = match.groups()
+            pieces.append('{%s}' % name)
+            if default is not None:
+                self.defaults.setdefault(name, default)
+            position = match.end()
+        pieces.append(text[position:].replace('{', '{{').replace('}', '}}'))
+        self.format_map = ''.join(pieces).format_map
+        self.fields = placeholders(text)
+        self.required = [name for name in self.fields if name not in self.defaults]
+
+    def render(self, record):
+        '''
+        A None or empty value counts as missing: the placeholder's default is
+        used, and a placeholder without one is an error.
+        '''
+        values = {}
+        missing = []
+        for name in self.fields:
+            value = record.get(name)
+            if value is None or value == '':
+                if name not in self.defaults:
+                    missing.append(name)
+                    continue
+                value = self.defaults[name]
+            values[name] = value
+        if missing:
+            raise MergeError('Missing %s.' % ', '.join(missing))
+        return self.format_map(values)
+
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def compiled(translation):
+    '''
+    The MergeTemplate for translation, compiled the first time it is asked for.
+    '''
+    template = _compiled.get(translation.pk)
+    if template is None or template.text != translation.content:
+        template = MergeTemplate(translation.content)
+        with _lock:
+            if len(_compiled) >= MAX_CACHED:
+                _compiled.clear()
+            _compiled[translation.pk] = template
+    return template
+
+
+def forget(pk):
+    with _lock:
+        _compiled.pop(pk, None)
+
+
+# Recipients
+
+def read_csv(stream):
+    '''
+    stream yields lines of bytes or str; the first is the header.
+    '''
+    lines = iter(stream)
+    first = next(lines, None)
+    if first is None:
+        return
+    if isinstance(first, bytes):
+        lines = codecs.iterdecode(lines, 'utf-8')
+        first = first.decode('utf-8-sig')
+    # Short rows get '' for their last columns, which render() treats as missing
+    yield from csv.DictReader(_chain(first, lines), restval='')
+
+
+def read_json(stream):
+    data = json.load(stream)
+    if not isinstance(data, list):
+        raise MergeError('Expected a JSON list of recipients.')
+    yield from data
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_jsonl,
+}
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/json': 'json',
+    'application/x-ndjson': 'jsonl',
+}
+
+
+def render_rows(template, records):
+    '''
+    Yields a dict per record: {'row': n, 'content': text} or {'row': n, 'error': message}.
+    '''
+    render = template.render
+    for row, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            yield {'row': row, 'error': 'Expected an object of placeholder values.'}
+            continue
+        try:
+            yield {'row': row, 'content': render(record)}
+        except MergeError as e:
+            yield {'row': row, 'error': str(e)}
+
+
+def render_stream(template, records, chunk_rows=CHUNK_ROWS):
+    '''
+    render_rows() as JSON lines, chunk_rows rows per chunk of bytes.  A
+    recipient file that can't be read ends the stream with an error line.
+    '''
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    lines = []
+    try:
+        for result in render_rows(template, records):
+            lines.append(dumps(result))
+            if len(lines) >= chunk_rows:
+                lines.append('')
+                yield '\n'.join(lines).encode('utf-8')
+                lines = []
+    except (MergeError, ValueError, csv.Error) as e:
+        lines.append(dumps({'error': 'Could not read the recipients: %s' % e}))
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
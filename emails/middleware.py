@@ -0,0 +1,142 @@
+import asyncio
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+
+from . import querystats
+
+
+class QueryStatsMiddleware:
+    '''
+    Records queries, database time and total time per URL name (see
+    querystats.py).  Does nothing unless settings.QUERY_STATS is True.
+    Works in both WSGI and ASGI stacks, so it doesn't make async views
+    wait for a sync thread.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_STATS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django that __call__ returns a coroutine
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with querystats.record_queries() as recorder:
+            response = self.get_response(request)
+        self.record(request, recorder, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with querystats.record_queries() as recorder:
+            response = await self.get_response(request)
+        self.record(request, recorder, started)
+        return response
+
+    def record(self, request, recorder, started):
+        total_time = time.perf_counter() - started
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            url_name = '%s:%s' % (match.namespace, match.url_name) if match.namespace else match.url_name
+            querystats.record(url_name, recorder.queries, recorder.db_time, total_time)
+
+
+# Names ManifestStaticFilesStorage gives collected files: style.0123456789ab.css
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+# Precompressed copies written by storage.CompressedManifestStaticFilesStorage, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def accepted_encodings(header):
+    '''
+    {coding: q value} of an Accept-Encoding header; "gzip;q=0" refuses gzip.
+    '''
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+class StaticFilesMiddleware:
+    '''
+    Serves the files collectstatic put in STATIC_ROOT, so the app needs no
+    web server or CDN in front of it for its CSS and JavaScript.  Hashed
+    names are cached by browsers for a year; a precompressed copy is sent
+    to clients that accept it.  Does nothing unless STATIC_ROOT is set.
+    Like QueryStatsMiddleware, works in both WSGI and ASGI stacks.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'STATIC_ROOT', None) or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.root = os.fspath(settings.STATIC_ROOT)
+        self.prefix = settings.STATIC_URL
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.static_response(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        # A stat and an open of a local file, not worth a trip to a thread
+        return self.static_response(request) or await self.get_response(request)
+
+    def static_response(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            return self.serve(request, request.path[len(self.prefix):])
+        return None
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        variants = [(encoding, path + suffix) for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+        # The one the client likes best, the smallest of those it likes equally
+        encoding, served = max(((encoding, variant) for encoding, variant in variants
+            if accepted.get(encoding, accepted.get('*', 0)) > 0),
+            key=lambda item: accepted.get(item[0], accepted.get('*', 0)), default=(None, path))
+        response = FileResponse(open(served, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if variants:
+            response['Vary'] = 'Accept-Encoding'
+        if HASHED_NAME.search(name):
+            response['Cache-Control'] = 'public, max-age=%d, immutable' % ONE_YEAR
+        else:
+            response['Cache-Control'] = 'no-cache'
+        return response
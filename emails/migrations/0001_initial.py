@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+            ],
+            options={
+                'verbose_name': 'Category',
+                'verbose_name_plural': 'Categories',
+            },
+        ),
+        migrations.CreateModel(
+            name='Email',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name_eng', models.CharField(max_length=100, verbose_name='Email name in English')),
+                ('name_esp', models.CharField(max_length=100, verbose_name='Email name in Spanish')),
+                ('category', models.ForeignKey(help_text="Choose a category!  Can't see a relevant category?  Click 'Add a new email category' in the menu on the left.", null=True, on_delete=django.db.models.deletion.SET_NULL, to='emails.category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmailTranslation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(blank=True, choices=[('EN', 'English'), ('FR', 'French'), ('ES', 'Spanish'), ('DE', 'German'), ('NE', 'Dutch'), ('IT', 'Italian')], default='EN', help_text='Specify a language', max_length=2)),
+                ('content', models.TextField(max_length=2000)),
+                ('email', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='emails.email')),
+            ],
+        ),
+    ]
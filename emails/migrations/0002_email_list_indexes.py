@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='email',
+            name='name_eng',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Email name in English'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['category', 'name_eng'], name='emails_emai_categor_72a59b_idx'),
+        ),
+    ]
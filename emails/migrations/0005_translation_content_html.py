@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0004_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtranslation',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0005_translation_content_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewQueryStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(max_length=100, unique=True)),
+                ('requests', models.BigIntegerField(default=0)),
+                ('queries', models.BigIntegerField(default=0)),
+                ('max_queries', models.IntegerField(default=0)),
+                ('db_time', models.FloatField(default=0, help_text='Seconds')),
+                ('total_time', models.FloatField(default=0, help_text='Seconds')),
+                ('max_total_time', models.FloatField(default=0, help_text='Seconds')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'View query stats',
+                'verbose_name_plural': 'View query stats',
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations, transaction
+from django.db.models import Count, F
+
+'''
+Before adding the unique (email, language) index, merge translations of the
+same email into the same language.  The oldest row is kept, so its id stays
+valid, and it gets the content of the newest one.  Groups are handled
+BATCH_SIZE at a time, each batch in its own transaction.
+'''
+
+BATCH_SIZE = 500
+
+
+def merge_duplicates(apps, schema_editor):
+    EmailTranslation = apps.get_model('emails', 'EmailTranslation')
+    Counter = apps.get_model('emails', 'Counter')
+    using = schema_editor.connection.alias
+    translations = EmailTranslation.objects.using(using)
+
+    duplicates = (translations.filter(email__isnull=False)
+        .values('email_id', 'language')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .order_by('email_id', 'language'))
+    while True:
+        # Merged groups drop out of duplicates, so this always reads the next batch
+        batch = list(duplicates[:BATCH_SIZE])
+        if not batch:
+            return
+        with transaction.atomic(using=using):
+            removed = []
+            for group in batch:
+                rows = list(translations.filter(email_id=group['email_id'], language=group['language']).order_by('id'))
+                keep, newest = rows[0], rows[-1]
+                if (keep.content, keep.content_html) != (newest.content, newest.content_html):
+                    keep.content, keep.content_html = newest.content, newest.content_html
+                    keep.save(update_fields=['content', 'content_html'])
+                removed += rows[1:]
+            translations.filter(id__in=[row.id for row in removed]).delete()
+            forget(Counter.objects.using(using), schema_editor.connection, removed)
+
+
+def forget(counters, connection, removed):
+    '''
+    What signals.py would have done for each deleted row: fix the counters
+    and drop the row from the SQLite search index.
+    '''
+    changes = {('total', 'translations'): len(removed)}
+    for row in removed:
+        for name in (('language', row.language), ('email', str(row.email_id))):
+            changes[name] = changes.get(name, 0) + 1
+    for (scope, key), count in changes.items():
+        counters.filter(scope=scope, key=key).update(value=F('value') - count)
+
+    if connection.vendor == 'sqlite' and 'emails_search_index' in connection.introspection.table_names():
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM emails_search_index WHERE rowid = %s', [(row.id * 2,) for row in removed])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('emails', '0006_viewquerystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
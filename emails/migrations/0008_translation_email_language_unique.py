@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0007_merge_duplicate_translations'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='emailtranslation',
+            unique_together={('email', 'language')},
+        ),
+        migrations.AddIndex(
+            model_name='emailtranslation',
+            index=models.Index(fields=['language'], name='emails_emai_languag_7a7920_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:13
+
+from django.db import migrations, models
+import emails.merge
+
+BATCH_SIZE = 1000
+
+
+def fill_placeholders(apps, schema_editor):
+    EmailTranslation = apps.get_model('emails', 'EmailTranslation')
+    translations = (EmailTranslation.objects.using(schema_editor.connection.alias)
+        .filter(content__contains='{{').only('content', 'placeholders').order_by('pk'))
+    last_pk = 0
+    while True:
+        batch = list(translations.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            return
+        for translation in batch:
+            translation.placeholders = ' '.join(emails.merge.placeholders(translation.content))
+        EmailTranslation.objects.using(schema_editor.connection.alias).bulk_update(batch, ['placeholders'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0008_translation_email_language_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtranslation',
+            name='placeholders',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='emailtranslation',
+            name='content',
+            field=models.TextField(max_length=2000, validators=[emails.merge.validate_placeholders]),
+        ),
+        migrations.RunPython(fill_placeholders, migrations.RunPython.noop),
+    ]
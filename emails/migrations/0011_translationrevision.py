@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0010_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranslationRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(choices=[('EN', 'English'), ('FR', 'French'), ('ES', 'Spanish'), ('DE', 'German'), ('NE', 'Dutch'), ('IT', 'Italian')], max_length=2)),
+                ('number', models.PositiveIntegerField()),
+                ('snapshot', models.BooleanField(default=False)),
+                ('data', models.TextField(blank=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('email', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='emails.email')),
+            ],
+            options={
+                'unique_together': {('email', 'language', 'number')},
+            },
+        ),
+    ]
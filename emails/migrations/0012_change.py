@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0011_translationrevision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('entity', models.CharField(choices=[('category', 'Category'), ('email', 'Email'), ('translation', 'Translation')], max_length=12)),
+                ('object_id', models.IntegerField()),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
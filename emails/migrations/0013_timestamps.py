@@ -0,0 +1,79 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:35
+
+from django.db import migrations, models
+from django.db.models import Max, Min
+import django.utils.timezone
+
+BATCH_SIZE = 1000
+
+
+def backfill(apps, schema_editor):
+    '''
+    New columns start at the time of the migration.  Rows the change log
+    (0012) or the revision history (0011) knows about get the times from there.
+    '''
+    db = schema_editor.connection.alias
+    Change = apps.get_model('emails', 'Change')
+    TranslationRevision = apps.get_model('emails', 'TranslationRevision')
+    for model_name, entity in (('Category', 'category'), ('Email', 'email'), ('EmailTranslation', 'translation')):
+        model = apps.get_model('emails', model_name)
+        times = {row['object_id']: (row['first'], row['last']) for row in Change.objects.using(db)
+            .filter(entity=entity).exclude(operation='delete').order_by()
+            .values('object_id').annotate(first=Min('created'), last=Max('created'))}
+        if model_name == 'EmailTranslation':
+            revisions = {(row['email_id'], row['language']): (row['first'], row['last'])
+                for row in TranslationRevision.objects.using(db).filter(deleted=False).order_by()
+                .values('email_id', 'language').annotate(first=Min('created'), last=Max('created'))}
+            for pk, email_id, language in model.objects.using(db).values_list('pk', 'email_id', 'language'):
+                if (email_id, language) in revisions:
+                    first, last = revisions[(email_id, language)]
+                    if pk in times:
+                        first, last = min(first, times[pk][0]), max(last, times[pk][1])
+                    times[pk] = (first, last)
+        pks = sorted(times)
+        for start in range(0, len(pks), BATCH_SIZE):
+            batch = list(model.objects.using(db).filter(pk__in=pks[start:start + BATCH_SIZE]).only('pk'))
+            for instance in batch:
+                instance.created_at, instance.updated_at = times[instance.pk]
+            model.objects.using(db).bulk_update(batch, ['created_at', 'updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0012_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='emailtranslation',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='emailtranslation',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0013_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranslationSignature',
+            fields=[
+                ('translation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='emails.emailtranslation')),
+                ('language', models.CharField(choices=[('EN', 'English'), ('FR', 'French'), ('ES', 'Spanish'), ('DE', 'German'), ('NE', 'Dutch'), ('IT', 'Italian')], max_length=2)),
+                ('minhash', models.BinaryField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='translationsignature',
+            index=models.Index(fields=['language'], name='emails_tran_languag_5f974e_idx'),
+        ),
+    ]
@@ -1,8 +1,64 @@
-from django.db import models
+import secrets
+
+from django.conf import settings
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import linebreaks
+
+from .merge import placeholders, validate_placeholders
+
+class TrackedModel(models.Model):
+    '''
+    Keeps the values a row had in the database in self._loaded_values so the
+    handlers in signals.py can see what a save changed, and runs save() and
+    delete() in a transaction together with the work those handlers do.
+    save() also moves updated_at on; code that writes in bulk does the same
+    through bulk.bulk_update().
+    '''
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # The pages' conditional GET validators read the latest of these (see conditional.py)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def current_values(self):
+        return {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
 
-# Create your models here.
-class Category(models.Model):
+    def load_previous_values(self):
+        # Fetch anything we weren't loaded with (new instances given a pk, deferred fields)
+        loaded = getattr(self, '_loaded_values', None)
+        if self.pk is None:
+            self._loaded_values = None
+            return
+        missing = [field.attname for field in self._meta.concrete_fields
+            if loaded is None or field.attname not in loaded]
+        if missing:
+            row = type(self)._base_manager.filter(pk=self.pk).values(*missing).first()
+            self._loaded_values = None if row is None else {**(loaded or {}), **row}
+
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'updated_at'}
+        with transaction.atomic():
+            self.load_previous_values()
+            super().save(*args, **kwargs)
+        self._loaded_values = self.current_values()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+class Category(TrackedModel):
     name = models.CharField(max_length=100)
 
     class Meta:
@@ -15,8 +71,8 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class Email(models.Model):
-    name_eng = models.CharField('Email name in English', max_length=100)
+class Email(TrackedModel):
+    name_eng = models.CharField('Email name in English', max_length=100, db_index=True)
     name_esp = models.CharField('Email name in Spanish', max_length=100)
     category = models.ForeignKey(Category, 
         on_delete=models.SET_NULL, 
@@ -24,13 +80,19 @@ class Email(models.Model):
         help_text="Choose a category!  Can't see a relevant category?  Click 'Add a new email category' in the menu on the left."
         )
 
+    class Meta:
+        # Keyset pagination of the email list orders on (name_eng, id)
+        indexes = [
+            models.Index(fields=['category', 'name_eng']),
+        ]
+
     def __str__(self):
         return self.name_eng + ', ' + self.name_esp
 
     def get_absolute_url(self):
         return reverse('email_detail', args=[str(self.id)])
 
-class EmailTranslation(models.Model):
+class EmailTranslation(TrackedModel):
     email = models.ForeignKey(Email, on_delete=models.SET_NULL, null=True)
 
     LANGUAGES = (
@@ -49,10 +111,204 @@ class EmailTranslation(models.Model):
         default = 'EN',
         help_text = 'Specify a language'
         )
-    content = models.TextField(max_length=2000)
+    content = models.TextField(max_length=2000, validators=[validate_placeholders])
+    # content run through the linebreaks filter, kept up to date by save()
+    content_html = models.TextField(blank=True, editable=False)
+    # Space separated mail merge placeholder names in content (see merge.py), also kept up to date by save()
+    placeholders = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        # One translation per language; "email X in French" is a point read on this index
+        unique_together = ('email', 'language')
+        indexes = [
+            models.Index(fields=['language']),
+        ]
+
+    def render_content(self):
+        self.content_html = linebreaks(self.content, autoescape=True)
+        self.placeholders = ' '.join(placeholders(self.content))
+
+    def placeholder_names(self):
+        return self.placeholders.split()
+
+    def save(self, *args, **kwargs):
+        self.render_content()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'content_html', 'placeholders'}
+        super().save(*args, **kwargs)
+
+class Counter(models.Model):
+    '''
+    Denormalized row counts for the dashboard, kept up to date by signals.py
+    and repaired by the reconcile_counters command.  See counters.py.
+    '''
+    SCOPES = (
+        ('total', 'Total'),
+        ('language', 'Language'),
+        ('category', 'Category'),
+        ('email', 'Email'),
+    )
+
+    scope = models.CharField(max_length=10, choices=SCOPES)
+    key = models.CharField(max_length=20)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('scope', 'key')
+
+    def __str__(self):
+        return '%s:%s = %s' % (self.scope, self.key, self.value)
+
+class ApiToken(models.Model):
+    '''
+    Lets machine clients call the JSON API (api.py) with an
+    "Authorization: Token <key>" header instead of logging in.
+    The token has the permissions of its user.
+    '''
+    key = models.CharField(max_length=40, unique=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, help_text='What uses this token, eg. "CRM integration"')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = secrets.token_hex(20)
+        super().save(*args, **kwargs)
 
+    def __str__(self):
+        return self.name
+
+class ViewQueryStats(models.Model):
+    '''
+    Queries and time spent per URL name, collected by QueryStatsMiddleware
+    when settings.QUERY_STATS is on.  See querystats.py.
+    '''
+    url_name = models.CharField(max_length=100, unique=True)
+    requests = models.BigIntegerField(default=0)
+    queries = models.BigIntegerField(default=0)
+    max_queries = models.IntegerField(default=0)
+    db_time = models.FloatField(default=0, help_text='Seconds')
+    total_time = models.FloatField(default=0, help_text='Seconds')
+    max_total_time = models.FloatField(default=0, help_text='Seconds')
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'View query stats'
+        verbose_name_plural = 'View query stats'
+
+    def __str__(self):
+        return self.url_name
+
+class OutboundMessage(models.Model):
+    '''
+    A personalised email waiting to be sent, or the record of having sent it.
+    Queued by outbox.enqueue() and sent by the send_queued_emails command.
+    '''
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    translation = models.ForeignKey(EmailTranslation, on_delete=models.SET_NULL, null=True, blank=True)
+    to_address = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    # When a queued message is next due, or when a worker's claim on a message being sent runs out
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Workers look for (status, next_attempt <= now) in next_attempt order
+        indexes = [
+            models.Index(fields=['status', 'next_attempt']),
+        ]
+
+    def __str__(self):
+        return '%s to %s (%s)' % (self.subject, self.to_address, self.status)
+
+class TranslationRevision(models.Model):
+    '''
+    One version of the content of an email in one language.  Most rows hold a
+    delta against the version before; a snapshot holds the whole text.  See
+    revisions.py.
+    '''
+    email = models.ForeignKey(Email, on_delete=models.CASCADE)
+    language = models.CharField(max_length=2, choices=EmailTranslation.LANGUAGES)
+    # 1, 2, 3... per (email, language)
+    number = models.PositiveIntegerField()
+    snapshot = models.BooleanField(default=False)
+    # The whole content for a snapshot, otherwise a delta (see revisions.encode_delta())
+    data = models.TextField(blank=True)
+    # The translation was deleted (or moved to another language); data is empty
+    deleted = models.BooleanField(default=False)
+    created = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        unique_together = ('email', 'language', 'number')
 
+    def __str__(self):
+        return '%s %s #%d' % (self.email_id, self.language, self.number)
+
+class Change(models.Model):
+    '''
+    One create, update or delete of a category, email or translation, in the
+    order they were written.  Integrations follow the log through the changes
+    API to stay in sync.  See changes.py.
+    '''
+    CATEGORY = 'category'
+    EMAIL = 'email'
+    TRANSLATION = 'translation'
+    ENTITIES = (
+        (CATEGORY, 'Category'),
+        (EMAIL, 'Email'),
+        (TRANSLATION, 'Translation'),
+    )
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OPERATIONS = (
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    )
 
-    
+    seq = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=12, choices=ENTITIES)
+    object_id = models.IntegerField()
+    operation = models.CharField(max_length=6, choices=OPERATIONS)
+    created = models.DateTimeField(default=timezone.now)
 
+    def __str__(self):
+        return '%d: %s %s %d' % (self.seq, self.operation, self.entity, self.object_id)
+
+class TranslationSignature(models.Model):
+    '''
+    MinHash signature of a translation's content, for finding near-duplicate
+    translations.  See duplicates.py.
+    '''
+    translation = models.OneToOneField(EmailTranslation, on_delete=models.CASCADE,
+        primary_key=True, related_name='signature')
+    # Copied from the translation, so one language's signatures are read without a join
+    language = models.CharField(max_length=2, choices=EmailTranslation.LANGUAGES)
+    minhash = models.BinaryField()
+    # The translation's updated_at when it was signed; older means it needs signing again
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['language']),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.translation_id, self.language)
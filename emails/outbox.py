@@ -0,0 +1,189 @@
+import datetime
+
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import merge
+from .models import OutboundMessage
+
+'''
+The outbound mail queue.
+
+enqueue() renders a translation for each recipient (see merge.py) and stores
+the results as OutboundMessage rows.  The send_queued_emails command calls
+send_due() until nothing is due: each batch is claimed in one transaction,
+sent over a single backend connection and its outcome written back with one
+bulk update, so draining the queue costs a few queries and one connection
+per batch, not per message.
+
+A claimed message is marked as sending until now + CLAIM_TIMEOUT; if its
+worker dies, the claim runs out and another worker picks it up.  A message
+that fails is retried after RETRY_DELAY, doubling each time, and given up on
+after EMAIL_QUEUE_MAX_ATTEMPTS attempts.
+'''
+
+BATCH_SIZE = 500
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+RETRY_DELAY = datetime.timedelta(minutes=1)
+MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+ENQUEUE_BATCH_SIZE = 1000
+# Column of the recipients file holding the address
+ADDRESS_FIELD = 'email'
+
+
+class NotSent(Exception):
+    pass
+
+
+class EnqueueResult:
+    def __init__(self):
+        self.queued = 0
+        # [(row, message)], the first few only
+        self.errors = []
+        self.skipped = 0
+
+    def skip(self, row, message):
+        self.skipped += 1
+        if len(self.errors) < 20:
+            self.errors.append((row, message))
+
+
+def enqueue(translation, subject, recipients, batch_size=ENQUEUE_BATCH_SIZE):
+    '''
+    Queues translation, rendered for each recipient dict, which needs an
+    'email' value besides the placeholders.  subject may use placeholders too.
+    Rows that can't be rendered, or whose address or subject couldn't be
+    sent, are skipped and reported in the result.
+    '''
+    result = EnqueueResult()
+    body_template = merge.compiled(translation)
+    subject_template = merge.MergeTemplate(subject)
+    batch = []
+    with transaction.atomic():
+        for row, record in enumerate(recipients, start=1):
+            address = str(record.get(ADDRESS_FIELD) or '').strip() if isinstance(record, dict) else ''
+            if not address:
+                result.skip(row, 'No %s address.' % ADDRESS_FIELD)
+                continue
+            # bulk_create() doesn't run the model's validators, and a bad address
+            # would only fail when sent, after every retry
+            try:
+                validate_email(address)
+            except ValidationError:
+                result.skip(row, '%s is not a valid email address.' % address)
+                continue
+            try:
+                subject = subject_template.render(record)
+                body = body_template.render(record)
+            except merge.MergeError as e:
+                result.skip(row, str(e))
+                continue
+            if '\r' in subject or '\n' in subject:
+                # Would be refused as a header injection when sent
+                result.skip(row, 'The subject would have a line break in it.')
+                continue
+            batch.append(OutboundMessage(
+                translation=translation,
+                to_address=address,
+                subject=subject[:255],
+                body=body,
+            ))
+            if len(batch) >= batch_size:
+                OutboundMessage.objects.bulk_create(batch)
+                result.queued += len(batch)
+                batch = []
+        if batch:
+            OutboundMessage.objects.bulk_create(batch)
+            result.queued += len(batch)
+    return result
+
+
+def claim(batch_size, now=None):
+    '''
+    Marks up to batch_size due messages as being sent by this worker and returns them.
+    '''
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = (OutboundMessage.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboundMessage.QUEUED, OutboundMessage.SENDING], next_attempt__lte=now)
+            .order_by('next_attempt', 'id'))
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if ids:
+            OutboundMessage.objects.filter(id__in=ids).update(
+                status=OutboundMessage.SENDING, next_attempt=now + CLAIM_TIMEOUT)
+    return list(OutboundMessage.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def failed(message, error, now, max_attempts):
+    message.attempts += 1
+    message.last_error = '%s: %s' % (type(error).__name__, error)
+    if message.attempts >= max_attempts:
+        message.status = OutboundMessage.FAILED
+    else:
+        message.status = OutboundMessage.QUEUED
+        message.next_attempt = now + retry_delay(message.attempts)
+
+
+def send_batch(messages, connection=None, max_attempts=None):
+    '''
+    Sends messages over one connection and records how each one went.
+    Returns the number sent.
+    '''
+    max_attempts = max_attempts or getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', MAX_ATTEMPTS)
+    connection = connection or mail.get_connection()
+    sent = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # Nothing can be sent; try the whole batch again later
+        now = timezone.now()
+        for message in messages:
+            failed(message, e, now, max_attempts)
+    else:
+        try:
+            for message in messages:
+                email = mail.EmailMessage(message.subject, message.body, settings.DEFAULT_FROM_EMAIL,
+                    [message.to_address], connection=connection)
+                try:
+                    # One message at a time to learn which ones the server refused
+                    if not connection.send_messages([email]):
+                        raise NotSent('The backend did not send the message.')
+                except Exception as e:
+                    failed(message, e, timezone.now(), max_attempts)
+                else:
+                    message.status = OutboundMessage.SENT
+                    message.attempts += 1
+                    message.sent_at = timezone.now()
+                    message.last_error = ''
+                    sent += 1
+        finally:
+            connection.close()
+    OutboundMessage.objects.bulk_update(messages,
+        ['status', 'attempts', 'next_attempt', 'last_error', 'sent_at'])
+    return sent
+
+
+def send_due(batch_size=None, connection=None):
+    '''
+    Claims and sends one batch.  Returns (claimed, sent).
+    '''
+    batch_size = batch_size or getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', BATCH_SIZE)
+    messages = claim(batch_size)
+    if not messages:
+        return 0, 0
+    return len(messages), send_batch(messages, connection)
+
+
+def status_counts():
+    counts = dict(OutboundMessage.objects.order_by().values_list('status').annotate(n=Count('id')))
+    return [(status, name, counts.get(status, 0)) for status, name in OutboundMessage.STATUSES]
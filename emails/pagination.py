@@ -0,0 +1,100 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    '''
+    One page of results from keyset_paginate.
+    Cursors are opaque strings to pass back as ?after= or ?before=.
+    '''
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, keys):
+    '''
+    Returns the list of values of model's fields `keys` in the cursor, or None
+    if it is missing or malformed.  Each value is checked by its field, so a
+    cursor that was tampered with can't reach the database.
+    '''
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    decoded = []
+    for key, value in zip(keys, values):
+        if value is None or isinstance(value, (list, dict)):
+            return None
+        try:
+            decoded.append(model._meta.get_field(key).to_python(value))
+        except ValidationError:
+            return None
+    return decoded
+
+
+def _keyset_filter(keys, values, lookup):
+    # (k1, k2, ...) > (v1, v2, ...) spelled out so every backend can use the index
+    condition = Q()
+    for i, key in enumerate(keys):
+        term = Q(**{'%s__%s' % (key, lookup): values[i]})
+        for prior_key, prior_value in zip(keys[:i], values[:i]):
+            term &= Q(**{prior_key: prior_value})
+        condition |= term
+    return condition
+
+
+def keyset_paginate(queryset, keys, after=None, before=None, per_page=50):
+    '''
+    Paginate queryset on the ascending, unique key tuple `keys` (eg. ('name_eng', 'id')).
+    Only per_page + 1 rows are read whatever the table size, so the cost of a page
+    does not grow with the catalog.  Malformed cursors are treated as missing.
+    '''
+    keys = tuple(keys)
+    after_values = decode_cursor(after, queryset.model, keys)
+    before_values = decode_cursor(before, queryset.model, keys)
+
+    if before_values is not None and after_values is None:
+        queryset = queryset.filter(_keyset_filter(keys, before_values, 'lt'))
+        rows = list(queryset.order_by(*['-' + key for key in keys])[:per_page + 1])
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_previous, has_next = has_more, True
+    else:
+        if after_values is not None:
+            queryset = queryset.filter(_keyset_filter(keys, after_values, 'gt'))
+        rows = list(queryset.order_by(*keys)[:per_page + 1])
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_previous = after_values is not None
+
+    def cursor_for(obj):
+        return encode_cursor([getattr(obj, key) for key in keys])
+
+    next_cursor = cursor_for(rows[-1]) if rows and has_next else None
+    previous_cursor = cursor_for(rows[0]) if rows and has_previous else None
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+'''
+Each user's permission set, kept in the cache between requests.
+
+CachedModelBackend answers has_perm() (views, the template "perms" proxy
+and the API) from the cache, so a warm request runs no permission queries.
+The handlers in signals.py call forget_user() when a user's permissions,
+groups or flags change and forget_all() when a group's permissions change.
+
+Every process must see the invalidations, so production needs a shared
+cache backend (see CACHES in settings.py); PERMISSION_CACHE_TIMEOUT bounds
+how stale a per-process cache can get.
+'''
+
+KEY_PREFIX = 'emails:perms:'
+VERSION_KEY = KEY_PREFIX + 'version'
+TIMEOUT = 300
+
+
+def user_key(user_id):
+    return '%suser:%s' % (KEY_PREFIX, user_id)
+
+
+def timeout():
+    return getattr(settings, 'PERMISSION_CACHE_TIMEOUT', TIMEOUT)
+
+
+def current_version():
+    return cache.get(VERSION_KEY, 0)
+
+
+def cached_permissions(user_id, load):
+    '''
+    The cached permission set of the user, or load() if it isn't cached or
+    was cached before the last forget_all().
+    '''
+    values = cache.get_many([user_key(user_id), VERSION_KEY])
+    version = values.get(VERSION_KEY, 0)
+    cached = values.get(user_key(user_id))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    permissions = load()
+    cache.set(user_key(user_id), (version, permissions), timeout())
+    return permissions
+
+
+def forget_user(*user_ids):
+    '''
+    Drop the cached permissions of users, now and again when the current
+    transaction commits, so a request in between can't cache the old set.
+    '''
+    keys = [user_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_all():
+    def bump():
+        if not cache.add(VERSION_KEY, 1, None):
+            cache.incr(VERSION_KEY)
+    bump()
+    transaction.on_commit(bump)
+
+
+class CachedModelBackend(ModelBackend):
+    '''
+    ModelBackend with get_all_permissions() read from the cache.
+    '''
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            user_obj._perm_cache = cached_permissions(user_obj.pk,
+                lambda: super(CachedModelBackend, self).get_all_permissions(user_obj))
+        return user_obj._perm_cache
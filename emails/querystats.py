@@ -0,0 +1,152 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import ViewQueryStats
+
+'''
+Per-view query counts and timings.
+
+QueryStatsMiddleware (middleware.py) records the number of queries, the time
+spent in them and the total time of each request under its URL name.  Every
+connection runs its queries through count_query() (installed by signals.py),
+which counts them for the request in the current context, whatever thread
+the query runs in.  Each process adds these up in memory and writes them to
+ViewQueryStats every QUERY_STATS_FLUSH_INTERVAL seconds, so the cost is a
+handful of queries per interval and not per request.
+
+Queries run while a StreamingHttpResponse is being sent aren't counted.
+'''
+
+FLUSH_INTERVAL = 10
+
+
+class QueryRecorder:
+    '''
+    Counts queries and the seconds spent in them, called like an
+    execute_wrapper (see "Database instrumentation" in the Django docs).
+    '''
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@contextmanager
+def record_queries():
+    '''
+    Counts the queries run inside the block, including those run from other
+    threads on its behalf (sync_to_async() and async_api.in_db_thread()
+    carry the context over).
+    '''
+    recorder = QueryRecorder()
+    token = current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        current_recorder.reset(token)
+
+
+class StatsBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = time.monotonic()
+
+    def add(self, url_name, queries, db_time, total_time):
+        with self.lock:
+            stats = self.views.setdefault(url_name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time': 0, 'total_time': 0, 'max_total_time': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            stats['db_time'] += db_time
+            stats['total_time'] += total_time
+            stats['max_total_time'] = max(stats['max_total_time'], total_time)
+
+    def due(self):
+        interval = getattr(settings, 'QUERY_STATS_FLUSH_INTERVAL', FLUSH_INTERVAL)
+        return time.monotonic() - self.last_flush >= interval
+
+    def pop(self):
+        with self.lock:
+            views, self.views = self.views, {}
+            self.last_flush = time.monotonic()
+        return views
+
+
+buffer = StatsBuffer()
+
+
+def record(url_name, queries, db_time, total_time):
+    buffer.add(url_name, queries, db_time, total_time)
+    if buffer.due():
+        flush()
+
+
+def flush():
+    '''
+    Write what this process has recorded since the last flush to the database.
+    '''
+    views = buffer.pop()
+    for url_name, stats in sorted(views.items()):
+        changes = {
+            'requests': F('requests') + stats['requests'],
+            'queries': F('queries') + stats['queries'],
+            'max_queries': Greatest(F('max_queries'), Value(stats['max_queries'])),
+            'db_time': F('db_time') + stats['db_time'],
+            'total_time': F('total_time') + stats['total_time'],
+            'max_total_time': Greatest(F('max_total_time'), Value(stats['max_total_time'])),
+        }
+        if ViewQueryStats.objects.filter(url_name=url_name).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                ViewQueryStats.objects.create(url_name=url_name, **stats)
+        except IntegrityError:
+            # Another process created it first
+            ViewQueryStats.objects.filter(url_name=url_name).update(**changes)
+
+
+def view_stats(order_by='-queries'):
+    '''
+    The stored stats with per-request averages, after flushing this process.
+    '''
+    flush()
+    rows = list(ViewQueryStats.objects.order_by(order_by, 'url_name'))
+    for row in rows:
+        row.avg_queries = row.queries / row.requests if row.requests else 0
+        row.avg_db_ms = row.db_time * 1000 / row.requests if row.requests else 0
+        row.avg_total_ms = row.total_time * 1000 / row.requests if row.requests else 0
+        row.max_total_ms = row.max_total_time * 1000
+    return rows
+
+
+def reset():
+    buffer.pop()
+    ViewQueryStats.objects.all().delete()
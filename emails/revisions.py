@@ -0,0 +1,213 @@
+import difflib
+import json
+import re
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import TranslationRevision
+
+'''
+Revision history of translation content.
+
+Every change to the content of an email in a language (kept up to date by
+signals.py) adds a TranslationRevision.  Most revisions store a delta against
+the revision before: the replaced word ranges of the old text and what
+replaced them, so an edit costs about as much storage as the words it
+touched.  The first revision, and at least every SNAPSHOT_EVERY-th one after
+it, stores the whole text, so any revision is rebuilt from at most
+SNAPSHOT_EVERY rows read in one query.
+
+Revisions follow (email, language) rather than the translation row, so a
+translation that is deleted and added again keeps its history; deletions are
+recorded as an empty snapshot marked deleted.  Writes that skip the signals
+(queryset.update() of content) leave the history behind, like the counters.
+'''
+
+SNAPSHOT_EVERY = 20
+TOKENS = re.compile(r'\s+|\S+\s*')
+
+
+def tokens(text):
+    return TOKENS.findall(text)
+
+
+def opcodes(old, new):
+    '''
+    Yields (start, end, replacement) for the ranges of old that differ from new, word by word.
+    '''
+    a, b = tokens(old), tokens(new)
+    offsets = [0]
+    for token in a:
+        offsets.append(offsets[-1] + len(token))
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            yield offsets[i1], offsets[i2], ''.join(b[j1:j2])
+
+
+def encode_delta(old, new):
+    return json.dumps(list(opcodes(old, new)), ensure_ascii=False, separators=(',', ':'))
+
+
+def apply_delta(text, delta):
+    pieces = []
+    position = 0
+    for start, end, replacement in json.loads(delta):
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+# Recording
+
+def heads(keys):
+    '''
+    {(email_id, language): (last number, last snapshot number)} for the given chains, in one query.
+    '''
+    if not keys:
+        return {}
+    lookup = Q()
+    for email_id, language in keys:
+        lookup |= Q(email_id=email_id, language=language)
+    rows = (TranslationRevision.objects.filter(lookup).order_by()
+        .values('email_id', 'language')
+        .annotate(last=Max('number'), last_snapshot=Max('number', filter=Q(snapshot=True))))
+    return {(row['email_id'], row['language']): (row['last'], row['last_snapshot'] or 0) for row in rows}
+
+
+def changes(instance, previous, deleted=False):
+    '''
+    (email_id, language, old content or None, new content or None) for a
+    saved or deleted translation.  previous is its _loaded_values.
+    '''
+    if deleted:
+        return [(instance.email_id, instance.language, instance.__dict__.get('content'), None)]
+    if previous is None:
+        return [(instance.email_id, instance.language, None, instance.content)]
+    if (previous['email_id'], previous['language']) != (instance.email_id, instance.language):
+        return [
+            (previous['email_id'], previous['language'], previous['content'], None),
+            (instance.email_id, instance.language, None, instance.content),
+        ]
+    if previous['content'] != instance.content:
+        return [(instance.email_id, instance.language, previous['content'], instance.content)]
+    return []
+
+
+def record(changes):
+    '''
+    Adds a revision for each change, in two queries however many there are.
+    A chain with no revisions yet (content from before history was kept)
+    first gets a snapshot of the old content.
+    '''
+    changes = [change for change in changes if change[0] is not None]
+    if not changes:
+        return
+    latest = heads({(email_id, language) for email_id, language, old, new in changes})
+    now = timezone.now()
+    rows = []
+    for email_id, language, old, new in changes:
+        last, last_snapshot = latest.get((email_id, language), (0, 0))
+
+        def add(**fields):
+            rows.append(TranslationRevision(email_id=email_id, language=language, number=last, created=now, **fields))
+
+        if last == 0 and old is not None:
+            last = last_snapshot = 1
+            add(snapshot=True, data=old)
+        last += 1
+        if new is None:
+            add(snapshot=True, deleted=True)
+            last_snapshot = last
+        else:
+            delta = None
+            if old is not None and last - last_snapshot < SNAPSHOT_EVERY:
+                delta = encode_delta(old, new)
+            if delta is None or len(delta) >= len(new):
+                add(snapshot=True, data=new)
+                last_snapshot = last
+            else:
+                add(data=delta)
+        latest[(email_id, language)] = (last, last_snapshot)
+    TranslationRevision.objects.bulk_create(rows)
+
+
+# Reading
+
+def texts(email_id, language, number):
+    '''
+    {n: content} for revision number and the revisions before it back to
+    the snapshot it builds on, in one query.  None for deletions.
+    '''
+    rows = (TranslationRevision.objects
+        .filter(email_id=email_id, language=language, number__gt=number - SNAPSHOT_EVERY - 1, number__lte=number)
+        .order_by('number')
+        .values_list('number', 'snapshot', 'deleted', 'data'))
+    result = {}
+    text = None
+    for n, snapshot, deleted, data in rows:
+        if snapshot:
+            text = None if deleted else data
+        elif text is not None:
+            text = apply_delta(text, data)
+        result[n] = text
+    return result
+
+
+def content_at(email_id, language, number):
+    return texts(email_id, language, number).get(number)
+
+
+def diff(email_id, language, number):
+    '''
+    [(kind, text)] segments turning revision number - 1 into revision
+    number, kind being 'equal', 'delete' or 'insert'.
+    '''
+    versions = texts(email_id, language, number)
+    old, new = versions.get(number - 1) or '', versions.get(number) or ''
+    segments = []
+    position = 0
+    for start, end, replacement in opcodes(old, new):
+        if position < start:
+            segments.append(('equal', old[position:start]))
+        if start < end:
+            segments.append(('delete', old[start:end]))
+        if replacement:
+            segments.append(('insert', replacement))
+        position = end
+    if position < len(old):
+        segments.append(('equal', old[position:]))
+    return segments
+
+
+# Pruning
+
+def prune(before, keep=10):
+    '''
+    Deletes revisions created before `before`, except the latest `keep` of
+    each email and language.  The oldest revision left becomes a snapshot.
+    Returns the number deleted.
+    '''
+    keep = max(keep, 1)
+    deleted = 0
+    chains = (TranslationRevision.objects.filter(created__lt=before).order_by()
+        .values_list('email_id', 'language').distinct())
+    for email_id, language in list(chains):
+        with transaction.atomic():
+            revisions = TranslationRevision.objects.filter(email_id=email_id, language=language)
+            numbers = list(revisions.order_by('-number').values_list('number', 'created'))
+            kept = [number for i, (number, created) in enumerate(numbers) if i < keep or created >= before]
+            first_kept = min(kept)
+            if first_kept == numbers[-1][0]:
+                continue
+            oldest = revisions.get(number=first_kept)
+            if not oldest.snapshot:
+                oldest.data = content_at(email_id, language, first_kept)
+                oldest.snapshot = True
+                oldest.save(update_fields=['data', 'snapshot'])
+            deleted += revisions.filter(number__lt=first_kept).delete()[0]
+    return deleted
@@ -0,0 +1,253 @@
+import re
+
+from django.db import NotSupportedError, connections
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Email, EmailTranslation
+
+'''
+Full-text search over email names and translation content.
+
+On MySQL the InnoDB FULLTEXT indexes on emails_emailtranslation.content and
+emails_email(name_eng, name_esp) do the work and the database keeps them in
+sync itself.  On SQLite (tests and development) an FTS5 table holds one row
+per translation (rowid = 2 * id) and one per email (rowid = 2 * id + 1),
+kept in sync by the handlers in signals.py.
+'''
+
+FTS_TABLE = 'emails_search_index'
+TRANSLATION_FULLTEXT_INDEX = 'emails_translation_content_ft'
+EMAIL_FULLTEXT_INDEX = 'emails_email_names_ft'
+
+MAX_TERMS = 10
+SNIPPET_WORDS = 16
+SNIPPET_CHARS = 160
+
+# Placeholders for the <mark> tags, swapped in after escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+class SearchResult:
+    def __init__(self, email, language, snippet, score):
+        self.email = email
+        self.language = language
+        self.snippet = snippet
+        self.score = score
+
+    def get_language_display(self):
+        return dict(EmailTranslation.LANGUAGES).get(self.language, '')
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def highlight(text):
+    return mark_safe(escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def make_snippet(text, terms):
+    '''
+    Python equivalent of FTS5's snippet() for backends that have none.
+    '''
+    pattern = re.compile(r'\b(%s)\w*' % '|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - SNIPPET_CHARS // 3) if match else 0
+    window = text[start:start + SNIPPET_CHARS]
+    marked = pattern.sub(lambda m: MARK_START + m.group(0) + MARK_END, window)
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if start + SNIPPET_CHARS < len(text) else ''
+    return highlight(prefix + marked + suffix)
+
+
+def _vendor(using):
+    return connections[using].vendor
+
+
+def keeps_own_index(using='default'):
+    return _vendor(using) == 'sqlite'
+
+
+# Index maintenance
+
+def ensure_index(using='default'):
+    '''
+    Create the full-text indexes if they are missing.  Safe to call repeatedly;
+    runs after every migrate.
+    '''
+    vendor = _vendor(using)
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone():
+                return
+            cursor.execute(
+                "CREATE VIRTUAL TABLE %s USING fts5("
+                "body, language, kind UNINDEXED, email_id UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')" % FTS_TABLE
+            )
+        elif vendor == 'mysql':
+            for table, name, columns in (
+                (EmailTranslation._meta.db_table, TRANSLATION_FULLTEXT_INDEX, 'content'),
+                (Email._meta.db_table, EMAIL_FULLTEXT_INDEX, 'name_eng, name_esp'),
+            ):
+                cursor.execute(
+                    "SELECT COUNT(*) FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                    [table, name]
+                )
+                if not cursor.fetchone()[0]:
+                    cursor.execute('ALTER TABLE %s ADD FULLTEXT INDEX %s (%s)' % (table, name, columns))
+            return
+        else:
+            return
+    rebuild_index(using=using)
+
+
+def _fts_rows_for_translations(translations):
+    return [(translation.pk * 2, translation.content, translation.language, 'translation', translation.email_id)
+        for translation in translations]
+
+
+def _fts_rows_for_emails(emails):
+    return [(email.pk * 2 + 1, '%s\n%s' % (email.name_eng, email.name_esp), '', 'email', email.pk)
+        for email in emails]
+
+
+def _fts_insert(cursor, rows):
+    cursor.executemany(
+        'INSERT INTO %s (rowid, body, language, kind, email_id) VALUES (%%s, %%s, %%s, %%s, %%s)' % FTS_TABLE,
+        rows
+    )
+
+
+def _fts_replace(cursor, rows):
+    if not rows:
+        return
+    cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(row[0],) for row in rows])
+    _fts_insert(cursor, rows)
+
+
+def index_translations(translations, using='default'):
+    if not keeps_own_index(using):
+        return
+    translations = list(translations)
+    unindex_translations([translation.pk for translation in translations if translation.email_id is None], using)
+    with connections[using].cursor() as cursor:
+        _fts_replace(cursor, _fts_rows_for_translations(
+            translation for translation in translations if translation.email_id is not None))
+
+
+def index_emails(emails, using='default'):
+    if not keeps_own_index(using):
+        return
+    with connections[using].cursor() as cursor:
+        _fts_replace(cursor, _fts_rows_for_emails(emails))
+
+
+def unindex_translations(translation_ids, using='default'):
+    if not keeps_own_index(using) or not translation_ids:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE,
+            [(pk * 2,) for pk in translation_ids])
+
+
+def unindex_email(email_id, using='default'):
+    if not keeps_own_index(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [email_id * 2 + 1])
+
+
+def rebuild_index(batch_size=2000, using='default'):
+    '''
+    Re-index every email and translation.  Only SQLite keeps a separate index.
+    Returns the number of rows indexed.
+    '''
+    if not keeps_own_index(using):
+        return 0
+    count = 0
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        for queryset, to_rows in (
+            (Email.objects.using(using).only('name_eng', 'name_esp'), _fts_rows_for_emails),
+            (EmailTranslation.objects.using(using).filter(email__isnull=False), _fts_rows_for_translations),
+        ):
+            batch = []
+            for obj in queryset.order_by('pk').iterator(chunk_size=batch_size):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    _fts_insert(cursor, to_rows(batch))
+                    count += len(batch)
+                    batch = []
+            if batch:
+                _fts_insert(cursor, to_rows(batch))
+                count += len(batch)
+    return count
+
+
+# Queries
+
+def _search_sqlite(cursor, terms, language, limit, offset):
+    match = ' AND '.join('body : "%s"*' % term for term in terms)
+    if language:
+        match = '(%s) AND language : "%s"' % (match, language.lower())
+    cursor.execute(
+        "SELECT kind, email_id, language, snippet(%s, 0, %%s, %%s, '…', %%s), bm25(%s) "
+        "FROM %s WHERE %s MATCH %%s ORDER BY rank LIMIT %%s OFFSET %%s" % (FTS_TABLE, FTS_TABLE, FTS_TABLE, FTS_TABLE),
+        [MARK_START, MARK_END, SNIPPET_WORDS, match, limit, offset]
+    )
+    # bm25() is lower for better matches
+    return [(email_id, lang, highlight(snippet), -score)
+        for kind, email_id, lang, snippet, score in cursor.fetchall()]
+
+
+def _search_mysql(cursor, terms, language, limit, offset):
+    against = ' '.join('+%s*' % term for term in terms)
+    hits = []
+    if not language:
+        cursor.execute(
+            "SELECT id, name_eng, name_esp, MATCH(name_eng, name_esp) AGAINST (%%s IN BOOLEAN MODE) AS score "
+            "FROM %s WHERE MATCH(name_eng, name_esp) AGAINST (%%s IN BOOLEAN MODE) "
+            "ORDER BY score DESC LIMIT %%s" % Email._meta.db_table,
+            [against, against, limit + offset]
+        )
+        hits += [(email_id, '', make_snippet('%s\n%s' % (name_eng, name_esp), terms), score)
+            for email_id, name_eng, name_esp, score in cursor.fetchall()]
+    sql = ("SELECT email_id, language, content, MATCH(content) AGAINST (%%s IN BOOLEAN MODE) AS score "
+        "FROM %s WHERE MATCH(content) AGAINST (%%s IN BOOLEAN MODE) AND email_id IS NOT NULL"
+        % EmailTranslation._meta.db_table)
+    params = [against, against]
+    if language:
+        sql += ' AND language = %s'
+        params.append(language)
+    cursor.execute(sql + ' ORDER BY score DESC LIMIT %s', params + [limit + offset])
+    hits += [(email_id, lang, make_snippet(content, terms), score)
+        for email_id, lang, content, score in cursor.fetchall()]
+    # Name matches first, the two relevance scales aren't comparable
+    return hits[offset:offset + limit]
+
+
+def search(query, language='', limit=20, offset=0, using='default'):
+    '''
+    Returns a list of SearchResult, best match first.  Every term in the query
+    has to match, as a word or the start of one.
+    '''
+    terms = search_terms(query)
+    if not terms:
+        return []
+    vendor = _vendor(using)
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            hits = _search_sqlite(cursor, terms, language, limit, offset)
+        elif vendor == 'mysql':
+            hits = _search_mysql(cursor, terms, language, limit, offset)
+        else:
+            raise NotSupportedError('Full-text search needs MySQL or SQLite, not %s.' % vendor)
+
+    emails = Email.objects.using(using).select_related('category').in_bulk({hit[0] for hit in hits})
+    return [SearchResult(emails[email_id], lang, snippet, score)
+        for email_id, lang, snippet, score in hits if email_id in emails]
@@ -0,0 +1,89 @@
+import math
+import random
+
+from .importer import CONTENT_MAX_LENGTH, EmailImporter
+from .models import EmailTranslation
+
+'''
+Reproducible synthetic catalogs for load testing and benchmarks.
+
+catalog() yields import records (see importer.py), so seeding goes through
+the same batched writes as import_emails and keeps the dashboard counters
+and the search index up to date.  The same arguments always give the same
+catalog.
+'''
+
+LANGUAGE_CODES = [code for code, name in EmailTranslation.LANGUAGES]
+
+WORDS = (
+    'account', 'address', 'appointment', 'booking', 'change', 'confirm', 'contract',
+    'customer', 'delivery', 'details', 'discount', 'document', 'feedback', 'follow',
+    'invoice', 'meeting', 'member', 'message', 'monthly', 'new', 'offer', 'order',
+    'payment', 'plan', 'please', 'price', 'product', 'reminder', 'renewal', 'request',
+    'schedule', 'service', 'support', 'team', 'thank', 'ticket', 'today', 'update',
+    'welcome', 'week', 'your', 'we', 'will', 'the', 'and', 'for', 'with', 'about',
+    'from', 'our', 'you', 'this', 'that', 'have', 'been', 'next', 'soon', 'questions',
+)
+TOPICS = (
+    'Sales', 'Support', 'Billing', 'Onboarding', 'Marketing', 'Partners', 'Events',
+    'Renewals', 'Shipping', 'Feedback', 'Recruiting', 'Legal',
+)
+
+# Translation lengths are log-normal around MEDIAN_CONTENT_LENGTH characters
+MEDIAN_CONTENT_LENGTH = 600
+CONTENT_LENGTH_SIGMA = 0.6
+MIN_CONTENT_LENGTH = 40
+
+
+def category_name(index):
+    return '%s %d' % (TOPICS[index % len(TOPICS)], index // len(TOPICS) + 1)
+
+
+def sentence(rng):
+    words = [rng.choice(WORDS) for i in range(rng.randint(6, 16))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def content(rng):
+    length = rng.lognormvariate(math.log(MEDIAN_CONTENT_LENGTH), CONTENT_LENGTH_SIGMA)
+    length = int(min(max(length, MIN_CONTENT_LENGTH), CONTENT_MAX_LENGTH))
+    paragraphs = [[]]
+    size = 0
+    while size < length:
+        text = sentence(rng)
+        paragraphs[-1].append(text)
+        size += len(text) + 1
+        if len(paragraphs[-1]) >= rng.randint(2, 5):
+            paragraphs.append([])
+    text = '\n\n'.join(' '.join(paragraph) for paragraph in paragraphs if paragraph)
+    return text[:CONTENT_MAX_LENGTH]
+
+
+def catalog(categories=10, emails=100, languages=None, seed=0):
+    '''
+    Yields records for emails emails in each of categories categories, with a
+    translation in each of languages (all of EmailTranslation.LANGUAGES by default).
+    '''
+    languages = languages or LANGUAGE_CODES
+    for category in range(categories):
+        yield {'category': category_name(category)}
+    for index in range(categories * emails):
+        # One generator per email, so a bigger catalog starts with the smaller one
+        rng = random.Random('%s:%d' % (seed, index))
+        title = ' '.join(rng.choice(WORDS) for i in range(rng.randint(2, 4))).capitalize()
+        yield {
+            'category': category_name(index % categories),
+            'name_eng': '%s %06d' % (title, index),
+            'name_esp': 'Correo %06d' % index,
+            'translations': [{'language': language, 'content': content(rng)} for language in languages],
+        }
+
+
+def seed_catalog(categories=10, emails=100, languages=None, seed=0, batch_size=500, upsert=False, progress=None):
+    '''
+    Adds a catalog to the database and returns the ImportStats.  With
+    upsert=True seeding the same catalog again changes nothing.
+    '''
+    records = catalog(categories, emails, languages, seed)
+    importer = EmailImporter(batch_size=batch_size, upsert=upsert)
+    return importer.run(enumerate(records, start=1), progress)
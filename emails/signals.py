@@ -0,0 +1,358 @@
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import changes, counters, coverage, merge, permissions, querystats, revisions, search, translation_memory, typeahead
+from .models import Category, Change, Email, EmailTranslation
+
+'''
+Bookkeeping that has to follow every write to the email models.
+Model.save()/delete() run these inside a transaction (see TrackedModel), and
+instance._loaded_values holds the row as it was before the save.
+'''
+
+# bulk_create() and bulk_update() skip the per-row signals, so code that writes
+# the email models in bulk calls send_bulk_saved() afterwards.  Receivers get
+# the model as sender and lists of `created` and `updated` instances (with pks);
+# updated instances still carry the _loaded_values they were fetched with.
+bulk_saved = Signal()
+
+def send_bulk_saved(model, created=(), updated=()):
+    created, updated = list(created), list(updated)
+    if not created and not updated:
+        return
+    bulk_saved.send(sender=model, created=created, updated=updated)
+    for instance in created + updated:
+        instance._loaded_values = instance.current_values()
+
+# Sent with the deleted `instances` by bulk.bulk_delete().
+bulk_deleted = Signal()
+
+def send_bulk_deleted(model, instances):
+    if instances:
+        bulk_deleted.send(sender=model, instances=list(instances))
+
+_state = threading.local()
+
+@contextmanager
+def row_signals_muted():
+    '''
+    The per-row handlers below do nothing inside this block, for bulk
+    deletes that are reported through bulk_deleted instead.
+    '''
+    _state.muted = getattr(_state, 'muted', 0) + 1
+    try:
+        yield
+    finally:
+        _state.muted -= 1
+
+def muted():
+    return getattr(_state, 'muted', 0) > 0
+
+@receiver(post_save, sender=Email)
+def email_saved(sender, instance, created, **kwargs):
+    if muted():
+        return
+    deltas = counters.new_deltas()
+    previous = instance._loaded_values
+    if previous is not None:
+        counters.add_email(deltas, previous['category_id'], -1)
+    counters.add_email(deltas, instance.category_id)
+    counters.apply(deltas)
+    search.index_emails([instance])
+
+@receiver(pre_delete, sender=Email)
+def email_deleting(sender, instance, **kwargs):
+    if muted():
+        return
+    if search.keeps_own_index():
+        instance._translation_ids = list(instance.emailtranslation_set.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Email)
+def email_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    deltas = counters.new_deltas()
+    counters.add_email(deltas, instance.category_id, -1)
+    counters.apply(deltas)
+    # Its translations were set to email=NULL by the delete
+    counters.forget_email(instance.pk)
+    search.unindex_email(instance.pk)
+    search.unindex_translations(getattr(instance, '_translation_ids', []))
+
+@receiver(post_save, sender=EmailTranslation)
+def emailtranslation_saved(sender, instance, created, **kwargs):
+    if muted():
+        return
+    deltas = counters.new_deltas()
+    previous = instance._loaded_values
+    if previous is not None:
+        counters.add_translation(deltas, previous['email_id'], previous['language'], -1)
+    counters.add_translation(deltas, instance.email_id, instance.language)
+    counters.apply(deltas)
+    search.index_translations([instance])
+
+@receiver(post_delete, sender=EmailTranslation)
+def emailtranslation_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    deltas = counters.new_deltas()
+    counters.add_translation(deltas, instance.email_id, instance.language, -1)
+    counters.apply(deltas)
+    search.unindex_translations([instance.pk])
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if muted() or not created:
+        return
+    deltas = counters.new_deltas()
+    counters.add_category(deltas)
+    counters.apply(deltas)
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    counters.forget_category(instance.pk)
+
+@receiver(bulk_saved, sender=Category)
+def categories_bulk_saved(sender, created, updated, **kwargs):
+    deltas = counters.new_deltas()
+    for category in created:
+        counters.add_category(deltas)
+    counters.apply(deltas)
+
+@receiver(bulk_deleted, sender=Category)
+def categories_bulk_deleted(sender, instances, **kwargs):
+    for category in instances:
+        counters.forget_category(category.pk)
+
+@receiver(bulk_saved, sender=Email)
+def emails_bulk_saved(sender, created, updated, **kwargs):
+    deltas = counters.new_deltas()
+    for email in created:
+        counters.add_email(deltas, email.category_id)
+    for email in updated:
+        counters.add_email(deltas, email._loaded_values['category_id'], -1)
+        counters.add_email(deltas, email.category_id)
+    counters.apply(deltas)
+    search.index_emails(created + updated)
+
+@receiver(bulk_saved, sender=EmailTranslation)
+def emailtranslations_bulk_saved(sender, created, updated, **kwargs):
+    deltas = counters.new_deltas()
+    for translation in created:
+        counters.add_translation(deltas, translation.email_id, translation.language)
+    for translation in updated:
+        previous = translation._loaded_values
+        counters.add_translation(deltas, previous['email_id'], previous['language'], -1)
+        counters.add_translation(deltas, translation.email_id, translation.language)
+    counters.apply(deltas)
+    search.index_translations(created + updated)
+
+@receiver(bulk_deleted, sender=EmailTranslation)
+def emailtranslations_bulk_deleted(sender, instances, **kwargs):
+    deltas = counters.new_deltas()
+    for translation in instances:
+        counters.add_translation(deltas, translation.email_id, translation.language, -1)
+    counters.apply(deltas)
+    search.unindex_translations([translation.pk for translation in instances])
+
+# Cached permissions, see permissions.py
+
+User = get_user_model()
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # is_active and is_superuser decide what has_perm() answers
+    permissions.forget_user(instance.pk)
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        permissions.forget_user(instance.pk)
+    elif pk_set:
+        # permission.user_set or group.user_set, pk_set holds the users
+        permissions.forget_user(*pk_set)
+    else:
+        permissions.forget_all()
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        permissions.forget_all()
+
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def permissions_changed(sender, **kwargs):
+    permissions.forget_all()
+
+# Per-view query stats, see querystats.py
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    if querystats.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(querystats.count_query)
+
+# Cached translation coverage, see coverage.py
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Email)
+@receiver(post_save, sender=EmailTranslation)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Email)
+@receiver(post_delete, sender=EmailTranslation)
+@receiver(bulk_saved)
+@receiver(bulk_deleted)
+def coverage_changed(sender, **kwargs):
+    coverage.forget()
+
+
+# Compiled mail merge templates, see merge.py
+
+@receiver(post_save, sender=EmailTranslation)
+@receiver(post_delete, sender=EmailTranslation)
+def merge_template_changed(sender, instance, **kwargs):
+    merge.forget(instance.pk)
+
+@receiver(bulk_saved, sender=EmailTranslation)
+def merge_templates_bulk_saved(sender, created, updated, **kwargs):
+    for translation in updated:
+        merge.forget(translation.pk)
+
+@receiver(bulk_deleted, sender=EmailTranslation)
+def merge_templates_bulk_deleted(sender, instances, **kwargs):
+    for translation in instances:
+        merge.forget(translation.pk)
+
+# Revision history of translation content, see revisions.py
+
+@receiver(post_save, sender=EmailTranslation)
+def revision_saved(sender, instance, **kwargs):
+    if muted():
+        return
+    revisions.record(revisions.changes(instance, instance._loaded_values))
+
+@receiver(post_delete, sender=EmailTranslation)
+def revision_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    revisions.record(revisions.changes(instance, None, deleted=True))
+
+@receiver(bulk_saved, sender=EmailTranslation)
+def revisions_bulk_saved(sender, created, updated, **kwargs):
+    revisions.record(
+        [change for translation in created for change in revisions.changes(translation, None)] +
+        [change for translation in updated for change in revisions.changes(translation, translation._loaded_values)])
+
+@receiver(bulk_deleted, sender=EmailTranslation)
+def revisions_bulk_deleted(sender, instances, **kwargs):
+    revisions.record([change for translation in instances
+        for change in revisions.changes(translation, None, deleted=True)])
+
+# Change log for the changes API, see changes.py
+
+ENTITIES = {Category: Change.CATEGORY, Email: Change.EMAIL, EmailTranslation: Change.TRANSLATION}
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Email)
+@receiver(post_save, sender=EmailTranslation)
+def change_saved(sender, instance, created, **kwargs):
+    if muted():
+        return
+    changes.log_saved(ENTITIES[sender], **{'created' if created else 'updated': [instance]})
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Email)
+@receiver(post_delete, sender=EmailTranslation)
+def change_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    changes.log_deleted(ENTITIES[sender], [instance.pk])
+
+@receiver(bulk_saved)
+def changes_bulk_saved(sender, created, updated, **kwargs):
+    if sender in ENTITIES:
+        changes.log_saved(ENTITIES[sender], created, updated)
+
+@receiver(bulk_deleted)
+def changes_bulk_deleted(sender, instances, **kwargs):
+    if sender in ENTITIES:
+        changes.log_deleted(ENTITIES[sender], [instance.pk for instance in instances])
+
+
+# Typeahead index of this process, see typeahead.py.  Applied on commit so a
+# rolled back save never shows up.
+
+def typeahead_saved(sender, instances):
+    rows = [typeahead.row(instance) for instance in instances]
+    transaction.on_commit(lambda: typeahead.saved(ENTITIES[sender], rows))
+
+def typeahead_deleted(sender, instances):
+    ids = [instance.pk for instance in instances]
+    transaction.on_commit(lambda: typeahead.deleted(ENTITIES[sender], ids))
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Email)
+def typeahead_name_saved(sender, instance, **kwargs):
+    if muted():
+        return
+    typeahead_saved(sender, [instance])
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Email)
+def typeahead_name_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    typeahead_deleted(sender, [instance])
+
+@receiver(bulk_saved, sender=Category)
+@receiver(bulk_saved, sender=Email)
+def typeahead_bulk_saved(sender, created, updated, **kwargs):
+    typeahead_saved(sender, created + updated)
+
+@receiver(bulk_deleted, sender=Category)
+@receiver(bulk_deleted, sender=Email)
+def typeahead_bulk_deleted(sender, instances, **kwargs):
+    typeahead_deleted(sender, instances)
+
+# Translation memory of this process, see translation_memory.py
+
+def translation_memory_written(email_ids):
+    email_ids = {pk for pk in email_ids if pk is not None}
+    transaction.on_commit(lambda: translation_memory.written(email_ids))
+
+@receiver(post_save, sender=EmailTranslation)
+@receiver(post_delete, sender=EmailTranslation)
+def translation_memory_translation_written(sender, instance, **kwargs):
+    if muted():
+        return
+    previous = getattr(instance, '_loaded_values', None)
+    translation_memory_written([instance.email_id, previous and previous['email_id']])
+
+@receiver(post_delete, sender=Email)
+def translation_memory_email_deleted(sender, instance, **kwargs):
+    if muted():
+        return
+    translation_memory_written([instance.pk])
+
+@receiver(bulk_saved, sender=EmailTranslation)
+def translation_memory_bulk_saved(sender, created, updated, **kwargs):
+    translation_memory_written([instance.email_id for instance in created]
+        + [pk for instance in updated for pk in (instance.email_id, instance._loaded_values['email_id'])])
+
+@receiver(bulk_deleted, sender=EmailTranslation)
+@receiver(bulk_deleted, sender=Email)
+def translation_memory_bulk_deleted(sender, instances, **kwargs):
+    translation_memory_written([instance.pk if sender is Email else instance.email_id for instance in instances])
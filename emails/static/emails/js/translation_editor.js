@@ -0,0 +1,27 @@
+document.querySelectorAll('.translation-form').forEach(function (form) {
+  form.addEventListener('submit', function (event) {
+    event.preventDefault();
+    var status = form.querySelector('.translation-status');
+    status.className = 'translation-status ml-2 text-muted';
+    status.textContent = 'Saving...';
+    fetch(form.action, {
+      method: 'POST',
+      body: new FormData(form),
+      headers: {'Accept': 'application/json'},
+      credentials: 'same-origin'
+    }).then(function (response) {
+      return response.json();
+    }).then(function (data) {
+      if (data.saved) {
+        status.className = 'translation-status ml-2 text-success';
+        status.textContent = 'Saved';
+      } else {
+        status.className = 'translation-status ml-2 text-danger';
+        status.textContent = (data.errors.content || [{message: 'Could not save'}])[0].message;
+      }
+    }).catch(function () {
+      status.className = 'translation-status ml-2 text-danger';
+      status.textContent = 'Could not save';
+    });
+  });
+});
@@ -0,0 +1,95 @@
+document.querySelectorAll('.translation-memory').forEach(function (panel) {
+  var form = panel.closest('form');
+  var prefix = panel.dataset.prefix;
+  var results = panel.querySelector('.translation-memory-results');
+  var hint = panel.querySelector('.translation-memory-hint');
+  var latest = 0;
+
+  function field(textarea, name) {
+    return form.querySelector('[name="' + textarea.name.replace(/-content$/, '-' + name) + '"]');
+  }
+
+  function english() {
+    var found = null;
+    form.querySelectorAll('textarea[name^="' + prefix + '-"]').forEach(function (textarea) {
+      var language = field(textarea, 'language');
+      if (language && language.value === 'EN' && textarea.value.trim()) {
+        found = textarea.value;
+      }
+    });
+    return found;
+  }
+
+  function insert(textarea, text) {
+    var start = textarea.selectionStart;
+    var before = textarea.value.slice(0, start);
+    var separator = before && !/\s$/.test(before) ? ' ' : '';
+    textarea.value = before + separator + text + textarea.value.slice(textarea.selectionEnd);
+    textarea.focus();
+    textarea.selectionStart = textarea.selectionEnd = start + separator.length + text.length;
+  }
+
+  function show(textarea, suggestions) {
+    results.textContent = '';
+    suggestions.forEach(function (suggestion) {
+      if (!suggestion.matches.length) {
+        return;
+      }
+      var item = document.createElement('li');
+      var sentence = document.createElement('strong');
+      sentence.textContent = suggestion.sentence;
+      item.appendChild(sentence);
+      var matches = document.createElement('ul');
+      suggestion.matches.forEach(function (match) {
+        var line = document.createElement('li');
+        line.textContent = match.translation + ' (' + Math.round(match.similarity * 100) + '%, ' +
+          match.emails + (match.emails === 1 ? ' email)' : ' emails)');
+        line.title = match.source;
+        var use = document.createElement('button');
+        use.type = 'button';
+        use.className = 'btn';
+        use.textContent = 'Use';
+        // Keep the translation's cursor where it is
+        use.addEventListener('mousedown', function (event) {
+          event.preventDefault();
+        });
+        use.addEventListener('click', function () {
+          insert(textarea, match.translation);
+        });
+        line.appendChild(use);
+        matches.appendChild(line);
+      });
+      item.appendChild(matches);
+      results.appendChild(item);
+    });
+    hint.textContent = results.children.length ? '' : 'No similar sentences translated yet.';
+  }
+
+  form.addEventListener('focusin', function (event) {
+    var textarea = event.target;
+    if (textarea.tagName !== 'TEXTAREA' || textarea.name.indexOf(prefix + '-') !== 0) {
+      return;
+    }
+    var language = field(textarea, 'language');
+    var source = english();
+    if (!language || language.value === 'EN' || !language.value || !source) {
+      results.textContent = '';
+      hint.textContent = 'Suggestions need an English translation and another language selected.';
+      return;
+    }
+    var request = ++latest;
+    var params = new URLSearchParams({source: source, language: language.value, exclude: panel.dataset.email});
+    fetch(panel.dataset.url + '?' + params, {
+      headers: {'Accept': 'application/json'},
+      credentials: 'same-origin'
+    }).then(function (response) {
+      return response.json();
+    }).then(function (data) {
+      if (request === latest) {
+        show(textarea, data.suggestions || []);
+      }
+    }).catch(function () {
+      hint.textContent = 'Could not load suggestions.';
+    });
+  });
+});
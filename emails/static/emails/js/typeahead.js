@@ -0,0 +1,79 @@
+document.querySelectorAll('.typeahead').forEach(function (form) {
+  var input = form.querySelector('input');
+  var results = form.querySelector('.typeahead-results');
+  var timer = null;
+  var latest = 0;
+  var active = -1;
+
+  function show(items) {
+    results.textContent = '';
+    active = -1;
+    items.forEach(function (item) {
+      var li = document.createElement('li');
+      var link = document.createElement('a');
+      link.href = item.url;
+      link.textContent = item.label;
+      if (item.detail || item.type === 'category') {
+        var detail = document.createElement('small');
+        detail.textContent = ' ' + (item.type === 'category' ? 'category' : item.detail);
+        link.appendChild(detail);
+      }
+      li.appendChild(link);
+      results.appendChild(li);
+    });
+  }
+
+  function highlight(index) {
+    var items = results.children;
+    if (!items.length) {
+      return;
+    }
+    if (active >= 0) {
+      items[active].classList.remove('active');
+    }
+    active = (index + items.length) % items.length;
+    items[active].classList.add('active');
+  }
+
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    var query = input.value.trim();
+    if (!query) {
+      show([]);
+      return;
+    }
+    timer = setTimeout(function () {
+      // Only the answer to the latest keystroke is shown
+      var request = ++latest;
+      fetch(input.dataset.url + '?q=' + encodeURIComponent(query), {
+        headers: {'Accept': 'application/json'},
+        credentials: 'same-origin'
+      }).then(function (response) {
+        return response.json();
+      }).then(function (data) {
+        if (request === latest) {
+          show(data.results || []);
+        }
+      }).catch(function () {
+        show([]);
+      });
+    }, 80);
+  });
+
+  input.addEventListener('keydown', function (event) {
+    if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+      event.preventDefault();
+      highlight(active + (event.key === 'ArrowDown' ? 1 : -1));
+    } else if (event.key === 'Enter' && active >= 0) {
+      event.preventDefault();
+      window.location = results.children[active].querySelector('a').href;
+    } else if (event.key === 'Escape') {
+      show([]);
+    }
+  });
+
+  input.addEventListener('blur', function () {
+    // Late enough for a click on a result to follow its link
+    setTimeout(function () { show([]); }, 200);
+  });
+});
@@ -0,0 +1,61 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Static files storage: every collected file gets the hash of its content in
+its name (see ManifestStaticFilesStorage), so a URL never changes meaning
+and browsers can keep the file for a year.  collectstatic also writes a
+gzip copy (name.gz) of each hashed text file, and a brotli copy (name.br)
+when the brotli package is installed, for StaticFilesMiddleware to send
+without compressing on every request.
+'''
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.json', '.map', '.html')
+# Smaller files aren't worth a second copy
+MIN_SIZE = 256
+
+
+def compressed_variants(data):
+    '''
+    Yields (suffix, compressed data) for each encoding that makes data smaller.
+    '''
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data) * 0.95:
+            yield suffix, compressed
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Before the first collectstatic (runserver, tests) there is no
+        # manifest; serve the files under their own names
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        if not kwargs.get('dry_run'):
+            for name in set(self.hashed_files.values()):
+                self.compress(name)
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE):
+            return
+        path = self.path(name)
+        if os.path.getsize(path) < MIN_SIZE:
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        for suffix, compressed in compressed_variants(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
@@ -0,0 +1,65 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+'''
+The most queries each view in emails/urls.py may run for one request, whatever
+the number of rows it shows.  A logged in user costs two of them (session and
+user), plus two for the permissions when they aren't cached yet.  Saves also
+count savepoints and the counter and search index updates in signals.py.
+
+Raise a budget only when the extra queries are worth it; a view that has
+started running a query per row needs fixing instead.
+'''
+
+QUERY_BUDGETS = {
+    'index': 6,
+    'email_create': 32,
+    'email_update': 33,
+    'translation_editor': 6,
+    'translation_save': 12,
+    'category_create': 4,
+    'category_update': 5,
+    'all_emails': 6,
+    'search': 6,
+    'all_categories': 5,
+    'email_detail': 6,
+    'category_detail': 6,
+    'query_stats': 5,
+    'email_history': 7,
+    'email_send': 6,
+    'outbox': 6,
+    'coverage': 7,
+    'coverage_export': 6,
+    'duplicates': 6,
+    'api_email_batch': 6,
+    'api_email_detail': 6,
+    'api_email_list': 7,
+    'api_email_merge': 5,
+    'api_autocomplete': 5,
+    'api_changes': 3,
+    'api_translation_memory': 4,
+    'api_export': 8,
+    'api_async_email_batch': 6,
+    'api_async_email_detail': 6,
+    'api_async_email_list': 7,
+}
+
+
+class QueryBudgetMixin:
+    '''
+    TestCase mixin: assertWithinQueryBudget() makes a request with self.client
+    and fails if the view runs more queries than its QUERY_BUDGETS entry.
+    '''
+    def assertWithinQueryBudget(self, url, data=None, method='get', **extra):
+        url_name = resolve(url.split('?')[0]).url_name
+        self.assertIn(url_name, QUERY_BUDGETS, 'No query budget for %r' % url_name)
+        budget = QUERY_BUDGETS[url_name]
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data, **extra)
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        if len(captured) > budget:
+            self.fail('%s ran %d queries, its budget is %d:\n%s' % (url_name, len(captured), budget,
+                '\n'.join('%d. %s' % (i, query['sql']) for i, query in enumerate(captured, start=1))))
+        return response
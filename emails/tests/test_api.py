@@ -0,0 +1,257 @@
+import asyncio
+import csv
+import io
+import json
+import threading
+import zipfile
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User, Permission
+
+from emails import api, async_api, exporter, querystats
+from emails.models import ApiToken, Category, Email, EmailTranslation
+from emails.pagination import encode_cursor
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(Permission.objects.get(name="Can view email"))
+        cls.token1 = ApiToken.objects.create(user=cls.test_user1, name='No permissions')
+        cls.token2 = ApiToken.objects.create(user=cls.test_user2, name='CRM')
+
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Hello", name_esp="Hola", category=None)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido')
+        EmailTranslation.objects.create(email=cls.email1, language='FR', content='Bienvenue')
+
+    def get(self, url, token=None, **params):
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + token.key} if token else {}
+        return self.client.get(url, params, **headers)
+
+    def test_token_is_generated(self):
+        self.assertEqual(len(self.token1.key), 40)
+        self.assertNotEqual(self.token1.key, self.token2.key)
+
+    def test_authentication_required(self):
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(reverse('api_email_detail', args=(self.email1.id,)), HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(response.status_code, 401)
+
+    def test_permission_required(self):
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)), self.token1)
+        self.assertEqual(response.status_code, 403)
+
+    def test_email_detail(self):
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)), self.token2)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['name_eng'], 'Welcome')
+        self.assertEqual(data['category'], {'id': self.category1.id, 'name': 'Company Introductions'})
+        self.assertEqual([t['language'] for t in data['translations']], ['ES', 'FR'])
+
+    def test_email_detail_one_language(self):
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)), self.token2, lang='fr')
+        self.assertEqual(response.json()['translations'],
+            [{'language': 'FR', 'language_name': 'French', 'content': 'Bienvenue', 'content_html': '<p>Bienvenue</p>'}])
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)), self.token2, lang='DE')
+        self.assertEqual(response.status_code, 404)
+        response = self.get(reverse('api_email_detail', args=(self.email1.id,)), self.token2, lang='XX')
+        self.assertEqual(response.status_code, 400)
+
+    def test_email_not_found(self):
+        response = self.get(reverse('api_email_detail', args=(999,)), self.token2)
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch(self):
+        response = self.get(reverse('api_email_batch'), self.token2,
+            ids='%s,999,%s' % (self.email2.id, self.email1.id))
+        data = response.json()
+        self.assertEqual([email['id'] for email in data['emails']], [self.email2.id, self.email1.id])
+        self.assertEqual(data['emails'][0]['category'], None)
+        self.assertEqual(data['missing'], [999])
+
+    def test_batch_bad_ids(self):
+        self.assertEqual(self.get(reverse('api_email_batch'), self.token2, ids='1,a').status_code, 400)
+        self.assertEqual(self.get(reverse('api_email_batch'), self.token2).status_code, 400)
+
+    def test_list(self):
+        response = self.get(reverse('api_email_list'), self.token2, per_page=1)
+        data = response.json()
+        self.assertEqual([email['name_eng'] for email in data['emails']], ['Hello'])
+        response = self.get(reverse('api_email_list'), self.token2, per_page=1, after=data['next'])
+        data = response.json()
+        self.assertEqual([email['name_eng'] for email in data['emails']], ['Welcome'])
+        self.assertEqual(data['next'], None)
+        self.assertEqual(self.get(reverse('api_email_list'), self.token2, per_page=0).status_code, 400)
+
+    def test_list_bad_cursor(self):
+        for values in (['x', 'notanint'], [None, 1], ['Hello'], [['Hello'], 1]):
+            with self.subTest(values=values):
+                response = self.get(reverse('api_email_list'), self.token2, after=encode_cursor(values))
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get(reverse('api_email_list'), self.token2, after='!!').status_code, 400)
+
+    def test_fixed_query_count(self):
+        ids = [self.email1.id]
+        for i in range(20):
+            email = Email.objects.create(name_eng="Email %s" % i, name_esp="Correo %s" % i, category=self.category1)
+            EmailTranslation.objects.create(email=email, language='EN', content='Content %s' % i)
+            ids.append(email.id)
+        cache.clear()
+        # token, user permissions, group permissions, emails, translations
+        with self.assertNumQueries(5):
+            response = self.get(reverse('api_email_batch'), self.token2, ids=','.join(map(str, ids)))
+        self.assertEqual(len(response.json()['emails']), 21)
+        # The permissions are cached now
+        with self.assertNumQueries(3):
+            response = self.get(reverse('api_email_batch'), self.token2, ids=','.join(map(str, ids)))
+
+    def test_session_login_works(self):
+        login = self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('api_email_detail', args=(self.email1.id,)))
+        self.assertEqual(response.status_code, 200)
+
+class AsyncApiTests(TransactionTestCase):
+    def setUp(self):
+        self.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        self.test_user1.user_permissions.add(Permission.objects.get(name="Can view email"))
+        self.token1 = ApiToken.objects.create(user=self.test_user1, name='CRM')
+        self.emails = [Email.objects.create(name_eng='Email %02d' % i, name_esp='Correo %02d' % i) for i in range(5)]
+        for email in self.emails:
+            EmailTranslation.objects.create(email=email, language='FR', content='Bonjour')
+
+    def get(self, url, token, **params):
+        if params:
+            url += '?' + urlencode(params)
+        return self.async_client.get(url, authorization='Token ' + token.key)
+
+    async def test_detail_list_and_batch(self):
+        email = self.emails[0]
+        response = await self.get(reverse('api_async_email_detail', args=(email.id,)), self.token1)
+        self.assertEqual(response.json()['translations'][0]['content'], 'Bonjour')
+        response = await self.get(reverse('api_async_email_batch'), self.token1, ids='%d,999' % email.id)
+        self.assertEqual(response.json()['missing'], [999])
+        response = await self.get(reverse('api_async_email_list'), self.token1, per_page=2)
+        self.assertEqual(len(response.json()['emails']), 2)
+        response = await self.async_client.get(reverse('api_async_email_detail', args=(email.id,)))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_concurrent_requests_share_the_pool(self):
+        threads = set()
+        serialize_emails = api.serialize_emails
+        lock = threading.Lock()
+        inside = [0]
+        together = threading.Event()
+        gave_up = threading.Event()
+
+        def serialize_slowly(ids, lang=''):
+            threads.add(threading.current_thread().name)
+            with lock:
+                inside[0] += 1
+                if inside[0] >= 2:
+                    together.set()
+            try:
+                # Holds the first requests until two are in the pool at the same time;
+                # a pool of one thread gives up once instead of on every request
+                if not gave_up.is_set() and not together.wait(timeout=5):
+                    gave_up.set()
+                return serialize_emails(ids, lang)
+            finally:
+                with lock:
+                    inside[0] -= 1
+
+        with mock.patch('emails.api.serialize_emails', serialize_slowly):
+            responses = await asyncio.gather(*[
+                self.get(reverse('api_async_email_detail', args=(self.emails[i % 5].id,)), self.token1)
+                for i in range(50)
+            ])
+        self.assertEqual({response.status_code for response in responses}, {200})
+        # Fifty requests in flight at once, at least two of them in the pool
+        # together, served by at most ASYNC_DB_THREADS threads
+        self.assertFalse(gave_up.is_set())
+        self.assertTrue(len(threads) >= 2)
+        self.assertTrue(all(name.startswith('emails-db') for name in threads))
+        self.assertTrue(len(threads) <= async_api.executor()._max_workers)
+
+    @override_settings(QUERY_STATS=True, QUERY_STATS_FLUSH_INTERVAL=3600)
+    async def test_query_stats_count_pool_queries(self):
+        querystats.buffer.pop()
+        await self.get(reverse('api_async_email_detail', args=(self.emails[0].id,)), self.token1)
+        stats = querystats.buffer.pop()
+        # token, emails and translations at least, all run in a pool thread
+        self.assertTrue(stats['api_async_email_detail']['queries'] >= 3)
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(Permission.objects.get(name="Can view email"))
+        cls.token2 = ApiToken.objects.create(user=cls.test_user2, name='Backups')
+
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        Category.objects.create(name="Empty")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Hello", name_esp="Hola", category=None)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido, "amigo"')
+        EmailTranslation.objects.create(email=cls.email1, language='FR', content='Bienvenue\nà bientôt')
+
+    def export(self, file_format):
+        response = self.client.get(reverse('api_export', args=(file_format,)),
+            HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_needs_permission(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('api_export', args=('csv',)))
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('api_export', args=('xml',)), HTTP_AUTHORIZATION='Token ' + self.token2.key)
+        self.assertEqual(response.status_code, 404)
+
+    def test_csv(self):
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertTrue('attachment; filename="emails-' in response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows, [
+            ['category', 'name_eng', 'name_esp', 'language', 'content'],
+            ['Company Introductions', 'Welcome', 'Bienvenido', 'ES', 'Bienvenido, "amigo"'],
+            ['Company Introductions', 'Welcome', 'Bienvenido', 'FR', 'Bienvenue\nà bientôt'],
+            ['', 'Hello', 'Hola', '', ''],
+        ])
+
+    def test_jsonl(self):
+        response, content = self.export('jsonl')
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(records[:2], [{'category': 'Company Introductions'}, {'category': 'Empty'}])
+        self.assertEqual(records[2]['name_eng'], 'Welcome')
+        self.assertEqual([t['language'] for t in records[2]['translations']], ['ES', 'FR'])
+        self.assertEqual(records[3]['translations'], [])
+
+    def test_zip(self):
+        response, content = self.export('zip')
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertEqual(len(archive.namelist()), len(EmailTranslation.LANGUAGES))
+        french = archive.read('FR-french.csv').decode()
+        self.assertTrue('Welcome,Bienvenido,FR' in french)
+        self.assertEqual(archive.read('DE-german.csv').decode().strip(), 'category,name_eng,name_esp,language,content')
+
+    def test_small_chunks(self):
+        for i in range(5):
+            email = Email.objects.create(name_eng="Email %s" % i, name_esp="Correo %s" % i, category=self.category1)
+            EmailTranslation.objects.create(email=email, language='EN', content='Content %s' % i)
+        rows = list(csv.reader(io.StringIO(b''.join(exporter.export_csv(chunk_size=2)).decode())))
+        self.assertEqual(len(rows), 1 + 3 + 5)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(exporter.export_zip(chunk_size=2))))
+        self.assertEqual(len(archive.read('EN-english.csv').decode().splitlines()), 6)
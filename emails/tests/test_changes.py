@@ -0,0 +1,140 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.contrib.auth.models import User, Permission
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from emails import changes
+from emails.bulk import bulk_create, bulk_delete
+from emails.models import ApiToken, Category, Change, Email, EmailTranslation
+from emails.signals import send_bulk_saved
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class ChangeLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Company Introductions")
+        cls.email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category)
+        cls.translation = EmailTranslation.objects.create(email=cls.email, language='ES', content='Bienvenido')
+
+    def entries(self, after=0):
+        return [(change['entity'], change['id'], change['op']) for change in changes.since(after)[0]]
+
+    def test_saves_and_deletes_are_logged(self):
+        self.assertEqual(self.entries(), [
+            ('category', self.category.id, 'create'),
+            ('email', self.email.id, 'create'),
+            ('translation', self.translation.id, 'create'),
+        ])
+        start = changes.latest_seq()
+        self.email.name_eng = "Welcome!"
+        self.email.save()
+        translation_id = self.translation.id
+        self.translation.delete()
+        self.assertEqual(self.entries(start), [
+            ('email', self.email.id, 'update'),
+            ('translation', translation_id, 'delete'),
+        ])
+
+    def test_bulk_writes_are_logged_once_per_write(self):
+        start = changes.latest_seq()
+        emails = bulk_create(Email, [Email(name_eng="One"), Email(name_eng="Two")])
+        with CaptureQueriesContext(connection) as queries:
+            send_bulk_saved(Email, created=emails)
+        self.assertEqual(len([q for q in queries if Change._meta.db_table in q['sql']]), 1)
+        bulk_delete(Email, emails)
+        ids = [email.id for email in emails]
+        self.assertEqual(self.entries(start),
+            [('email', pk, 'create') for pk in ids] + [('email', pk, 'delete') for pk in ids])
+
+    def test_paging(self):
+        Category.objects.bulk_create([Category(name="Category %d" % i) for i in range(3)])
+        send_bulk_saved(Category, created=Category.objects.exclude(pk=self.category.pk))
+        page, more = changes.since(0, limit=4)
+        self.assertEqual(len(page), 4)
+        self.assertTrue(more)
+        page, more = changes.since(page[-1]['seq'], limit=4)
+        self.assertEqual(len(page), 2)
+        self.assertFalse(more)
+
+    @override_settings(CHANGES_SETTLE_SECONDS=60)
+    def test_fresh_changes_are_held_back(self):
+        self.assertEqual(self.entries(), [])
+        Change.objects.update(created=Change.objects.first().created - datetime.timedelta(minutes=2))
+        self.assertEqual(len(self.entries()), 3)
+
+    @override_settings(CHANGES_SETTLE_SECONDS=5)
+    def test_nothing_after_an_unsettled_change_is_returned(self):
+        # A lower seq still settling, e.g. a transaction that commits later or a writer whose seq and time crossed
+        old = Change.objects.first().created - datetime.timedelta(seconds=10)
+        Change.objects.update(created=old)
+        last = changes.latest_seq()
+        unsettled = Change.objects.create(entity=Change.EMAIL, object_id=self.email.id, operation=Change.UPDATE)
+        Change.objects.create(entity=Change.EMAIL, object_id=self.email.id, operation=Change.DELETE, created=old)
+        self.assertEqual(len(self.entries()), 3)
+        ids, seq = changes.touched(0)
+        self.assertEqual(seq, last)
+        Change.objects.filter(pk=unsettled.pk).update(created=old)
+        self.assertEqual([change['seq'] for change in changes.since(last)[0]], [unsettled.seq, unsettled.seq + 1])
+        self.assertEqual(changes.touched(seq)[1], unsettled.seq + 1)
+
+    def test_stamped_by_the_database_clock(self):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=1)):
+            Email.objects.create(name_eng="Skewed", name_esp="Desfasado")
+        self.assertLess(Change.objects.last().created, timezone.now() + datetime.timedelta(hours=1))
+
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class ChangesApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        user.user_permissions.add(Permission.objects.get(codename='view_email'))
+        cls.token = ApiToken.objects.create(user=user, name='Sync')
+        cls.category = Category.objects.create(name="Company Introductions")
+        cls.email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category)
+
+    def get(self, **params):
+        return self.client.get(reverse('api_changes'), params, HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_needs_permission(self):
+        response = self.client.get(reverse('api_changes'), {'since': 0})
+        self.assertEqual(response.status_code, 401)
+
+    def test_without_since_starts_from_now(self):
+        data = self.get().json()
+        self.assertEqual(data, {'changes': [], 'next': changes.latest_seq(), 'more': False})
+
+    def test_follow(self):
+        data = self.get(since=0, limit=1).json()
+        self.assertEqual([(c['entity'], c['id'], c['op']) for c in data['changes']],
+            [('category', self.category.id, 'create')])
+        self.assertTrue(data['more'])
+        data = self.get(since=data['next']).json()
+        self.assertEqual([(c['entity'], c['id'], c['op']) for c in data['changes']],
+            [('email', self.email.id, 'create')])
+        self.assertFalse(data['more'])
+        data = self.get(since=data['next']).json()
+        self.assertEqual(data['changes'], [])
+        self.assertEqual(data['next'], changes.latest_seq())
+
+    def test_bad_parameters(self):
+        for params in ({'since': 'x'}, {'since': -1}, {'since': 0, 'limit': 0}, {'since': 0, 'limit': 5000}):
+            self.assertEqual(self.get(**params).status_code, 400, params)
+
+    def test_fixed_query_count(self):
+        Category.objects.bulk_create([Category(name="Category %d" % i) for i in range(50)])
+        send_bulk_saved(Category, created=Category.objects.exclude(pk=self.category.pk))
+        cache.clear()
+        # token, user permissions, group permissions, the page
+        with self.assertNumQueries(4):
+            response = self.get(since=0, limit=1000)
+        self.assertEqual(len(response.json()['changes']), 52)
+        # The permissions are cached now
+        with self.assertNumQueries(2):
+            self.get(since=0, limit=1000)
@@ -0,0 +1,281 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from emails import benchmark, counters, querystats, search, seed
+from emails.management.commands import vendor_bootstrap
+from emails.models import Category, Email, EmailTranslation, ViewQueryStats
+
+class RenderTranslationsCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        EmailTranslation.objects.bulk_create([
+            EmailTranslation(email=cls.email1, language='ES', content='Bienvenido\nHola'),
+            EmailTranslation(email=cls.email1, language='FR', content='Bienvenue'),
+        ])
+
+    def test_backfills_missing_html(self):
+        out = StringIO()
+        call_command('render_translations', '--batch-size', '1', stdout=out)
+        self.assertTrue('Rendered 2 translations.' in out.getvalue())
+        self.assertEqual(EmailTranslation.objects.get(language='ES').content_html, '<p>Bienvenido<br>Hola</p>')
+
+        out = StringIO()
+        call_command('render_translations', stdout=out)
+        self.assertTrue('Rendered 0 translations.' in out.getvalue())
+
+    def test_all_rerenders(self):
+        call_command('render_translations', stdout=StringIO())
+        EmailTranslation.objects.update(content_html='<p>stale</p>')
+        call_command('render_translations', '--all', stdout=StringIO())
+        self.assertEqual(EmailTranslation.objects.get(language='FR').content_html, '<p>Bienvenue</p>')
+
+class ImportEmailsCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido')
+
+    def write_file(self, name, text):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_import_csv(self):
+        path = self.write_file('emails.csv',
+            'category,name_eng,name_esp,language,content\n'
+            'Company Introductions,Hello,Hola,EN,Hello there\n'
+            'Company Introductions,Hello,Hola,FR,Bonjour\n'
+            'Refunds,Refund,Reembolso,ES,"Su reembolso,\nha sido procesado"\n'
+            ',Broken,Roto,XX,Nope\n'
+        )
+        out, err = StringIO(), StringIO()
+        call_command('import_emails', path, '--batch-size', '2', stdout=out, stderr=err)
+        self.assertTrue('1 categories, 2 emails and 3 translations created' in out.getvalue())
+        self.assertTrue("Line 6 skipped: Unknown language 'XX'." in err.getvalue())
+
+        hello = Email.objects.get(name_eng='Hello')
+        self.assertEqual(hello.category, self.category1)
+        self.assertEqual(sorted(hello.emailtranslation_set.values_list('language', flat=True)), ['EN', 'FR'])
+        refund = EmailTranslation.objects.get(email__name_eng='Refund')
+        self.assertEqual(refund.email.category.name, 'Refunds')
+        self.assertEqual(refund.content_html, '<p>Su reembolso,<br>ha sido procesado</p>')
+
+        # Counters and the search index are kept up to date
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+        self.assertEqual([result.email for result in search.search('procesado')], [refund.email])
+
+    def test_import_csv_saved_by_excel(self):
+        path = self.write_file('emails.csv', '\ufeffname_eng,name_esp,language,content\nHello,Hola,EN,Hello there\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_emails', path, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertEqual(Email.objects.get(name_eng='Hello').emailtranslation_set.get().content, 'Hello there')
+
+    def test_import_jsonl_upsert(self):
+        path = self.write_file('emails.jsonl',
+            '{"name_eng": "Welcome", "translations": [{"language": "ES", "content": "Bienvenida"}, {"language": "DE", "content": "Willkommen"}]}\n'
+            '\n'
+            '{"category": "Empty category"}\n'
+            'not json\n'
+        )
+        out, err = StringIO(), StringIO()
+        call_command('import_emails', path, '--upsert', stdout=out, stderr=err)
+        self.assertTrue('Line 4 skipped: Invalid JSON' in err.getvalue())
+        self.assertEqual(Email.objects.count(), 1)
+        email = Email.objects.get()
+        self.assertEqual(email.name_esp, 'Bienvenido')
+        self.assertEqual(email.category, self.category1)
+        self.assertEqual(dict(email.emailtranslation_set.values_list('language', 'content')),
+            {'ES': 'Bienvenida', 'DE': 'Willkommen'})
+        self.assertTrue(Category.objects.filter(name='Empty category').exists())
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_dry_run(self):
+        path = self.write_file('emails.csv',
+            'category,name_eng,name_esp,language,content\n'
+            'New category,Hello,Hola,EN,Hello there\n'
+            'New category,Goodbye,Adios,EN,Bye\n'
+        )
+        out = StringIO()
+        call_command('import_emails', path, '--dry-run', '--batch-size', '1', stdout=out)
+        self.assertTrue('Dry run, nothing was saved.' in out.getvalue())
+        self.assertTrue('1 categories, 2 emails and 2 translations created' in out.getvalue())
+        self.assertEqual(Email.objects.count(), 1)
+        self.assertFalse(Category.objects.filter(name='New category').exists())
+
+class ExportEmailsCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido')
+        EmailTranslation.objects.create(email=cls.email1, language='FR', content='Bienvenue')
+
+    def test_export_then_import(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'emails.jsonl')
+        out = StringIO()
+        call_command('export_emails', '--format', 'jsonl', '-o', path, stdout=out)
+        self.assertTrue('Wrote' in out.getvalue())
+
+        Email.objects.all().delete()
+        Category.objects.all().delete()
+        call_command('import_emails', path, stdout=StringIO())
+        email = Email.objects.get()
+        self.assertEqual(email.category.name, 'Company Introductions')
+        self.assertEqual(dict(email.emailtranslation_set.values_list('language', 'content')),
+            {'ES': 'Bienvenido', 'FR': 'Bienvenue'})
+
+@override_settings(QUERY_STATS=True, QUERY_STATS_FLUSH_INTERVAL=3600)
+class QueryStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!', is_staff=True)
+
+    def setUp(self):
+        querystats.reset()
+        self.addCleanup(querystats.buffer.pop)
+        self.client.login(username='test_user1', password='X$G123**3!')
+
+    def test_middleware_records_per_view(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        self.client.get(reverse('all_categories'))
+        self.assertEqual(ViewQueryStats.objects.count(), 0)
+
+        querystats.flush()
+        index = ViewQueryStats.objects.get(url_name='index')
+        self.assertEqual(index.requests, 2)
+        # The second request has the permissions cached
+        self.assertTrue(index.max_queries < index.queries < 2 * index.max_queries)
+        self.assertTrue(index.max_queries > 0)
+        self.assertTrue(0 < index.db_time <= index.total_time)
+        self.assertEqual(ViewQueryStats.objects.get(url_name='all_categories').requests, 1)
+
+        self.client.get(reverse('index'))
+        querystats.flush()
+        self.assertEqual(ViewQueryStats.objects.get(url_name='index').requests, 3)
+
+    @override_settings(QUERY_STATS=False)
+    def test_off_by_default(self):
+        self.client.get(reverse('index'))
+        querystats.flush()
+        self.assertEqual(ViewQueryStats.objects.count(), 0)
+
+    def test_staff_page(self):
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual([row.url_name for row in response.context['stats']], ['index'])
+        self.assertTrue('<td>index</td>' in response.content.decode())
+
+        User.objects.filter(pk=self.test_user1.pk).update(is_staff=False)
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_command(self):
+        self.client.get(reverse('all_categories'))
+        out = StringIO()
+        call_command('query_stats', '--reset', stdout=out)
+        self.assertTrue('all_categories' in out.getvalue())
+        self.assertEqual(ViewQueryStats.objects.count(), 0)
+
+        out = StringIO()
+        call_command('query_stats', stdout=out)
+        self.assertTrue('Nothing recorded yet.' in out.getvalue())
+
+class SeedEmailsCommandTests(TestCase):
+    def test_seed(self):
+        out = StringIO()
+        call_command('seed_emails', '--categories', '3', '--emails', '4', '--languages', 'EN,FR', stdout=out)
+        self.assertTrue('3 categories, 12 emails and 24 translations created' in out.getvalue())
+        self.assertEqual(Email.objects.filter(category__name='Sales 1').count(), 4)
+        self.assertEqual(set(EmailTranslation.objects.values_list('language', flat=True)), {'EN', 'FR'})
+        self.assertEqual(counters.dashboard_stats()['num_emailtranslations'], 24)
+        lengths = [len(content) for content in EmailTranslation.objects.values_list('content', flat=True)]
+        self.assertTrue(min(lengths) >= seed.MIN_CONTENT_LENGTH and max(lengths) <= 2000)
+
+        # Same seed, same catalog
+        out = StringIO()
+        call_command('seed_emails', '--categories', '3', '--emails', '4', '--languages', 'EN,FR', '--upsert', stdout=out)
+        self.assertTrue('0 categories, 0 emails and 0 translations created, 0 translations updated' in out.getvalue())
+
+    def test_reproducible(self):
+        small = list(seed.catalog(2, 3, seed=7))
+        self.assertEqual(small, list(seed.catalog(2, 3, seed=7)))
+        self.assertEqual(small[2:], list(seed.catalog(2, 5, seed=7))[2:8])
+        self.assertNotEqual(small, list(seed.catalog(2, 3, seed=8)))
+
+class BenchmarkTests(TestCase):
+    def test_run_and_compare(self):
+        results = benchmark.run(['1x4x2'], repeat=1)
+        self.assertEqual(Email.objects.count(), 0)
+        views = results['1x4x2']['views']
+        self.assertEqual(results['1x4x2']['emails'], 4)
+        # Warm permission cache: session, user, page state, emails and categories
+        self.assertEqual(views['all_emails']['queries'], 5)
+        self.assertTrue(views['email_detail']['median_ms'] > 0)
+
+        from emails.urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns if not pattern.name.startswith('api_async_')} - set(views), set())
+
+        self.assertEqual(benchmark.compare(results, results), [])
+        slower = {'1x4x2': {'views': {'all_emails': {'median_ms': views['all_emails']['median_ms'] / 2, 'queries': 3}}}}
+        self.assertEqual([(view, what) for size, view, what, before, after in benchmark.compare(results, slower)],
+            [('all_emails', 'queries'), ('all_emails', 'median_ms')])
+
+    def test_bad_size(self):
+        with self.assertRaises(ValueError):
+            benchmark.parse_size('10x50')
+        with self.assertRaises(ValueError):
+            benchmark.parse_size('1x1x9')
+
+
+class VendorBootstrapCommandTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.output = os.path.join(directory, 'bootstrap.css')
+        with open(self.output, 'wb') as f:
+            f.write(b'/* subset */')
+        self.release = b'/*! Bootstrap v4.1.3 */.btn{display:inline-block}'
+        patcher = mock.patch.object(vendor_bootstrap, 'INTEGRITY', vendor_bootstrap.integrity(self.release))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_integrity(self):
+        self.assertEqual(vendor_bootstrap.integrity(b''),
+            'sha384-OLBgp1GsljhM2TJ+sbHjaiH9txEUvgdDTAzHv2P24donTt6/529l+9Ua0vFImLlb')
+
+    def test_download_is_checked(self):
+        with mock.patch('urllib.request.urlopen', return_value=BytesIO(self.release + b' ')):
+            with self.assertRaisesMessage(CommandError, 'not Bootstrap 4.1.3'):
+                call_command('vendor_bootstrap', '-o', self.output, stdout=StringIO())
+        with open(self.output, 'rb') as f:
+            self.assertEqual(f.read(), b'/* subset */')
+        with mock.patch('urllib.request.urlopen', return_value=BytesIO(self.release)):
+            call_command('vendor_bootstrap', '-o', self.output, stdout=StringIO())
+        with open(self.output, 'rb') as f:
+            self.assertEqual(f.read(), self.release)
+
+    def test_from_file(self):
+        path = self.output + '.min'
+        with open(path, 'wb') as f:
+            f.write(self.release)
+        call_command('vendor_bootstrap', '--from-file', path, '-o', self.output, stdout=StringIO())
+        with open(self.output, 'rb') as f:
+            self.assertEqual(f.read(), self.release)
@@ -0,0 +1,124 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from emails import counters
+from emails.models import Category, Counter, Email, EmailTranslation
+
+def counter_value(scope, key):
+    counter = Counter.objects.filter(scope=scope, key=key).first()
+    return counter.value if counter else 0
+
+class CounterSignalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.category2 = Category.objects.create(name="Company Information")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Hello", name_esp="Hola", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido')
+        EmailTranslation.objects.create(email=cls.email1, language='EN', content='Welcome')
+
+    def test_counts_after_create(self):
+        self.assertEqual(counter_value('total', 'emails'), 2)
+        self.assertEqual(counter_value('total', 'translations'), 2)
+        self.assertEqual(counter_value('language', 'ES'), 1)
+        self.assertEqual(counter_value('category', str(self.category1.id)), 2)
+        self.assertEqual(counters.translation_count(self.email1.id), 2)
+
+    def test_categories(self):
+        self.assertEqual(counter_value('total', 'categories'), 2)
+        Category.objects.get(id=self.category1.id).delete()
+        self.assertEqual(counter_value('total', 'categories'), 1)
+        self.assertEqual(counter_value('category', 'none'), 2)
+        category = Category.objects.create(name="Holidays")
+        category.name = "Public holidays"
+        category.save()
+        self.assertEqual(counter_value('total', 'categories'), 2)
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_reparent_translation(self):
+        translation = EmailTranslation.objects.get(email=self.email1, language='ES')
+        translation.email = self.email2
+        translation.language = 'FR'
+        translation.save()
+        self.assertEqual(counters.translation_count(self.email1.id), 1)
+        self.assertEqual(counters.translation_count(self.email2.id), 1)
+        self.assertEqual(counter_value('language', 'ES'), 0)
+        self.assertEqual(counter_value('language', 'FR'), 1)
+        self.assertEqual(counter_value('total', 'translations'), 2)
+
+    def test_move_email_to_other_category(self):
+        email = Email.objects.get(id=self.email2.id)
+        email.category = self.category2
+        email.save()
+        self.assertEqual(counter_value('category', str(self.category1.id)), 1)
+        self.assertEqual(counter_value('category', str(self.category2.id)), 1)
+        self.assertEqual(counter_value('total', 'emails'), 2)
+
+    def test_delete_translation_and_email(self):
+        EmailTranslation.objects.filter(language='EN').delete()
+        self.assertEqual(counter_value('total', 'translations'), 1)
+        self.assertEqual(counters.translation_count(self.email1.id), 1)
+
+        Email.objects.get(id=self.email1.id).delete()
+        self.assertEqual(counter_value('total', 'emails'), 1)
+        self.assertEqual(counters.translation_count(self.email1.id), 0)
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_delete_category(self):
+        self.category1.delete()
+        self.assertEqual(counter_value('category', 'none'), 2)
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+class ReconcileCountersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido')
+
+    def test_reconcile_repairs_drift(self):
+        # Bulk writes skip the signals
+        EmailTranslation.objects.bulk_create([EmailTranslation(email=self.email1, language='FR', content='Bienvenue')])
+        Counter.objects.filter(scope='total', key='emails').update(value=10)
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertTrue('Repaired 4 counters.' in out.getvalue())
+        self.assertEqual(counter_value('total', 'emails'), 1)
+        self.assertEqual(counter_value('total', 'translations'), 2)
+        self.assertEqual(counter_value('language', 'FR'), 1)
+        self.assertEqual(counters.translation_count(self.email1.id), 2)
+
+    def test_dry_run_changes_nothing(self):
+        Counter.objects.filter(scope='total', key='emails').update(value=10)
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertTrue('total:emails stored 10, actual 1' in out.getvalue())
+        self.assertEqual(counter_value('total', 'emails'), 10)
+
+class IndexStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        for i in range(5):
+            email = Email.objects.create(name_eng="Email %s" % i, name_esp="Correo %s" % i, category=cls.category1)
+            EmailTranslation.objects.create(email=email, language='FR', content='Bonjour')
+
+    def test_stats_in_page(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_emails'], 5)
+        self.assertEqual(response.context['num_emailtranslations'], 5)
+        self.assertEqual(response.context['translations_per_language'], [('French', 5)])
+        self.assertTrue("Company Introductions: 5" in str(response.content))
+
+    def test_no_count_queries(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        with self.assertNumQueries(6):
+            self.client.get(reverse('index'))
@@ -0,0 +1,149 @@
+import io
+import random
+from unittest import mock
+
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from emails import duplicates
+from emails.models import Category, Email, EmailTranslation, TranslationSignature
+
+WELCOME = ('Dear customer, thank you for your order. Your package will arrive within three working days. '
+    'If anything is missing please reply to this email and we will sort it out. Kind regards, the team')
+HOLIDAYS = ('Hello, our office is closed on public holidays. We will answer your message as soon as we can '
+    'after we open again. For urgent questions about deliveries please call the number on our website.')
+
+def words(seed, n=40):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+        'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa']) for i in range(n))
+
+class MinHashTests(TestCase):
+    def test_signature_estimates_jaccard_similarity(self):
+        edited = WELCOME.replace('three', 'five')
+        a, b = duplicates.shingles(WELCOME), duplicates.shingles(edited)
+        jaccard = len(a & b) / len(a | b)
+        estimate = duplicates.similarity(duplicates.minhash(WELCOME), duplicates.minhash(edited))
+        self.assertAlmostEqual(estimate, jaccard, delta=0.15)
+        self.assertEqual(duplicates.similarity(duplicates.minhash(WELCOME), duplicates.minhash(WELCOME.upper())), 1)
+        self.assertLess(duplicates.similarity(duplicates.minhash(WELCOME), duplicates.minhash(HOLIDAYS)), 0.1)
+
+    def test_short_and_empty_texts(self):
+        self.assertEqual(duplicates.shingles('Hi there'), {'hi there'})
+        self.assertEqual(duplicates.minhash('...'), b'')
+
+    def test_bands_find_pairs_at_the_threshold(self):
+        for threshold in (0.5, 0.8, 0.95):
+            rows = duplicates.lsh_rows(threshold)
+            bands = duplicates.NUM_HASHES // rows
+            self.assertGreaterEqual(1 - (1 - threshold ** rows) ** bands, duplicates.RECALL)
+        self.assertLess(duplicates.lsh_rows(0.5), duplicates.lsh_rows(0.9))
+
+
+class DuplicatesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Welcome 2", name_esp="Bienvenido 2")
+        cls.email3 = Email.objects.create(name_eng="Welcome (new)", name_esp="Bienvenido (nuevo)")
+        cls.email4 = Email.objects.create(name_eng="Holidays", name_esp="Vacaciones")
+        EmailTranslation.objects.create(email=cls.email1, language='EN', content=WELCOME)
+        EmailTranslation.objects.create(email=cls.email2, language='EN', content=WELCOME + ' Thanks!')
+        EmailTranslation.objects.create(email=cls.email3, language='EN', content=WELCOME.replace('three', 'five'))
+        EmailTranslation.objects.create(email=cls.email4, language='EN', content=HOLIDAYS)
+        # Same text in another language isn't a duplicate of the English ones
+        EmailTranslation.objects.create(email=cls.email4, language='FR', content=WELCOME)
+        EmailTranslation.objects.create(email=cls.email3, language='FR', content='Bienvenue')
+
+    def groups(self, language='EN', threshold=0.6):
+        return [members for similarity, members in duplicates.find_groups(language, threshold)]
+
+    def translation(self, email, language='EN'):
+        return EmailTranslation.objects.get(email=email, language=language)
+
+    def test_reindex_signs_only_changed_translations(self):
+        self.assertEqual(duplicates.reindex(), 6)
+        self.assertEqual(duplicates.reindex(), 0)
+        translation = self.translation(self.email4)
+        translation.content = WELCOME
+        translation.save()
+        self.assertEqual(duplicates.reindex(), 1)
+        self.assertEqual(TranslationSignature.objects.get(translation=translation).minhash,
+            duplicates.minhash(WELCOME))
+        translation.language = 'IT'
+        translation.save()
+        duplicates.reindex()
+        self.assertEqual(TranslationSignature.objects.get(translation=translation).language, 'IT')
+        translation.delete()
+        self.assertEqual(TranslationSignature.objects.count(), 5)
+        self.assertEqual(duplicates.reindex(full=True), 5)
+
+    def test_groups(self):
+        duplicates.reindex()
+        welcome = sorted(self.translation(email).pk for email in (self.email1, self.email2, self.email3))
+        self.assertEqual(self.groups(), [welcome])
+        self.assertEqual(self.groups('FR'), [])
+        self.assertEqual(self.groups(threshold=0.95), [[self.translation(self.email1).pk, self.translation(self.email2).pk]])
+
+    def test_unsigned_translations_are_left_out(self):
+        self.assertEqual(self.groups(), [])
+
+    def test_suggestion_keeps_the_email_with_most_translations(self):
+        duplicates.reindex()
+        [group] = duplicates.suggest('EN', duplicates.find_groups('EN', 0.6))
+        self.assertEqual(group.keep.email, self.email3)
+        self.assertEqual([translation.email for translation in group.others], [self.email1, self.email2])
+        self.assertGreater(group.similarity, 0.6)
+
+    def test_candidates_not_all_pairs(self):
+        Email.objects.all().delete()
+        for i in range(200):
+            email = Email.objects.create(name_eng="Email %d" % i, name_esp="Correo %d" % i)
+            EmailTranslation.objects.create(email=email, language='DE', content=words(i))
+        duplicates.reindex()
+        with mock.patch('emails.duplicates.similarity', wraps=duplicates.similarity) as compare:
+            self.assertEqual(self.groups('DE', 0.8), [])
+        self.assertLess(compare.call_count, 200 * 199 / 2 / 10)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('find_duplicates', '--threshold', '0.6', '--language', 'EN', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Signed 6 translations.')
+        self.assertTrue(lines[1].startswith('EN ') and lines[1].endswith('keep #%d %s' % (self.email3.id, self.email3)))
+        self.assertEqual(lines[-1], '1 groups of near-duplicates.')
+        out = io.StringIO()
+        call_command('find_duplicates', '--reindex-only', stdout=out)
+        self.assertEqual(out.getvalue(), 'Signed 0 translations.\n')
+
+
+class DuplicatesViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(Permission.objects.get(codename='view_email'))
+        User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido")
+        cls.email2 = Email.objects.create(name_eng="Welcome again", name_esp="Bienvenido otra vez")
+        EmailTranslation.objects.create(email=cls.email1, language='FR', content=WELCOME)
+        EmailTranslation.objects.create(email=cls.email2, language='FR', content=WELCOME + ' Thanks!')
+
+    def test_needs_permission(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        self.assertEqual(self.client.get(reverse('duplicates')).status_code, 302)
+
+    def test_report(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('duplicates'), {'language': 'FR'})
+        self.assertEqual(response.context['unsigned'], 2)
+        self.assertEqual(response.context['groups'], [])
+        duplicates.reindex()
+        response = self.client.get(reverse('duplicates'), {'language': 'FR', 'threshold': '0.7'})
+        self.assertEqual(response.context['unsigned'], 0)
+        [group] = response.context['groups']
+        self.assertEqual((group.keep.email, group.others[0].email), (self.email1, self.email2))
+        self.assertContains(response, 'Welcome again')
+        self.assertEqual(self.client.get(reverse('duplicates'), {'language': 'EN'}).context['groups'], [])
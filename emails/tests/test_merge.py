@@ -0,0 +1,160 @@
+import io
+import json
+import os
+import tempfile
+import time
+
+from django.contrib.auth.models import User, Permission
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from emails import merge
+from emails.models import ApiToken, Email, EmailTranslation
+
+class PlaceholderTests(TestCase):
+    def test_placeholders(self):
+        text = 'Hi {{ first_name }}, order {{order_number}} ships to {{first_name|you}}.'
+        self.assertEqual(merge.placeholders(text), ['first_name', 'order_number'])
+        self.assertEqual(merge.placeholders('No placeholders {here}'), [])
+
+    def test_validator(self):
+        merge.validate_placeholders('Hi {{ first_name|there }}, {single braces} are fine')
+        for text in ('Hi {{ first name }}', 'Hi {{first_name', 'Hi {{}}', 'Hi first_name}}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValidationError):
+                    merge.validate_placeholders(text)
+
+    def test_placeholders_are_stored_on_save(self):
+        email = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        translation = EmailTranslation.objects.create(email=email, language='EN', content='Hi {{ first_name }}')
+        self.assertEqual(translation.placeholder_names(), ['first_name'])
+        translation.content = 'Order {{ order_number }} for {{ first_name }}'
+        translation.save(update_fields=['content'])
+        translation.refresh_from_db()
+        self.assertEqual(translation.placeholder_names(), ['order_number', 'first_name'])
+
+    def test_full_clean_rejects_bad_placeholders(self):
+        email = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        with self.assertRaises(ValidationError):
+            EmailTranslation(email=email, language='EN', content='Hi {{ first name }}').full_clean()
+
+class MergeTemplateTests(TestCase):
+    def test_render(self):
+        template = merge.MergeTemplate('Hi {{ first_name|there }}, order {{ order_number }} {braces} 100%')
+        self.assertEqual(template.render({'first_name': 'Ana', 'order_number': 7}), 'Hi Ana, order 7 {braces} 100%')
+        self.assertEqual(template.render({'first_name': '', 'order_number': '8'}), 'Hi there, order 8 {braces} 100%')
+        with self.assertRaisesMessage(merge.MergeError, 'Missing order_number.'):
+            template.render({'first_name': 'Ana'})
+
+    def test_empty_and_null_values_are_missing(self):
+        template = merge.MergeTemplate('Hi {{ first_name }}, order {{ order_number|soon }}')
+        self.assertEqual(template.render({'first_name': 'Ana', 'order_number': None}), 'Hi Ana, order soon')
+        for value in (None, ''):
+            with self.subTest(value=value):
+                with self.assertRaisesMessage(merge.MergeError, 'Missing first_name.'):
+                    template.render({'first_name': value, 'order_number': 7})
+        records = merge.read_csv(io.BytesIO(b'first_name,order_number\nAna\n,8\n'))
+        self.assertEqual([row for row in merge.render_rows(template, records)], [
+            {'row': 1, 'content': 'Hi Ana, order soon'},
+            {'row': 2, 'error': 'Missing first_name.'},
+        ])
+        records = merge.read_json(io.BytesIO(b'[{"first_name": null, "order_number": 9}]'))
+        self.assertEqual(list(merge.render_rows(template, records)), [{'row': 1, 'error': 'Missing first_name.'}])
+
+    def test_attribute_lookups_are_not_placeholders(self):
+        template = merge.MergeTemplate('{{ a.__class__ }} {0} {{ a }}')
+        self.assertEqual(template.render({'a': 'x'}), '{{ a.__class__ }} {0} x')
+
+    def test_compiled_once_and_forgotten_on_save(self):
+        email = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        translation = EmailTranslation.objects.create(email=email, language='EN', content='Hi {{ first_name }}')
+        template = merge.compiled(translation)
+        self.assertIs(merge.compiled(translation), template)
+        translation.content = 'Hello {{ first_name }}'
+        translation.save()
+        self.assertFalse(translation.pk in merge._compiled)
+        self.assertEqual(merge.compiled(translation).render({'first_name': 'Ana'}), 'Hello Ana')
+
+    def test_readers(self):
+        records = list(merge.read_csv(io.BytesIO('﻿first_name,city\nAna,Sevilla\nJosé,Málaga\n'.encode('utf-8'))))
+        self.assertEqual(records, [{'first_name': 'Ana', 'city': 'Sevilla'}, {'first_name': 'José', 'city': 'Málaga'}])
+        self.assertEqual(list(merge.read_json(io.BytesIO(b'[{"a": 1}]'))), [{'a': 1}])
+        self.assertEqual(list(merge.read_jsonl(io.BytesIO(b'{"a": 1}\n\n{"a": 2}\n'))), [{'a': 1}, {'a': 2}])
+
+    def test_render_stream(self):
+        template = merge.MergeTemplate('Hi {{ first_name }}')
+        records = [{'first_name': 'Ana'}, {}, 'nope']
+        lines = b''.join(merge.render_stream(template, records, chunk_rows=2)).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'row': 1, 'content': 'Hi Ana'},
+            {'row': 2, 'error': 'Missing first_name.'},
+            {'row': 3, 'error': 'Expected an object of placeholder values.'},
+        ])
+        lines = b''.join(merge.render_stream(template, merge.read_json(io.BytesIO(b'{"a": 1}')))).decode().splitlines()
+        self.assertTrue(json.loads(lines[0])['error'].startswith('Could not read the recipients'))
+
+    def test_speed(self):
+        # 100,000 recipients a minute is 10,000 in six seconds
+        template = merge.MergeTemplate('Dear {{ first_name|customer }},\n\nYour order {{ order_number }} has shipped.\n' * 5)
+        csv_data = 'first_name,order_number\n' + ''.join('Name %d,%d\n' % (i, i) for i in range(10000))
+        started = time.perf_counter()
+        output = b''.join(merge.render_stream(template, merge.read_csv(io.BytesIO(csv_data.encode()))))
+        self.assertTrue(time.perf_counter() - started < 6)
+        self.assertEqual(output.count(b'\n'), 10000)
+
+class MergeApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(Permission.objects.get(name="Can view email"))
+        cls.token1 = ApiToken.objects.create(user=cls.test_user1, name='CRM')
+        cls.email1 = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        EmailTranslation.objects.create(email=cls.email1, language='FR',
+            content='Bonjour {{ first_name|client }}, commande {{ order_number }}')
+
+    def post(self, body, content_type='text/csv', language='fr', token=True):
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + self.token1.key} if token else {}
+        return self.client.post(reverse('api_email_merge', args=(self.email1.id, language)), body,
+            content_type=content_type, **headers)
+
+    def results(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_csv(self):
+        response = self.post('first_name,order_number\nAna,1\n,2\nLuc,\n')
+        self.assertEqual(self.results(response), [
+            {'row': 1, 'content': 'Bonjour Ana, commande 1'},
+            {'row': 2, 'content': 'Bonjour client, commande 2'},
+            {'row': 3, 'error': 'Missing order_number.'},
+        ])
+
+    def test_json_and_jsonl(self):
+        response = self.post(json.dumps([{'first_name': 'Ana', 'order_number': 1}]), 'application/json')
+        self.assertEqual(self.results(response), [{'row': 1, 'content': 'Bonjour Ana, commande 1'}])
+        response = self.post('{"order_number": 2}\n{"first_name": "Luc"}\n', 'application/x-ndjson')
+        self.assertEqual(self.results(response), [
+            {'row': 1, 'content': 'Bonjour client, commande 2'},
+            {'row': 2, 'error': 'Missing order_number.'},
+        ])
+
+    def test_errors(self):
+        self.assertEqual(self.post('first_name\n', token=False).status_code, 401)
+        self.assertEqual(self.post('first_name\n', 'text/plain').status_code, 415)
+        self.assertEqual(self.post('first_name\n', language='XX').status_code, 400)
+        self.assertEqual(self.post('first_name\n', language='DE').status_code, 404)
+        response = self.client.get(reverse('api_email_merge', args=(self.email1.id, 'FR')),
+            HTTP_AUTHORIZATION='Token ' + self.token1.key)
+        self.assertEqual(response.status_code, 405)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recipients = os.path.join(directory, 'recipients.csv')
+            output = os.path.join(directory, 'out.jsonl')
+            with open(recipients, 'w') as f:
+                f.write('first_name,order_number\nAna,1\n')
+            call_command('merge_emails', self.email1.id, 'fr', recipients, '-o', output, stdout=io.StringIO())
+            with open(output) as f:
+                self.assertEqual(json.loads(f.readline()), {'row': 1, 'content': 'Bonjour Ana, commande 1'})
@@ -0,0 +1,127 @@
+import datetime
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+class MergeDuplicateTranslationsTests(TransactionTestCase):
+    before = [('emails', '0006_viewquerystats')]
+    after = [('emails', '0008_translation_email_language_unique')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged(self):
+        Email = self.apps.get_model('emails', 'Email')
+        EmailTranslation = self.apps.get_model('emails', 'EmailTranslation')
+        Counter = self.apps.get_model('emails', 'Counter')
+        email1 = Email.objects.create(name_eng='Welcome', name_esp='Bienvenido')
+        email2 = Email.objects.create(name_eng='Goodbye', name_esp='Adios')
+        first = EmailTranslation.objects.create(email=email1, language='FR', content='Bienvenue', content_html='<p>Bienvenue</p>')
+        EmailTranslation.objects.create(email=email1, language='FR', content='Bienvenue !', content_html='<p>Bienvenue !</p>')
+        EmailTranslation.objects.create(email=email1, language='ES', content='Hola', content_html='<p>Hola</p>')
+        other = EmailTranslation.objects.create(email=email2, language='FR', content='Au revoir', content_html='<p>Au revoir</p>')
+        EmailTranslation.objects.create(email=None, language='FR', content='Orphan')
+        EmailTranslation.objects.create(email=None, language='FR', content='Orphan')
+        Counter.objects.bulk_create([
+            Counter(scope='total', key='translations', value=6),
+            Counter(scope='language', key='FR', value=5),
+            Counter(scope='email', key=str(email1.id), value=3),
+        ])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        EmailTranslation = apps.get_model('emails', 'EmailTranslation')
+        Counter = apps.get_model('emails', 'Counter')
+
+        french = EmailTranslation.objects.get(email_id=email1.id, language='FR')
+        self.assertEqual((french.id, french.content, french.content_html), (first.id, 'Bienvenue !', '<p>Bienvenue !</p>'))
+        self.assertEqual(EmailTranslation.objects.filter(email_id=email1.id).count(), 2)
+        self.assertTrue(EmailTranslation.objects.filter(id=other.id).exists())
+        self.assertEqual(EmailTranslation.objects.filter(email=None).count(), 2)
+        self.assertEqual(dict(Counter.objects.values_list('key', 'value')),
+            {'translations': 5, 'FR': 4, str(email1.id): 2})
+
+class BackfillTimestampsTests(TransactionTestCase):
+    before = [('emails', '0012_change')]
+    after = [('emails', '0013_timestamps')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_times_come_from_the_change_log_and_revisions(self):
+        Email = self.apps.get_model('emails', 'Email')
+        EmailTranslation = self.apps.get_model('emails', 'EmailTranslation')
+        TranslationRevision = self.apps.get_model('emails', 'TranslationRevision')
+        Change = self.apps.get_model('emails', 'Change')
+        logged = Email.objects.create(name_eng='Welcome', name_esp='Bienvenido')
+        unknown = Email.objects.create(name_eng='Goodbye', name_esp='Adios')
+        translation = EmailTranslation.objects.create(email=logged, language='FR', content='Bienvenue')
+        times = [datetime.datetime(2020, 1, day, tzinfo=datetime.timezone.utc) for day in range(1, 5)]
+        Change.objects.bulk_create([
+            Change(entity='email', object_id=logged.id, operation='create', created=times[1]),
+            Change(entity='email', object_id=logged.id, operation='update', created=times[2]),
+            Change(entity='translation', object_id=translation.id, operation='update', created=times[3]),
+        ])
+        TranslationRevision.objects.create(email=logged, language='FR', number=1, snapshot=True,
+            data='Bienvenue', created=times[0])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        Email = apps.get_model('emails', 'Email')
+        EmailTranslation = apps.get_model('emails', 'EmailTranslation')
+
+        self.assertEqual(Email.objects.values_list('created_at', 'updated_at').get(id=logged.id), (times[1], times[2]))
+        self.assertEqual(EmailTranslation.objects.values_list('created_at', 'updated_at').get(id=translation.id),
+            (times[0], times[3]))
+        # Nothing known: the time of the migration
+        self.assertGreater(Email.objects.get(id=unknown.id).created_at, times[3])
+
+class InitialSchemaTests(TransactionTestCase):
+    '''
+    0001 is the schema of the app before it shipped migrations, so existing
+    installs can fake it and let the later migrations add the rest.
+    '''
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def schema(self):
+        with connection.cursor() as cursor:
+            # The search index is made by search.py after migrate, not by a migration
+            tables = {table for table in connection.introspection.table_names(cursor)
+                if table.startswith('emails_') and not table.startswith('emails_search_index')}
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, 'emails_emailtranslation')}
+        return tables, columns
+
+    def test_initial_is_the_original_schema(self):
+        MigrationExecutor(connection).migrate([('emails', '0001_initial')])
+        tables, columns = self.schema()
+        self.assertEqual(tables, {'emails_category', 'emails_email', 'emails_emailtranslation'})
+        self.assertEqual(columns, {'id', 'language', 'content', 'email_id'})
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('emails', '0006_viewquerystats')])
+        tables, columns = self.schema()
+        self.assertTrue({'emails_counter', 'emails_apitoken', 'emails_viewquerystats'} <= tables)
+        self.assertIn('content_html', columns)
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, 'emails_email')
+        self.assertIn(['category_id', 'name_eng'], [index['columns'] for index in indexes.values()])
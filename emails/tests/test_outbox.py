@@ -0,0 +1,221 @@
+import datetime
+import io
+import socketserver
+import threading
+
+from django.contrib.auth.models import User, Permission
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from emails import outbox
+from emails.models import Email, EmailTranslation, OutboundMessage
+
+class CountingBackend(LocmemBackend):
+    '''
+    The locmem backend, counting connections opened and refusing some addresses.
+    '''
+    opened = 0
+    refuse = ()
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & set(self.refuse):
+                raise ConnectionRefusedError('Refused %s' % ', '.join(message.to))
+        return super().send_messages(messages)
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    '''
+    Just enough of an SMTP server to accept mail.
+    '''
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 Go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.email1 = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        cls.translation1 = EmailTranslation.objects.create(email=cls.email1, language='EN',
+            content='Hi {{ first_name|there }}, order {{ order_number }} has shipped.')
+
+    def setUp(self):
+        CountingBackend.opened = 0
+        CountingBackend.refuse = ()
+
+    def queue(self, count, subject='Order {{ order_number }}'):
+        recipients = [{'email': 'customer%d@example.com' % i, 'first_name': 'Customer %d' % i, 'order_number': str(i)}
+            for i in range(count)]
+        return outbox.enqueue(self.translation1, subject, recipients, batch_size=7)
+
+    def test_enqueue(self):
+        result = outbox.enqueue(self.translation1, 'Order {{ order_number }}', [
+            {'email': 'ana@example.com', 'first_name': 'Ana', 'order_number': '1'},
+            {'email': '', 'order_number': '2'},
+            {'email': 'luc@example.com'},
+            {'email': None, 'order_number': '4'},
+        ])
+        self.assertEqual((result.queued, result.skipped), (1, 3))
+        self.assertEqual(result.errors, [(2, 'No email address.'), (3, 'Missing order_number.'), (4, 'No email address.')])
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.to_address, message.subject, message.body, message.status),
+            ('ana@example.com', 'Order 1', 'Hi Ana, order 1 has shipped.', OutboundMessage.QUEUED))
+
+    def test_bad_addresses_and_subjects_are_not_queued(self):
+        result = outbox.enqueue(self.translation1, 'Hello {{ first_name }}', [
+            {'email': 'not-an-address', 'first_name': 'Ana', 'order_number': '1'},
+            {'email': 'ana@example.com', 'first_name': 'Ana\nBcc: x@evil.example', 'order_number': '2'},
+            {'email': 'luc@example.com', 'first_name': 'Luc\r', 'order_number': '3'},
+            {'email': ' ana@example.com ', 'first_name': 'Ana', 'order_number': '4'},
+        ])
+        self.assertEqual(result.errors, [
+            (1, 'not-an-address is not a valid email address.'),
+            (2, 'The subject would have a line break in it.'),
+            (3, 'The subject would have a line break in it.'),
+        ])
+        self.assertEqual(list(OutboundMessage.objects.values_list('to_address', 'subject')),
+            [('ana@example.com', 'Hello Ana')])
+
+    @override_settings(EMAIL_BACKEND='emails.tests.test_outbox.CountingBackend')
+    def test_one_connection_per_batch(self):
+        self.queue(25)
+        self.assertEqual(outbox.send_due(batch_size=10), (10, 10))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertEqual((mail.outbox[0].to, mail.outbox[0].subject), (['customer0@example.com'], 'Order 0'))
+        # A batch costs a fixed number of queries: claim (select, update, load) and one bulk update
+        with self.assertNumQueries(6):
+            self.assertEqual(outbox.send_due(batch_size=10), (10, 10))
+        self.assertEqual(outbox.send_due(batch_size=10), (5, 5))
+        self.assertEqual(outbox.send_due(batch_size=10), (0, 0))
+        self.assertEqual(CountingBackend.opened, 3)
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.SENT, sent_at__isnull=False).count(), 25)
+
+    @override_settings(EMAIL_BACKEND='emails.tests.test_outbox.CountingBackend', EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_retries_with_backoff(self):
+        self.queue(3)
+        CountingBackend.refuse = ['customer1@example.com']
+        self.assertEqual(outbox.send_due(), (3, 2))
+        message = OutboundMessage.objects.get(to_address='customer1@example.com')
+        self.assertEqual((message.status, message.attempts), (OutboundMessage.QUEUED, 1))
+        self.assertTrue('Refused customer1@example.com' in message.last_error)
+        self.assertTrue(message.next_attempt > timezone.now() + datetime.timedelta(seconds=50))
+        # Not due yet
+        self.assertEqual(outbox.send_due(), (0, 0))
+
+        OutboundMessage.objects.update(next_attempt=timezone.now())
+        self.assertEqual(outbox.send_due(), (1, 0))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboundMessage.FAILED, 2))
+        self.assertEqual(outbox.retry_delay(1), outbox.RETRY_DELAY)
+        self.assertEqual(outbox.retry_delay(3), outbox.RETRY_DELAY * 4)
+        self.assertEqual(outbox.retry_delay(30), outbox.MAX_RETRY_DELAY)
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1', EMAIL_PORT=9)
+    def test_unreachable_server(self):
+        self.queue(2)
+        with override_settings(EMAIL_TIMEOUT=1):
+            self.assertEqual(outbox.send_due(), (2, 0))
+        self.assertEqual(list(OutboundMessage.objects.values_list('status', 'attempts').distinct()),
+            [(OutboundMessage.QUEUED, 1)])
+
+    def test_abandoned_claims_are_picked_up(self):
+        self.queue(2)
+        self.assertEqual(len(outbox.claim(10)), 2)
+        self.assertEqual(outbox.claim(10), [])
+        later = timezone.now() + outbox.CLAIM_TIMEOUT + datetime.timedelta(seconds=1)
+        self.assertEqual(len(outbox.claim(10, now=later)), 2)
+
+    def test_smtp_server(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+        server.connections = server.messages = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.queue(40)
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1]):
+            call_command('send_queued_emails', '--batch-size', '25', stdout=io.StringIO())
+        self.assertEqual((server.connections, server.messages), (2, 40))
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.SENT).count(), 40)
+
+class SendViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(*Permission.objects.filter(
+            codename__in=['add_outboundmessage', 'view_outboundmessage']))
+        cls.email1 = Email.objects.create(name_eng='Order shipped', name_esp='Pedido enviado')
+        cls.translation1 = EmailTranslation.objects.create(email=cls.email1, language='FR',
+            content='Bonjour {{ first_name }}')
+
+    def test_needs_permission(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        self.assertEqual(self.client.get(reverse('email_send', args=(self.email1.id,))).status_code, 302)
+        self.assertEqual(self.client.get(reverse('outbox')).status_code, 302)
+
+    def test_queue_from_upload(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('email_send', args=(self.email1.id,)))
+        self.assertEqual(response.context['form']['subject'].value(), 'Order shipped')
+        recipients = SimpleUploadedFile('recipients.csv', b'email,first_name\nana@example.com,Ana\n,Luc\n')
+        response = self.client.post(reverse('email_send', args=(self.email1.id,)), {
+            'translation': self.translation1.id, 'subject': 'Hello {{ first_name }}', 'recipients': recipients})
+        self.assertEqual((response.context['result'].queued, response.context['result'].skipped), (1, 1))
+        self.assertEqual(OutboundMessage.objects.get().subject, 'Hello Ana')
+
+        response = self.client.get(reverse('outbox'))
+        self.assertEqual(response.context['counts'][0], (OutboundMessage.QUEUED, 'Queued', 1))
+
+    def test_unreadable_uploads_are_form_errors(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        for content, error in (
+                ('email,first_name\nana@example.com,Ana\nluc@example.com,Lucía\n'.encode('latin-1'), 'not UTF-8'),
+                # A field longer than the csv module allows
+                (b'email,first_name\nana@example.com,' + b'a' * 200000 + b'\n', 'Could not read the recipients')):
+            with self.subTest(error=error):
+                response = self.client.post(reverse('email_send', args=(self.email1.id,)), {
+                    'translation': self.translation1.id, 'subject': 'Hello',
+                    'recipients': SimpleUploadedFile('recipients.csv', content)})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(error, response.context['form'].errors['recipients'][0])
+                self.assertIsNone(response.context['result'])
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_short_rows(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        recipients = SimpleUploadedFile('recipients.csv', b'first_name,email\nAna,ana@example.com\nLuc\n')
+        response = self.client.post(reverse('email_send', args=(self.email1.id,)), {
+            'translation': self.translation1.id, 'subject': 'Hello', 'recipients': recipients})
+        self.assertEqual(response.context['result'].errors, [(2, 'No email address.')])
+        self.assertEqual(OutboundMessage.objects.get().to_address, 'ana@example.com')
@@ -0,0 +1,106 @@
+import datetime
+import io
+
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from emails import revisions
+from emails.bulk import bulk_delete
+from emails.models import Email, EmailTranslation, TranslationRevision
+
+class DeltaTests(TestCase):
+    def test_round_trip(self):
+        old = 'Dear customer,\n\nThank you for your order.  It ships today.'
+        for new in ('Dear Ana,\n\nThank you for your order.  It ships tomorrow!', '', old, '  leading space', old + ' More.'):
+            with self.subTest(new=new):
+                self.assertEqual(revisions.apply_delta(old, revisions.encode_delta(old, new)), new)
+
+    def test_delta_grows_with_the_edit(self):
+        old = 'word ' * 400
+        new = old.replace('word', 'changed', 1)
+        self.assertTrue(len(revisions.encode_delta(old, new)) < 40)
+
+class RevisionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.email1 = Email.objects.create(name_eng='Welcome', name_esp='Bienvenido')
+
+    def chain(self, language='EN'):
+        return list(TranslationRevision.objects.filter(email=self.email1, language=language)
+            .order_by('number').values_list('number', 'snapshot', 'deleted'))
+
+    def test_each_change_is_a_revision(self):
+        translation = EmailTranslation.objects.create(email=self.email1, language='EN', content='Hello there, friend')
+        translation.content = 'Hello there, dear friend'
+        translation.save()
+        translation.save()
+        self.assertEqual(self.chain(), [(1, True, False), (2, False, False)])
+        self.assertEqual(revisions.content_at(self.email1.id, 'EN', 1), 'Hello there, friend')
+        self.assertEqual(revisions.content_at(self.email1.id, 'EN', 2), 'Hello there, dear friend')
+        self.assertEqual(revisions.diff(self.email1.id, 'EN', 2),
+            [('equal', 'Hello there, '), ('insert', 'dear '), ('equal', 'friend')])
+
+    def test_content_from_before_history_is_kept(self):
+        translation = EmailTranslation.objects.create(email=self.email1, language='EN', content='Old text')
+        TranslationRevision.objects.all().delete()
+        translation.content = 'New text'
+        translation.save()
+        self.assertEqual([revisions.content_at(self.email1.id, 'EN', n) for n in (1, 2)], ['Old text', 'New text'])
+
+    def test_periodic_snapshots_bound_reconstruction(self):
+        translation = EmailTranslation.objects.create(email=self.email1, language='EN', content='Version 0 ' + 'text ' * 50)
+        for i in range(1, 45):
+            translation.content = 'Version %d ' % i + 'text ' * 50
+            translation.save()
+        snapshots = [number for number, snapshot, deleted in self.chain() if snapshot]
+        self.assertEqual(snapshots, [1, 21, 41])
+        with self.assertNumQueries(1):
+            self.assertEqual(revisions.content_at(self.email1.id, 'EN', 40), 'Version 39 ' + 'text ' * 50)
+
+    def test_deleted_and_added_again(self):
+        translation = EmailTranslation.objects.create(email=self.email1, language='FR', content='Bonjour')
+        translation.delete()
+        EmailTranslation.objects.create(email=self.email1, language='FR', content='Salut')
+        self.assertEqual(self.chain('FR'), [(1, True, False), (2, True, True), (3, True, False)])
+        self.assertEqual(revisions.content_at(self.email1.id, 'FR', 1), 'Bonjour')
+
+    def test_bulk_writes(self):
+        translations = [EmailTranslation.objects.create(email=self.email1, language=language, content='Hi')
+            for language in ('EN', 'DE')]
+        bulk_delete(EmailTranslation, translations)
+        self.assertEqual(self.chain('DE'), [(1, True, False), (2, True, True)])
+
+    def test_prune(self):
+        translation = EmailTranslation.objects.create(email=self.email1, language='EN', content='Version 0 of the text')
+        for i in range(1, 6):
+            translation.content = 'Version %d of the text' % i
+            translation.save()
+        TranslationRevision.objects.filter(number__lte=4).update(created=timezone.now() - datetime.timedelta(days=400))
+        out = io.StringIO()
+        call_command('prune_revisions', '--keep', '3', stdout=out)
+        self.assertTrue('Deleted 3 revisions.' in out.getvalue())
+        self.assertEqual(self.chain(), [(4, True, False), (5, False, False), (6, False, False)])
+        self.assertEqual(revisions.content_at(self.email1.id, 'EN', 4), 'Version 3 of the text')
+        self.assertEqual(revisions.content_at(self.email1.id, 'EN', 6), 'Version 5 of the text')
+
+class HistoryViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(Permission.objects.get(name="Can view email"))
+        cls.email1 = Email.objects.create(name_eng='Welcome', name_esp='Bienvenido')
+        translation = EmailTranslation.objects.create(email=cls.email1, language='EN', content='Hello <b> friend')
+        translation.content = 'Hello <b> dear friend'
+        translation.save()
+
+    def test_history(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('email_history', args=(self.email1.id,)))
+        self.assertEqual([revision.number for revision in response.context['history']], [2, 1])
+        response = self.client.get(reverse('email_history', args=(self.email1.id,)), {'language': 'EN', 'revision': 2})
+        content = response.content.decode()
+        self.assertTrue('<ins class="bg-success text-white">dear </ins>' in content)
+        self.assertTrue('&lt;b&gt;' in content)
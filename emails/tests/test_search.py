@@ -0,0 +1,76 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User, Permission
+
+from emails import search
+from emails.models import Category, Email, EmailTranslation
+
+class SearchServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Refund request", name_esp="Reembolso", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='EN', content='Welcome to the company, we are glad to have you.')
+        EmailTranslation.objects.create(email=cls.email1, language='FR', content='Bienvenue dans la société.')
+        cls.refund = EmailTranslation.objects.create(email=cls.email2, language='EN', content='Your refund has been processed <today>.')
+
+    def test_finds_content(self):
+        results = search.search('refund processed')
+        self.assertEqual([(result.email, result.language) for result in results], [(self.email2, 'EN')])
+        self.assertTrue('<mark>refund</mark>' in results[0].snippet)
+        self.assertTrue('&lt;today&gt;' in results[0].snippet)
+
+    def test_finds_names_and_prefixes(self):
+        results = search.search('reembol')
+        self.assertEqual([(result.email, result.language) for result in results], [(self.email2, '')])
+
+    def test_language_filter(self):
+        self.assertEqual([result.language for result in search.search('welcome', 'EN')], ['EN'])
+        self.assertEqual(search.search('welcome', 'FR'), [])
+        self.assertEqual([result.email for result in search.search('societe', 'FR')], [self.email1])
+
+    def test_index_follows_save_and_delete(self):
+        self.refund.content = 'Your order has shipped.'
+        self.refund.save()
+        self.assertEqual([result.language for result in search.search('refund')], [''])
+        self.assertEqual(len(search.search('shipped')), 1)
+
+        self.refund.delete()
+        self.assertEqual(search.search('shipped'), [])
+
+        Email.objects.get(id=self.email1.id).delete()
+        self.assertEqual(search.search('welcome'), [])
+
+    def test_rebuild_command(self):
+        EmailTranslation.objects.bulk_create([EmailTranslation(email=self.email2, language='DE', content='Ihre Rückerstattung')])
+        self.assertEqual(search.search('ruckerstattung'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual([result.language for result in search.search('ruckerstattung')], ['DE'])
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(Permission.objects.get(name="Can view email"))
+
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        EmailTranslation.objects.create(email=cls.email1, language='ES', content='Bienvenido a la empresa')
+
+    def test_needs_view_email_permission(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('search'), {'q': 'empresa'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_results_in_page(self):
+        login = self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('search'), {'q': 'empresa', 'lang': 'ES'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'emails/search.html')
+        self.assertTrue('<mark>empresa</mark>' in response.content.decode())
+        self.assertTrue('Welcome, Bienvenido' in response.content.decode())
@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User, Permission
+
+from emails import conditional
+from emails.middleware import HASHED_NAME, ONE_YEAR, accepted_encodings
+from emails.models import Email
+
+ASSET_URLS = re.compile(r'<(?:link|script|img)\b[^>]*?\b(?:href|src)="([^"]*)"')
+TEMPLATE_DIRS = [os.path.join(settings.BASE_DIR, 'templates'), os.path.join(settings.BASE_DIR, 'emails', 'templates')]
+# Classes the templates use as hooks for JavaScript only
+SCRIPT_CLASSES = {'translation-form', 'translation-status'}
+
+class CollectedStaticTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.static_root = tempfile.mkdtemp()
+        cls.static_settings = override_settings(STATIC_ROOT=cls.static_root)
+        cls.static_settings.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.static_settings.disable()
+        shutil.rmtree(cls.static_root)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.user.user_permissions.add(*Permission.objects.filter(codename__in=['view_email', 'change_email']))
+        cls.email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido")
+
+    def asset_urls(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return ASSET_URLS.findall(response.content.decode())
+
+    def test_pages_reference_only_hashed_local_urls(self):
+        urls = self.asset_urls(reverse('login'))
+        self.client.login(username='test_user1', password='X$G123**3!')
+        for url in (reverse('index'), reverse('translation_editor', args=(self.email.id,))):
+            urls += self.asset_urls(url)
+        self.assertIn(staticfiles_storage.url('emails/js/translation_editor.js'), urls)
+        for url in urls:
+            self.assertTrue(url.startswith(settings.STATIC_URL), url)
+            self.assertRegex(url, HASHED_NAME)
+            self.assertTrue(os.path.isfile(os.path.join(self.static_root, url[len(settings.STATIC_URL):])), url)
+
+    def test_compressed_copies(self):
+        path = staticfiles_storage.path(staticfiles_storage.stored_name('emails/css/bootstrap.css'))
+        with open(path, 'rb') as original, gzip.open(path + '.gz') as compressed:
+            self.assertEqual(compressed.read(), original.read())
+
+    def test_served_with_far_future_cache_headers(self):
+        url = staticfiles_storage.url('emails/css/bootstrap.css')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        for refused in ('gzip;q=0', 'br, gzip; q=0.0', 'identity'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=refused)
+            self.assertFalse(response.has_header('Content-Encoding'), refused)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='*;q=0.5')['Content-Encoding'], 'gzip')
+        with open(finders.find('emails/css/bootstrap.css'), 'rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+
+    async def test_served_without_leaving_the_asgi_event_loop(self):
+        url = staticfiles_storage.url('emails/css/bootstrap.css')
+        with self.settings(DEBUG=True), self.assertLogs('django.request', 'DEBUG') as logs:
+            response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%d, immutable' % ONE_YEAR)
+        # Django logs every sync middleware (or view) it has to wrap for an async stack
+        self.assertEqual([line for line in logs.output if 'adapted' in line], [])
+
+    def test_manifest_is_part_of_the_build_version(self):
+        with open(os.path.join(self.static_root, staticfiles_storage.manifest_name), 'rb') as f:
+            self.assertEqual(conditional.build_version()[1], hashlib.sha1(f.read()).hexdigest())
+
+    def test_unhashed_names_are_revalidated(self):
+        response = self.client.get(settings.STATIC_URL + 'emails/css/bootstrap.css')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_missing_files_fall_through(self):
+        self.assertEqual(self.client.get(settings.STATIC_URL + 'emails/css/nothing.css').status_code, 404)
+        self.assertEqual(self.client.get(settings.STATIC_URL + '../manage.py').status_code, 404)
+
+
+class AcceptEncodingTests(TestCase):
+    def test_q_values(self):
+        self.assertEqual(accepted_encodings('gzip, deflate;q=0.5, br;q=0, *;Q=0.1'),
+            {'gzip': 1.0, 'deflate': 0.5, 'br': 0.0, '*': 0.1})
+        self.assertEqual(accepted_encodings('GZIP;q=nonsense, , '), {'gzip': 0.0})
+        self.assertEqual(accepted_encodings(''), {})
+
+
+class StylesheetTests(TestCase):
+    def test_templates_only_use_defined_classes(self):
+        defined = set()
+        for name in ('emails/css/bootstrap.css', 'emails/css/style.css'):
+            with open(finders.find(name)) as f:
+                defined.update(re.findall(r'\.([A-Za-z][\w-]*)', re.sub(r'/\*.*?\*/', '', f.read(), flags=re.S)))
+        used = {}
+        for directory in TEMPLATE_DIRS:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    with open(os.path.join(dirpath, filename)) as f:
+                        for value in re.findall(r'class="([^"]*)"', f.read()):
+                            # Drop template tags, keep the class names inside their branches
+                            for name in re.sub(r'\{%.*?%\}|\{\{.*?\}\}', ' ', value).split():
+                                used.setdefault(name, filename)
+        undefined = {name: filename for name, filename in used.items() if name not in defined | SCRIPT_CLASSES}
+        self.assertEqual(undefined, {})
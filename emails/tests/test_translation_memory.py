@@ -0,0 +1,213 @@
+import random
+import time
+
+from django.contrib.auth.models import User, Permission
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from emails import translation_memory
+from emails.bulk import bulk_create, bulk_delete
+from emails.models import ApiToken, Email, EmailTranslation
+from emails.signals import send_bulk_saved
+
+ORDER_EN = 'Thank you for your order. It will ship tomorrow.\n\nQuestions? Reply to this email.'
+ORDER_FR = 'Merci pour votre commande. Elle partira demain.\n\nDes questions ? Répondez à cet email.'
+
+class AlignmentTests(TestCase):
+    def test_sentences(self):
+        self.assertEqual(translation_memory.sentences('Hi there! How are you?\nFine... thanks.  '),
+            ['Hi there!', 'How are you?', 'Fine...', 'thanks.'])
+        self.assertEqual(translation_memory.sentences(' \n '), [])
+
+    def test_sentences_are_lined_up_where_the_counts_agree(self):
+        self.assertEqual(translation_memory.align(ORDER_EN, ORDER_FR), [
+            ('Thank you for your order.', 'Merci pour votre commande.'),
+            ('It will ship tomorrow.', 'Elle partira demain.'),
+            ('Questions?', 'Des questions ?'),
+            ('Reply to this email.', 'Répondez à cet email.'),
+        ])
+
+    def test_paragraphs_when_only_their_counts_agree(self):
+        self.assertEqual(translation_memory.align('One. Two.\n\nThree.', 'Un et deux.\n\nTrois.'),
+            [('One. Two.', 'Un et deux.'), ('Three.', 'Trois.')])
+        self.assertEqual(translation_memory.align('One. Two.', 'Un et deux.'), [])
+
+
+class MemoryTests(TestCase):
+    def setUp(self):
+        self.memory = translation_memory.Memory()
+        self.memory.load([
+            (1, 1, 'EN', ORDER_EN),
+            (2, 1, 'FR', ORDER_FR),
+            (3, 1, 'DE', 'Danke für Ihre Bestellung. Sie wird morgen versandt.\n\nFragen? Antworten Sie auf diese E-Mail.'),
+            (4, 2, 'EN', 'Thank you for your order!'),
+            (5, 2, 'FR', 'Merci pour votre commande !'),
+            (6, 3, 'FR', 'Merci pour votre commande.'),
+        ])
+
+    def matches(self, source, language='FR', **kwargs):
+        return [[(source, target, emails) for similarity, source, target, emails in matches]
+            for sentence, matches in self.memory.suggest(source, language, **kwargs)]
+
+    def test_closest_sentences_first(self):
+        self.assertEqual(self.matches('Thank you for your order.'), [[
+            ('Thank you for your order.', 'Merci pour votre commande.', 1),
+            ('Thank you for your order!', 'Merci pour votre commande !', 1),
+        ]])
+        self.assertEqual(self.matches('thank you for your order. Please reply to this email'), [
+            [('Thank you for your order.', 'Merci pour votre commande.', 1),
+                ('Thank you for your order!', 'Merci pour votre commande !', 1)],
+            [('Reply to this email.', 'Répondez à cet email.', 1)],
+        ])
+        self.assertEqual(self.matches('Thank you for your order.', 'DE', limit=1),
+            [[('Thank you for your order.', 'Danke für Ihre Bestellung.', 1)]])
+        self.assertEqual(self.matches('The weather is nice.'), [[]])
+        self.assertEqual(self.matches(''), [])
+
+    def test_similarity(self):
+        [[sentence, [best, close]]] = self.memory.suggest('Thank you for your order.', 'FR')
+        self.assertEqual(best[0], 1)
+        self.assertTrue(translation_memory.MIN_SIMILARITY <= close[0] < 1)
+        self.assertEqual(self.matches('Thanks.'), [[]])
+
+    def test_exclude_and_shared_sentences(self):
+        self.assertEqual(self.matches('Thank you for your order.', exclude=1),
+            [[('Thank you for your order!', 'Merci pour votre commande !', 1)]])
+        self.memory.add_email(4, [(7, 'EN', 'Thank you for your order!'), (8, 'FR', 'Merci pour votre commande !')])
+        self.assertEqual(self.matches('Thank you for your order!', exclude=4)[0][0][2], 2)
+
+    def test_remove_email(self):
+        self.memory.remove_email(1)
+        self.assertEqual(self.matches('Reply to this email.'), [[]])
+        self.assertEqual(self.memory.suggest('Thank you for your order.', 'DE'), [('Thank you for your order.', [])])
+        self.assertEqual(len(self.matches('Thank you for your order.')[0]), 1)
+        self.assertEqual(set(self.memory.postings['DE']), set())
+
+    def test_lookup_time(self):
+        rng = random.Random(0)
+        letters, weights = 'etaoinshrdlcumwfgypbvkjxqz', [12, 9, 8, 7.5, 7, 6.7, 6.3, 6, 6, 4.3, 4, 2.8, 2.8, 2.4,
+            2.4, 2.2, 2, 2, 1.9, 1.5, 1, 0.8, 0.15, 0.15, 0.1, 0.07]
+        words = [''.join(rng.choices(letters, weights, k=rng.randint(2, 9))) for i in range(5000)]
+        # A few words are in most sentences, like "the" and "you"
+        frequency = [1 / (rank + 1) for rank in range(len(words))]
+        def sentence():
+            return ' '.join(rng.choices(words, frequency, k=rng.randint(5, 14))).capitalize() + '.'
+        rows = []
+        for email in range(10000):
+            english = ' '.join(sentence() for i in range(3))
+            rows += [(2 * email, email, 'EN', english), (2 * email + 1, email, 'FR', english.upper())]
+        memory = translation_memory.Memory()
+        memory.load(rows)
+        source = ' '.join(sentence() for i in range(9)) + ' ' + rows[0][3].replace('a', 'e', 1)
+        started = time.perf_counter()
+        suggestions = memory.suggest(source, 'FR')
+        # Tens of milliseconds for a whole email, with room for slow machines
+        self.assertLess(time.perf_counter() - started, 0.2)
+        self.assertEqual(suggestions[9][1][0][2], translation_memory.sentences(rows[1][3])[0])
+
+
+class MemoryRefreshTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.email = Email.objects.create(name_eng="Order", name_esp="Pedido")
+        cls.english = EmailTranslation.objects.create(email=cls.email, language='EN', content=ORDER_EN)
+        cls.french = EmailTranslation.objects.create(email=cls.email, language='FR', content=ORDER_FR)
+
+    def setUp(self):
+        translation_memory.forget()
+        self.addCleanup(translation_memory.forget)
+
+    def translations(self, source, language='FR'):
+        return [target for sentence, matches in translation_memory.memory().suggest(source, language)
+            for similarity, source, target, emails in matches]
+
+    def test_built_once_and_kept_between_lookups(self):
+        self.assertEqual(self.translations('It will ship tomorrow.'), ['Elle partira demain.'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.translations('Questions?'), ['Des questions ?'])
+
+    def test_own_writes_are_read_again_by_the_next_lookup(self):
+        self.translations('Questions?')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.french.content = ORDER_FR.replace('Elle partira demain', 'Expédiée demain')
+            self.french.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.translations('It will ship tomorrow.'), ['Expédiée demain.'])
+        with self.captureOnCommitCallbacks(execute=True):
+            email = Email.objects.create(name_eng="Thanks", name_esp="Gracias")
+            translations = bulk_create(EmailTranslation, [
+                EmailTranslation(email=email, language='EN', content='Thanks a lot.'),
+                EmailTranslation(email=email, language='IT', content='Grazie mille.')])
+            send_bulk_saved(EmailTranslation, created=translations)
+        self.assertEqual(self.translations('Thanks a lot!', 'IT'), ['Grazie mille.'])
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_delete(EmailTranslation, translations[1:])
+        self.assertEqual(self.translations('Thanks a lot!', 'IT'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.email.delete()
+        self.assertEqual(self.translations('Questions?'), [])
+
+    @override_settings(CHANGES_SETTLE_SECONDS=0, TRANSLATION_MEMORY_REFRESH_SECONDS=0)
+    def test_catches_up_with_other_processes_from_the_change_log(self):
+        self.translations('Questions?')
+        # Writes whose commit callbacks ran in another process
+        with self.captureOnCommitCallbacks(execute=False):
+            EmailTranslation.objects.create(email=self.email, language='ES', content=
+                'Gracias por su pedido. Saldrá mañana.\n\n¿Preguntas? Responda a este correo.')
+            EmailTranslation.objects.get(pk=self.french.pk).delete()
+        self.assertEqual(self.translations('Questions?', 'ES'), ['¿Preguntas?'])
+        self.assertEqual(self.translations('Questions?'), [])
+
+    def test_refresh_waits_for_the_interval(self):
+        self.translations('Questions?')
+        with self.captureOnCommitCallbacks(execute=False):
+            EmailTranslation.objects.get(pk=self.french.pk).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.translations('Questions?'), ['Des questions ?'])
+
+
+class TranslationMemoryApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(*Permission.objects.filter(codename__in=['view_email', 'change_email']))
+        cls.token = ApiToken.objects.create(user=cls.test_user1, name='CAT tool')
+        cls.email = Email.objects.create(name_eng="Order", name_esp="Pedido")
+        EmailTranslation.objects.create(email=cls.email, language='EN', content=ORDER_EN)
+        EmailTranslation.objects.create(email=cls.email, language='FR', content=ORDER_FR)
+
+    def setUp(self):
+        translation_memory.forget()
+        self.addCleanup(translation_memory.forget)
+
+    def get(self, **params):
+        return self.client.get(reverse('api_translation_memory'), params, HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_needs_permission(self):
+        response = self.client.get(reverse('api_translation_memory'), {'source': 'Questions?', 'language': 'FR'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_suggestions(self):
+        response = self.get(source='Thanks for your order. Questions?', language='FR')
+        self.assertEqual(response.json(), {'suggestions': [
+            {'sentence': 'Thanks for your order.', 'matches': [{'source': 'Thank you for your order.',
+                'translation': 'Merci pour votre commande.', 'similarity': 0.844, 'emails': 1}]},
+            {'sentence': 'Questions?', 'matches': [{'source': 'Questions?', 'translation': 'Des questions ?',
+                'similarity': 1.0, 'emails': 1}]},
+        ]})
+        response = self.get(source='Questions?', language='FR', exclude=self.email.id)
+        self.assertEqual(response.json()['suggestions'][0]['matches'], [])
+
+    def test_bad_parameters(self):
+        for params in ({'language': 'EN'}, {'language': 'XX'}, {'language': 'FR', 'limit': '0'},
+                {'language': 'FR', 'limit': 'all'}, {'language': 'FR', 'exclude': 'me'},
+                {'language': 'FR', 'source': 'x' * 2001}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_email_update_panel(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('email_update', args=(self.email.id,)))
+        self.assertContains(response, 'data-url="%s"' % reverse('api_translation_memory'))
+        self.assertContains(response, 'data-email="%d"' % self.email.id)
+        self.assertContains(response, 'emails/js/translation_memory')
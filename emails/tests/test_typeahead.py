@@ -0,0 +1,173 @@
+import random
+import time
+
+from django.contrib.auth.models import User, Permission
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from emails import typeahead
+from emails.bulk import bulk_create, bulk_delete
+from emails.models import ApiToken, Category, Change, Email
+from emails.signals import send_bulk_saved
+
+class PrefixIndexTests(TestCase):
+    def setUp(self):
+        self.index = typeahead.PrefixIndex()
+        self.index.add(Change.EMAIL, 1, 'Order shipped', 'Pedido enviado')
+        self.index.add(Change.EMAIL, 2, 'Shipping delay', 'Retraso del envío')
+        self.index.add(Change.EMAIL, 3, 'Café opening', 'Apertura del café')
+        self.index.add(Change.CATEGORY, 1, 'Shipping')
+
+    def ids(self, query, **kwargs):
+        return [(kind, pk) for kind, pk, label, detail in self.index.search(query, **kwargs)]
+
+    def test_whole_names_before_words(self):
+        self.assertEqual(self.ids('ship'), [('category', 1), ('email', 2), ('email', 1)])
+        self.assertEqual(self.ids('shipping d'), [('email', 2)])
+        self.assertEqual(self.ids('envi'), [('email', 1), ('email', 2)])
+        self.assertEqual(self.ids('hipping'), [])
+        self.assertEqual(self.ids('  '), [])
+
+    def test_case_and_accents_are_ignored(self):
+        self.assertEqual(self.ids('CAFE'), [('email', 3)])
+        self.assertEqual(self.ids('envío'), self.ids('envio'))
+
+    def test_limit_and_kinds(self):
+        self.assertEqual(self.ids('ship', limit=1), [('category', 1)])
+        self.assertEqual(self.ids('ship', limit=1, kinds=[Change.EMAIL]), [('email', 2)])
+
+    def test_add_replaces_and_remove(self):
+        self.index.add(Change.EMAIL, 1, 'Order delivered', 'Pedido entregado')
+        self.assertEqual(self.ids('order'), [('email', 1)])
+        self.assertEqual(self.ids('shipped'), [])
+        self.index.remove(Change.EMAIL, 1)
+        self.index.remove(Change.EMAIL, 99)
+        self.assertEqual(self.ids('order'), [])
+        self.assertEqual(self.index.search('apertura'), [('email', 3, 'Café opening', 'Apertura del café')])
+
+    def test_search_time_does_not_grow_with_the_catalog(self):
+        rng = random.Random(0)
+        syllables = ['ka', 'lo', 'mi', 'ne', 'pu', 'ro', 'sa', 'ti', 'vo', 'ze']
+        def name():
+            return ' '.join(''.join(rng.choice(syllables) for i in range(3)) for j in range(3))
+        index = typeahead.PrefixIndex()
+        index.load([(pk, name(), name()) for pk in range(100000)], [(pk, name()) for pk in range(500)])
+        queries = [''.join(rng.choice(syllables) for i in range(2)) for j in range(200)]
+        started = time.perf_counter()
+        for query in queries:
+            self.assertEqual(len(index.search(query)), typeahead.LIMIT)
+        # Well under the 5 ms a keystroke can take, even on a slow machine
+        self.assertLess((time.perf_counter() - started) / len(queries), 0.005)
+
+
+class TypeaheadIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Company Introductions")
+        cls.email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category)
+
+    def setUp(self):
+        typeahead.forget()
+        self.addCleanup(typeahead.forget)
+
+    def names(self, query):
+        return [label for kind, pk, label, detail in typeahead.index().search(query)]
+
+    def test_built_once_and_kept_between_lookups(self):
+        self.assertEqual(self.names('welc'), ['Welcome'])
+        self.assertEqual(self.names('comp'), ['Company Introductions'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('bien'), ['Welcome'])
+
+    def test_own_writes_show_up_on_commit(self):
+        self.names('w')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.email.name_eng = "Hello"
+            self.email.save()
+            Category.objects.create(name="Holidays")
+        self.assertEqual(self.names('h'), ['Hello', 'Holidays'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.email.delete()
+        self.assertEqual(self.names('h'), ['Holidays'])
+
+    def test_bulk_writes(self):
+        self.names('w')
+        with self.captureOnCommitCallbacks(execute=True):
+            emails = bulk_create(Email, [Email(name_eng="Reminder"), Email(name_eng="Receipt")])
+            send_bulk_saved(Email, created=emails)
+        self.assertEqual(self.names('re'), ['Receipt', 'Reminder'])
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_delete(Email, emails)
+        self.assertEqual(self.names('re'), [])
+
+    def test_rolled_back_writes_are_left_out(self):
+        self.names('w')
+        with self.captureOnCommitCallbacks(execute=False):
+            Email.objects.create(name_eng="Never committed")
+        self.assertEqual(self.names('never'), [])
+
+    @override_settings(CHANGES_SETTLE_SECONDS=0, TYPEAHEAD_REFRESH_SECONDS=0)
+    def test_catches_up_with_other_processes_from_the_change_log(self):
+        self.names('w')
+        # Writes whose commit callbacks ran in another process
+        with self.captureOnCommitCallbacks(execute=False):
+            renamed = Email.objects.create(name_eng="Goodbye", name_esp="Adiós")
+            Email.objects.filter(pk=self.email.pk).get().delete()
+        self.assertEqual(self.names('adios'), ['Goodbye'])
+        self.assertEqual(self.names('welc'), [])
+        renamed.name_eng = "Farewell"
+        renamed.save()
+        self.assertEqual(self.names('fare'), ['Farewell'])
+
+    def test_refresh_waits_for_the_interval(self):
+        self.names('w')
+        with self.captureOnCommitCallbacks(execute=False):
+            Email.objects.create(name_eng="Goodbye", name_esp="Adiós")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('good'), [])
+
+
+class AutocompleteApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(Permission.objects.get(codename='view_email'))
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(*Permission.objects.filter(codename__in=['view_email', 'view_category']))
+        cls.token = ApiToken.objects.create(user=cls.test_user1, name='CRM')
+        cls.category = Category.objects.create(name="Welcome emails")
+        cls.email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category)
+
+    def setUp(self):
+        typeahead.forget()
+        self.addCleanup(typeahead.forget)
+
+    def test_needs_permission(self):
+        self.assertEqual(self.client.get(reverse('api_autocomplete'), {'q': 'w'}).status_code, 401)
+        response = self.client.get(reverse('api_autocomplete'), {'q': 'w'}, HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.assertEqual(response.json()['results'], [{'type': 'email', 'id': self.email.id, 'label': 'Welcome',
+            'detail': 'Bienvenido', 'url': reverse('email_detail', args=(self.email.id,))}])
+
+    def test_categories_for_users_who_may_see_them(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('api_autocomplete'), {'q': 'welcome'})
+        self.assertEqual([(result['type'], result['url']) for result in response.json()['results']], [
+            ('email', reverse('email_detail', args=(self.email.id,))),
+            ('category', reverse('category_detail', args=(self.category.id,))),
+        ])
+
+    def test_limit(self):
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('api_autocomplete'), {'q': 'welcome', 'limit': '1'})
+        self.assertEqual(len(response.json()['results']), 1)
+        for limit in ('0', '51', 'many'):
+            with self.subTest(limit=limit):
+                response = self.client.get(reverse('api_autocomplete'), {'q': 'welcome', 'limit': limit})
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_autocomplete')).json(), {'results': []})
+
+    def test_sidebar_box(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'data-url="%s"' % reverse('api_autocomplete'))
+        self.assertContains(response, 'emails/js/typeahead')
@@ -1,7 +1,42 @@
-from django.test import TestCase, Client
+import csv
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from emails import conditional, counters, translation_memory, typeahead, views
+from emails.bulk import bulk_update
+from emails.pagination import encode_cursor
+from emails.tests.budgets import QUERY_BUDGETS, QueryBudgetMixin
 from emails.models import Email, Category, EmailTranslation
 from django.urls import reverse
-from django.contrib.auth.models import User, Permission
+from django.contrib.auth.models import Group, User, Permission
+
+def email_post_data(email, translations, category=None):
+    '''
+    POST data for the email create/update form.  translations is a list of
+    (id or None, language, content, delete).
+    '''
+    data = {
+        'name_eng': email['name_eng'],
+        'name_esp': email['name_esp'],
+        'category': category.id if category else '',
+        'emailtranslation_set-TOTAL_FORMS': len(translations),
+        'emailtranslation_set-INITIAL_FORMS': len([t for t in translations if t[0]]),
+        'emailtranslation_set-MIN_NUM_FORMS': 0,
+        'emailtranslation_set-MAX_NUM_FORMS': 1000,
+    }
+    for i, (pk, language, content, delete) in enumerate(translations):
+        prefix = 'emailtranslation_set-%d-' % i
+        data[prefix + 'id'] = pk or ''
+        data[prefix + 'language'] = language
+        data[prefix + 'content'] = content
+        if delete:
+            data[prefix + 'DELETE'] = 'on'
+    return data
 
 class IndexTests(TestCase):
     @classmethod
@@ -86,6 +121,19 @@ class EmailDetailViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'email_detail.html')
 
+    def test_stored_html_is_used(self):
+        translation = EmailTranslation.objects.create(
+            email=self.email1,
+            language='EN',
+            content = 'Dear <customer>,\n\nWelcome'
+        )
+        self.assertEqual(translation.content_html, '<p>Dear &lt;customer&gt;,</p>\n\n<p>Welcome</p>')
+        EmailTranslation.objects.filter(id=translation.id).update(content_html='<p>Stored copy</p>')
+
+        login = self.client.login(username='test_user2', password='iO**pgf!!2')
+        response = self.client.get(reverse('email_detail', args=(self.email1.id,)))
+        self.assertTrue('<p>Stored copy</p>' in response.content.decode())
+
 class EmailListViewTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -113,6 +161,57 @@ class EmailListViewTests(TestCase):
         response = self.client.get(reverse('all_emails'))
         self.assertTrue("Welcome" in str(response.content))
 
+    '''
+    A page costs the same number of queries however many emails there are
+    '''
+    def test_query_count_constant(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        # Logging in forgets the cached permissions, so the first page loads them
+        with self.assertNumQueries(7):
+            self.client.get(reverse('all_emails'))
+        for i in range(60):
+            Email.objects.create(name_eng="Email %02d" % i, name_esp="Correo %02d" % i, category=self.category1)
+        # session, user, page state, emails, categories
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('all_emails'))
+        self.assertEqual(len(response.context['email_list']), 50)
+
+    def test_next_and_previous_pages(self):
+        for i in range(60):
+            Email.objects.create(name_eng="Email %02d" % i, name_esp="Correo %02d" % i, category=self.category1)
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('all_emails'))
+        self.assertFalse('previous_url' in response.context)
+        first_page = [email.id for email in response.context['email_list']]
+
+        response = self.client.get(reverse('all_emails') + response.context['next_url'])
+        second_page = [email.id for email in response.context['email_list']]
+        self.assertEqual(len(second_page), 11)
+        self.assertFalse(set(first_page) & set(second_page))
+        self.assertFalse('next_url' in response.context)
+
+        response = self.client.get(reverse('all_emails') + response.context['previous_url'])
+        self.assertEqual([email.id for email in response.context['email_list']], first_page)
+
+    def test_malformed_cursor_is_ignored(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        for values in (['x', 'notanint'], [None, 1]):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('all_emails'), {'after': encode_cursor(values)})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(list(response.context['email_list']), [self.email1])
+
+    def test_filter_by_name_and_category(self):
+        category2 = Category.objects.create(name="Company Information")
+        Email.objects.create(name_eng="Opening hours", name_esp="Horario", category=category2)
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+
+        response = self.client.get(reverse('all_emails'), {'category': category2.id})
+        self.assertEqual([str(email) for email in response.context['email_list']], ['Opening hours, Horario'])
+
+        response = self.client.get(reverse('all_emails'), {'name': 'bienven'})
+        self.assertEqual([str(email) for email in response.context['email_list']], ['Welcome, Bienvenido'])
+
 class EmailCreateViewTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -168,6 +267,28 @@ class EmailCreateViewTests(TestCase):
         response = self.client.get(reverse('email_create'))
         self.assertTemplateUsed(response, 'emails/email_create.html')
 
+    def test_create_email_with_translations(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = email_post_data({'name_eng': 'Goodbye', 'name_esp': 'Adios'}, [
+            (None, 'EN', 'Goodbye', False),
+            (None, 'FR', 'Au revoir', False),
+            (None, 'EN', '', False),
+        ], self.category1)
+        response = self.client.post(reverse('email_create'), data)
+        email = Email.objects.get(name_eng='Goodbye')
+        self.assertRedirects(response, reverse('email_detail', args=(email.id,)), fetch_redirect_response=False)
+        self.assertEqual(dict(email.emailtranslation_set.values_list('language', 'content_html')),
+            {'EN': '<p>Goodbye</p>', 'FR': '<p>Au revoir</p>'})
+
+    def test_conflicting_translation_leaves_nothing_behind(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = email_post_data({'name_eng': 'Goodbye', 'name_esp': 'Adios'}, [(None, 'EN', 'Goodbye', False)], self.category1)
+        with mock.patch('emails.forms.BaseEmailTranslationFormSet.save_translations', side_effect=IntegrityError):
+            response = self.client.post(reverse('email_create'), data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.context['formset'].non_form_errors(), [views.TRANSLATION_CONFLICT])
+        self.assertFalse(Email.objects.filter(name_eng='Goodbye').exists())
+
 class EmailUpdateViewTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -224,6 +345,142 @@ class EmailUpdateViewTests(TestCase):
         self.assertTemplateUsed(response, 'emails/email_update.html')
         self.assertTrue(response.status_code, 200)
 
+    def update_data(self, changes, new=(), delete=()):
+        translations = []
+        for translation in self.email1.emailtranslation_set.order_by('id'):
+            content = changes.get(translation.language, translation.content)
+            translations.append((translation.id, translation.language, content, translation.language in delete))
+        translations += [(None, language, content, False) for language, content in new]
+        return email_post_data({'name_eng': 'Welcome', 'name_esp': 'Bienvenido'}, translations, self.category1)
+
+    def test_update_adds_changes_and_deletes(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = self.update_data({'ES': 'Bienvenida'}, new=[('FR', 'Bienvenue')], delete=['EN'])
+        response = self.client.post(reverse('email_update', args=(self.email1.id,)), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(self.email1.emailtranslation_set.values_list('language', 'content')),
+            {'ES': 'Bienvenida', 'FR': 'Bienvenue'})
+        self.assertEqual(EmailTranslation.objects.get(language='ES').content_html, '<p>Bienvenida</p>')
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_duplicate_language_is_reported(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = self.update_data({}, new=[('ES', 'Hola')])
+        response = self.client.post(reverse('email_update', args=(self.email1.id,)), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['formset'].non_form_errors(), ['There is more than one Spanish translation.'])
+        self.assertEqual(response.context['formset'][2].errors['language'], ['There is already a Spanish translation.'])
+        self.assertEqual(self.email1.emailtranslation_set.filter(language='ES').count(), 1)
+
+        with self.assertRaises(ValidationError):
+            EmailTranslation(email=self.email1, language='ES', content='Hola').validate_unique()
+
+    def test_delete_and_add_same_language(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = self.update_data({}, new=[('EN', 'Hello')], delete=['EN'])
+        response = self.client.post(reverse('email_update', args=(self.email1.id,)), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.email1.emailtranslation_set.get(language='EN').content, 'Hello')
+
+    def test_translations_swap_languages(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        spanish, english = self.email1.emailtranslation_set.order_by('id')
+        data = email_post_data({'name_eng': 'Welcome', 'name_esp': 'Bienvenido'},
+            [(spanish.id, 'EN', 'Bienvenido', False), (english.id, 'ES', 'Welcome', False)], self.category1)
+        response = self.client.post(reverse('email_update', args=(self.email1.id,)), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(self.email1.emailtranslation_set.values_list('id', 'language')),
+            {spanish.id: 'EN', english.id: 'ES'})
+
+    def test_language_added_in_the_meantime_is_reported(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        data = self.update_data({}, new=[('FR', 'Bienvenue')])
+        # Added in the translation editor after the page was loaded
+        EmailTranslation.objects.create(email=self.email1, language='FR', content='Salut')
+        response = self.client.post(reverse('email_update', args=(self.email1.id,)), data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.context['formset'].non_form_errors(), [views.TRANSLATION_CONFLICT])
+        self.assertContains(response, views.TRANSLATION_CONFLICT, status_code=409)
+        self.assertEqual(self.email1.emailtranslation_set.get(language='FR').content, 'Salut')
+
+    '''
+    Saving costs the same number of queries however many translations changed
+    '''
+    def test_update_query_count_constant(self):
+        for language in ('FR', 'DE', 'IT', 'NE'):
+            EmailTranslation.objects.create(email=self.email1, language=language, content='Old')
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        url = reverse('email_update', args=(self.email1.id,))
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as one_change:
+            self.client.post(url, self.update_data({'FR': 'One'}))
+        with CaptureQueriesContext(connection) as all_changed:
+            self.client.post(url, self.update_data({language: 'All' for language in ('ES', 'EN', 'FR', 'DE', 'IT', 'NE')}))
+        self.assertEqual(len(one_change), len(all_changed))
+        self.assertEqual(set(self.email1.emailtranslation_set.values_list('content', flat=True)), {'All'})
+
+        with CaptureQueriesContext(connection) as nothing_changed:
+            self.client.post(url, self.update_data({}))
+        self.assertFalse([query for query in nothing_changed.captured_queries
+            if query['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))])
+
+class TranslationSaveViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.translation1 = EmailTranslation.objects.create(
+            email=cls.email1,
+            language='ES',
+            content = 'Bienvenido'
+        )
+
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='Yui*!v4G6!')
+        cls.test_user1.user_permissions.add(Permission.objects.get(name="Can change email"))
+
+    def test_user2_cant_save(self):
+        login = self.client.login(username='test_user2', password='Yui*!v4G6!')
+        response = self.client.post(reverse('translation_save', args=(self.email1.id, 'FR')), {'FR-content': 'Bienvenue'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(EmailTranslation.objects.filter(language='FR').exists())
+
+    def test_editor_page(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('translation_editor', args=(self.email1.id,)))
+        self.assertTemplateUsed(response, 'emails/translation_editor.html')
+        self.assertEqual(len(response.context['forms']), 6)
+        self.assertTrue('Bienvenido</textarea>' in response.content.decode())
+
+    def test_create_translation_json(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.post(reverse('translation_save', args=(self.email1.id, 'FR')),
+            {'FR-content': 'Bienvenue'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'language': 'FR', 'saved': True, 'content_html': '<p>Bienvenue</p>', 'errors': {}})
+        self.assertEqual(self.email1.emailtranslation_set.get(language='FR').content, 'Bienvenue')
+
+    def test_update_translation_html(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.post(reverse('translation_save', args=(self.email1.id, 'ES')), {'ES-content': 'Bienvenida'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'emails/translation_form.html')
+        self.assertTrue('Saved' in response.content.decode())
+        self.assertEqual(EmailTranslation.objects.get(id=self.translation1.id).content, 'Bienvenida')
+        self.assertEqual(self.email1.emailtranslation_set.count(), 1)
+
+    def test_invalid_content(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.post(reverse('translation_save', args=(self.email1.id, 'DE')),
+            {'DE-content': ''}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['content'][0]['code'], 'required')
+
+    def test_unknown_language(self):
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.post(reverse('translation_save', args=(self.email1.id, 'XX')), {'XX-content': 'Hi'})
+        self.assertEqual(response.status_code, 404)
+
 class CategoryCreateViewTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -232,7 +489,7 @@ class CategoryCreateViewTests(TestCase):
         cls.test_user1.save()
         cls.test_user2.save()
 
-        perm_can_add_category = Permission.objects.get(name="Can add category")
+        perm_can_add_category = Permission.objects.get(codename="add_category")
         cls.test_user1.user_permissions.add(perm_can_add_category)
         cls.test_user1.save()
 
@@ -268,7 +525,7 @@ class CategoryUpdateViewTests(TestCase):
         cls.test_user1.save()
         cls.test_user2.save()
 
-        perm_can_change_category = Permission.objects.get(name="Can change category")
+        perm_can_change_category = Permission.objects.get(codename="change_category")
         cls.test_user1.user_permissions.add(perm_can_change_category)
         cls.test_user1.save()
 
@@ -326,6 +583,28 @@ class CategoryListViewTests(TestCase):
         self.assertTemplateUsed(response, 'category_list.html')
         self.assertTrue(response.status_code, 200)
 
+    def test_counts(self):
+        email = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=self.category1)
+        Email.objects.create(name_eng="Hello", name_esp="Hola", category=self.category1)
+        EmailTranslation.objects.create(email=email, language='FR', content='Bienvenue')
+        EmailTranslation.objects.create(email=email, language='DE', content='Willkommen')
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('all_categories'))
+        counts = [(category.name, category.num_emails, category.num_translations)
+            for category in response.context['category_list']]
+        self.assertEqual(counts, [('Company Information', 0, 0), ('Company Introductions', 2, 2)])
+        self.assertTrue("2 emails, 2 translations" in str(response.content))
+
+    def test_fixed_query_count(self):
+        for i in range(10):
+            category = Category.objects.create(name="Category %s" % i)
+            Email.objects.create(name_eng="Email %s" % i, name_esp="Correo %s" % i, category=category)
+        login = self.client.login(username='test_user1', password='X$G123**3!')
+        self.client.get(reverse('all_categories'))
+        # session, user, page state, categories
+        with self.assertNumQueries(4):
+            self.client.get(reverse('all_categories'))
+
 class CategoryDetailViewTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -334,8 +613,8 @@ class CategoryDetailViewTests(TestCase):
         cls.test_user1.save()
         cls.test_user2.save()
 
-        perm_can_change_category = Permission.objects.get(name="Can change category")
-        perm_can_view_category = Permission.objects.get(name="Can view category")
+        perm_can_change_category = Permission.objects.get(codename="change_category")
+        perm_can_view_category = Permission.objects.get(codename="view_category")
         
         cls.test_user1.user_permissions.add(perm_can_change_category)
         cls.test_user1.user_permissions.add(perm_can_view_category)
@@ -379,6 +658,31 @@ class CategoryDetailViewTests(TestCase):
         self.assertTemplateUsed(response, 'category_detail.html')
         self.assertTrue(response.status_code, 200)
 
+    def test_emails_are_ordered_with_language_badges(self):
+        EmailTranslation.objects.create(email=self.email1, language='FR', content='Bienvenue')
+        login = self.client.login(username='test_user2', password='Yui*!v4G6!')
+        response = self.client.get(reverse('category_detail', args=(self.category1.id,)))
+        rows = response.context['rows']
+        self.assertEqual([email.name_eng for email, flags in rows], ['Goodbye', 'Hello', 'Welcome'])
+        self.assertEqual([code for code, translated in rows[2][1] if translated], ['FR'])
+        self.assertTrue('badge-success">FR' in str(response.content))
+
+    def test_pages(self):
+        for i in range(60):
+            Email.objects.create(name_eng="Email %02d" % i, name_esp="Correo %02d" % i, category=self.category1)
+        login = self.client.login(username='test_user2', password='Yui*!v4G6!')
+        url = reverse('category_detail', args=(self.category1.id,))
+        response = self.client.get(url)
+        names = [email.name_eng for email, flags in response.context['rows']]
+        self.assertEqual(len(names), 50)
+        response = self.client.get(url + response.context['next_url'])
+        names += [email.name_eng for email, flags in response.context['rows']]
+        self.assertEqual(len(names), 63)
+        self.assertEqual(names, sorted(names))
+        # session, user, page state, category, emails
+        with self.assertNumQueries(5):
+            self.client.get(url + response.context['previous_url'])
+
 
 
 
@@ -403,11 +707,343 @@ class CategoryDetailViewTests(TestCase):
 
         
 
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(name='Category %d' % i) for i in range(3)]
+        cls.emails = []
+        for i in range(12):
+            email = Email.objects.create(name_eng='Email %d' % i, name_esp='Correo %d' % i, category=cls.categories[i % 3])
+            for language in ('EN', 'ES', 'FR'):
+                EmailTranslation.objects.create(email=email, language=language, content='Hello %d %s' % (i, language))
+            cls.emails.append(email)
+
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!', is_staff=True)
+        cls.test_user1.user_permissions.add(*Permission.objects.filter(content_type__app_label='emails'))
+
+    def setUp(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+
+    def test_every_view_has_a_budget(self):
+        from emails.urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns} - set(QUERY_BUDGETS), set())
+
+    def test_pages(self):
+        email, category = self.emails[0], self.categories[0]
+        # Count building the typeahead index and translation memory, not ones left by another test
+        typeahead.forget()
+        translation_memory.forget()
+        for url in (
+            reverse('index'),
+            reverse('email_create'),
+            reverse('email_update', args=(email.id,)),
+            reverse('translation_editor', args=(email.id,)),
+            reverse('translation_save', args=(email.id, 'EN')),
+            reverse('category_create'),
+            reverse('category_update', args=(category.id,)),
+            reverse('all_emails'),
+            reverse('all_emails') + '?name=Email',
+            reverse('search') + '?q=hello',
+            reverse('all_categories'),
+            reverse('email_detail', args=(email.id,)),
+            reverse('category_detail', args=(category.id,)),
+            reverse('query_stats'),
+            reverse('email_history', args=(email.id,)),
+            reverse('email_history', args=(email.id,)) + '?language=EN&revision=1',
+            reverse('email_send', args=(email.id,)),
+            reverse('outbox'),
+            reverse('coverage'),
+            reverse('coverage') + '?missing=on&category=%s' % category.id,
+            reverse('coverage_export'),
+            reverse('duplicates'),
+            reverse('api_email_batch') + '?ids=%s' % ','.join(str(email.id) for email in self.emails),
+            reverse('api_email_detail', args=(email.id,)),
+            reverse('api_email_list'),
+            reverse('api_autocomplete') + '?q=em',
+            reverse('api_changes') + '?since=0',
+            reverse('api_translation_memory') + '?language=FR&source=Thank+you+for+your+order.',
+            reverse('api_export', args=('jsonl',)),
+        ):
+            with self.subTest(url=url):
+                response = self.assertWithinQueryBudget(url)
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(ASYNC_DB_THREADS=0)
+    def test_async_api(self):
+        # Run in the test's own connection, which can see the test data
+        email = self.emails[0]
+        for url in (
+            reverse('api_async_email_batch') + '?ids=%s' % ','.join(str(email.id) for email in self.emails),
+            reverse('api_async_email_detail', args=(email.id,)),
+            reverse('api_async_email_list'),
+        ):
+            with self.subTest(url=url):
+                response = self.assertWithinQueryBudget(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_saves(self):
+        email = self.emails[0]
+        translations = list(email.emailtranslation_set.order_by('id'))
+        data = email_post_data({'name_eng': 'Email 0', 'name_esp': 'Correo cero'},
+            [(t.id, t.language, t.content + '!', False) for t in translations] + [(None, 'DE', 'Hallo', False)],
+            self.categories[0])
+        response = self.assertWithinQueryBudget(reverse('email_update', args=(email.id,)), data, method='post')
+        self.assertEqual(response.status_code, 302)
 
+        response = self.assertWithinQueryBudget(reverse('translation_save', args=(email.id, 'EN')),
+            {'EN-content': 'Hi'}, method='post')
+        self.assertEqual(response.status_code, 200)
 
+        data = email_post_data({'name_eng': 'New', 'name_esp': 'Nuevo'},
+            [(None, 'EN', 'Hi', False), (None, 'FR', 'Salut', False)], self.categories[1])
+        response = self.assertWithinQueryBudget(reverse('email_create'), data, method='post')
+        self.assertEqual(response.status_code, 302)
 
+    def test_merge(self):
+        recipients = 'first_name\n' + 'Ana\n' * 500
+        response = self.assertWithinQueryBudget(reverse('api_email_merge', args=(self.emails[0].id, 'EN')),
+            recipients, method='post', content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
 
+class PermissionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido")
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.group1 = Group.objects.create(name='Editors')
+        cls.perm_can_view_email = Permission.objects.get(name="Can view email")
+        cls.perm_can_change_email = Permission.objects.get(name="Can change email")
+
+    def setUp(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+
+    def permission_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        return response, [query for query in captured if 'auth_permission' in query['sql']]
+
+    def test_warm_cache_runs_no_permission_queries(self):
+        self.test_user1.user_permissions.add(self.perm_can_view_email)
+        url = reverse('email_detail', args=(self.email1.id,))
+        response, queries = self.permission_queries(url)
+        self.assertEqual((response.status_code, len(queries)), (200, 2))
+        response, queries = self.permission_queries(url)
+        self.assertEqual((response.status_code, len(queries)), (200, 0))
+
+    def test_user_permission_changes(self):
+        url = reverse('email_update', args=(self.email1.id,))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.test_user1.user_permissions.add(self.perm_can_change_email)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.perm_can_change_email.user_set.remove(self.test_user1)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_group_changes(self):
+        url = reverse('email_update', args=(self.email1.id,))
+        self.test_user1.groups.add(self.group1)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.group1.permissions.add(self.perm_can_change_email)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.group1.user_set.clear()
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.test_user1.groups.add(self.group1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.group1.delete()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_superuser_flag(self):
+        url = reverse('email_update', args=(self.email1.id,))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.test_user1.is_superuser = True
+        self.test_user1.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class CoverageViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(Permission.objects.get(name="Can view email"))
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.email2 = Email.objects.create(name_eng="Hello", name_esp="Hola", category=None)
+        for language, _ in EmailTranslation.LANGUAGES:
+            EmailTranslation.objects.create(email=cls.email1, language=language, content='Welcome')
+        EmailTranslation.objects.create(email=cls.email2, language='FR', content='Bonjour')
+
+    def setUp(self):
+        # Cached pages outlive each test's rolled back data
+        cache.clear()
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+
+    def test_needs_permission(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
+        response = self.client.get(reverse('coverage'))
+        self.assertEqual(response.status_code, 403)
 
+    def test_matrix(self):
+        response = self.client.get(reverse('coverage'))
+        self.assertEqual(response.status_code, 200)
+        rows = {email.name_eng: dict(flags) for email, flags in response.context['rows']}
+        self.assertTrue(all(rows['Welcome'].values()))
+        self.assertEqual([code for code, translated in rows['Hello'].items() if translated], ['FR'])
+
+    def test_summary(self):
+        response = self.client.get(reverse('coverage'))
+        categories = response.context['categories']
+        self.assertEqual([category.name for category in categories], ['Company Introductions', 'No category'])
+        self.assertEqual(categories[0].complete, 100.0)
+        french = dict((code, percent) for code, translated, percent in categories[1].languages)
+        self.assertEqual((french['FR'], french['DE']), (100.0, 0.0))
+        overall = response.context['overall']
+        self.assertEqual(overall.emails, 2)
+        self.assertEqual(overall.complete, round(100 * (len(EmailTranslation.LANGUAGES) + 1) / (2 * len(EmailTranslation.LANGUAGES)), 1))
+
+    def test_filters(self):
+        response = self.client.get(reverse('coverage'), {'missing': 'on'})
+        self.assertEqual([email.name_eng for email, flags in response.context['rows']], ['Hello'])
+        response = self.client.get(reverse('coverage'), {'category': self.category1.id})
+        self.assertEqual([email.name_eng for email, flags in response.context['rows']], ['Welcome'])
+
+    def test_constant_query_count(self):
+        self.client.get(reverse('coverage'))
+        for i in range(20):
+            email = Email.objects.create(name_eng="Email %s" % i, name_esp="Correo %s" % i, category=self.category1)
+            EmailTranslation.objects.create(email=email, language='EN', content='Content %s' % i)
+        # session, user, the page, the summary and the category filter's choices
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('coverage'))
+        self.assertEqual(len(response.context['rows']), 22)
+        # Cached until something changes
+        with self.assertNumQueries(3):
+            self.client.get(reverse('coverage'))
+
+    def test_changes_clear_the_cache(self):
+        response = self.client.get(reverse('coverage'))
+        self.assertEqual(response.context['overall'].languages[0][1], 1)
+        EmailTranslation.objects.create(email=self.email2, language=EmailTranslation.LANGUAGES[0][0], content='Hi')
+        response = self.client.get(reverse('coverage'))
+        self.assertEqual(response.context['overall'].languages[0][1], 2)
+
+    def test_pages(self):
+        for i in range(60):
+            Email.objects.create(name_eng="Email %02d" % i, name_esp="Correo %02d" % i)
+        response = self.client.get(reverse('coverage'))
+        self.assertEqual(len(response.context['rows']), 50)
+        response = self.client.get(reverse('coverage') + response.context['next_url'])
+        self.assertEqual(len(response.context['rows']), 12)
+
+    def test_junk_cursors_share_the_first_page(self):
+        self.client.get(reverse('coverage'))
+        for after in ('x' * 1000, encode_cursor(['x', 'notanint']), encode_cursor([None, 1])):
+            with self.subTest(after=after), self.assertNumQueries(3):
+                response = self.client.get(reverse('coverage'), {'after': after, 'before': after})
+                self.assertEqual(len(response.context['rows']), 2)
+
+    def test_export(self):
+        response = self.client.get(reverse('coverage_export'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        languages = EmailTranslation.LANGUAGES
+        self.assertEqual(rows[0], ['id', 'name_eng', 'category'] + [name for code, name in languages] + ['languages'])
+        self.assertEqual(rows[1], [str(self.email1.id), 'Welcome', 'Company Introductions'] + ['yes'] * len(languages)
+            + [str(len(languages))])
+        self.assertEqual(rows[2][-1], '1')
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user1 = User.objects.create_user(username='test_user1', password='X$G123**3!')
+        cls.test_user1.user_permissions.add(*Permission.objects.filter(codename__in=['view_email', 'view_category']))
+        cls.test_user2 = User.objects.create_user(username='test_user2', password='iO**pgf!!2')
+        cls.test_user2.user_permissions.add(*Permission.objects.filter(
+            codename__in=['view_email', 'view_category', 'change_email']))
+        cls.category1 = Category.objects.create(name="Company Introductions")
+        cls.email1 = Email.objects.create(name_eng="Welcome", name_esp="Bienvenido", category=cls.category1)
+        cls.translation1 = EmailTranslation.objects.create(email=cls.email1, language='FR', content='Bienvenue')
 
+    def setUp(self):
+        self.client.login(username='test_user1', password='X$G123**3!')
 
-
+    def assertChangesPage(self, url, change):
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unchanged_pages_are_not_sent_again(self):
+        for url in (reverse('email_detail', args=(self.email1.id,)), reverse('all_emails'),
+                reverse('all_categories'), reverse('category_detail', args=(self.category1.id,))):
+            response = self.client.get(url)
+            self.assertTrue(response.has_header('Last-Modified'), url)
+            self.assertIn('no-cache', response['Cache-Control'])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b'')
+
+    def test_not_modified_skips_the_page_queries(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        etag = self.client.get(url)['ETag']
+        # session, user, page state
+        with self.assertNumQueries(3):
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_email_detail_changes(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        self.assertChangesPage(url, lambda: EmailTranslation.objects.create(email=self.email1, language='DE', content='Hallo'))
+        translation = EmailTranslation.objects.get(email=self.email1, language='DE')
+        self.assertChangesPage(url, translation.delete)
+        self.category1.name = "Introductions"
+        self.assertChangesPage(url, self.category1.save)
+
+    def test_bulk_writes_change_pages(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        translation = EmailTranslation.objects.get(pk=self.translation1.pk)
+        translation.content = 'Bienvenue !'
+
+        def save():
+            bulk_update(EmailTranslation, [translation], ['content'])
+        self.assertChangesPage(url, save)
+
+    def test_lists_change(self):
+        self.assertChangesPage(reverse('all_emails'),
+            lambda: Email.objects.create(name_eng="Hello", name_esp="Hola"))
+        self.assertChangesPage(reverse('all_emails'), lambda: Email.objects.get(name_eng="Hello").delete())
+        self.assertChangesPage(reverse('all_categories'),
+            lambda: EmailTranslation.objects.create(email=self.email1, language='IT', content='Benvenuto'))
+        self.assertChangesPage(reverse('category_detail', args=(self.category1.id,)),
+            lambda: EmailTranslation.objects.filter(email=self.email1, language='IT').get().delete())
+
+    def test_list_state_does_not_count_the_tables(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(conditional.table_state(Category, Email, EmailTranslation),
+                [(self.category1.updated_at, 1), (self.email1.updated_at, 1), (self.translation1.updated_at, 1)])
+        self.assertNotIn('COUNT(', queries.captured_queries[0]['sql'].upper())
+        # Deleting a category moves no updated_at, but its counter
+        category = Category.objects.create(name="Holidays")
+        self.assertChangesPage(reverse('all_emails'), category.delete)
+
+    def test_validators_depend_on_the_build(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        etag = self.client.get(url)['ETag']
+        with self.settings(BUILD_VERSION='2.0'):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_validators_depend_on_the_user(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.login(username='test_user2', password='iO**pgf!!2')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_permission_checked_first(self):
+        url = reverse('email_detail', args=(self.email1.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 302)
+
+    def test_missing_objects(self):
+        self.assertEqual(self.client.get(reverse('email_detail', args=(self.email1.id + 100,))).status_code, 404)
+        self.assertEqual(self.client.get(reverse('category_detail', args=(self.category1.id + 100,))).status_code, 404)
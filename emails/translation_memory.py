@@ -0,0 +1,265 @@
+import collections
+import itertools
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import changes
+from .models import Change, EmailTranslation
+from .typeahead import normalize
+
+'''
+Translation memory: how sentences of the English translations were
+translated into the other languages, to suggest while translating.
+
+Each translation of an email is cut into sentences and lined up with the
+English one: paragraph by paragraph and then sentence by sentence where the
+counts agree, or whole paragraphs where only the paragraph counts do.  Emails
+whose translations can't be lined up that way add nothing.  The same pair of
+sentences used in several emails is kept once.
+
+English sentences are indexed by their character trigrams, per target
+language, and scored by the share of trigrams they have in common with the
+one being translated (Dice similarity).  Common trigrams ("the", "you") are
+in most sentences, so a lookup only reads the postings of the sentence's
+RARE_TRIGRAMS rarest trigrams and scores the CANDIDATES sentences that share
+the most of them.  A close match shares most of its trigrams, the rare ones
+included, so it is almost never missed, and a lookup stays at a few
+milliseconds per sentence with tens of thousands of sentences per language.
+
+Like the typeahead, each server process keeps its own memory, built on
+first use.  Writes in this process mark their emails, which are read again by
+the next lookup; writes elsewhere are found in the change log, checked at most
+every TRANSLATION_MEMORY_REFRESH_SECONDS.
+'''
+
+SOURCE_LANGUAGE = 'EN'
+# Share of trigrams in common, the usual floor for fuzzy matches
+MIN_SIMILARITY = 0.7
+LIMIT = 3
+MAX_LIMIT = 10
+REFRESH_SECONDS = 1
+# A lookup reads the postings of this many of a sentence's rarest trigrams,
+# and scores the sentences that share the most of them
+RARE_TRIGRAMS = 16
+CANDIDATES = 50
+# Above this many changed emails, the memory is built again from scratch
+REBUILD_AFTER = 1000
+PARAGRAPHS = re.compile(r'\n\s*\n')
+SENTENCE_BREAKS = re.compile(r'(?<=[.!?…])\s+|\n')
+
+
+def sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BREAKS.split(text) if sentence.strip()]
+
+
+def align(source, target):
+    '''
+    [(source sentence, target sentence)] of two translations of one text.
+    '''
+    source_paragraphs, target_paragraphs = PARAGRAPHS.split(source.strip()), PARAGRAPHS.split(target.strip())
+    if len(source_paragraphs) != len(target_paragraphs):
+        source_paragraphs, target_paragraphs = [source], [target]
+    pairs = []
+    for source_paragraph, target_paragraph in zip(source_paragraphs, target_paragraphs):
+        source_sentences, target_sentences = sentences(source_paragraph), sentences(target_paragraph)
+        if not source_sentences or not target_sentences:
+            continue
+        if len(source_sentences) == len(target_sentences):
+            pairs.extend(zip(source_sentences, target_sentences))
+        elif len(source_paragraphs) > 1:
+            pairs.append((' '.join(source_sentences), ' '.join(target_sentences)))
+    return pairs
+
+
+def trigrams(normalized):
+    text = ' %s ' % normalized
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class Memory:
+    def __init__(self):
+        # id: [language, source, normalized source, target, trigram count, email ids]
+        self.units = {}
+        # (language, normalized source, target): id
+        self.ids = {}
+        # language: {trigram: unit ids}
+        self.postings = {}
+        # email id: unit ids
+        self.by_email = {}
+        # translation id: email id, to find the email of a deleted translation
+        self.emails = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.checked = 0
+
+    def add_email(self, email_id, translations):
+        '''
+        Puts the sentences of one email's [(pk, language, content)] in the memory.
+        '''
+        source = None
+        for pk, language, content in translations:
+            self.emails[pk] = email_id
+            if language == SOURCE_LANGUAGE:
+                source = content
+        ids = []
+        if source is not None:
+            for pk, language, content in translations:
+                if language == SOURCE_LANGUAGE:
+                    continue
+                for source_sentence, target_sentence in align(source, content):
+                    normalized = normalize(source_sentence)
+                    key = (language, normalized, target_sentence)
+                    unit_id = self.ids.get(key)
+                    if unit_id is None:
+                        unit_id = self.ids[key] = self.next_id
+                        self.next_id += 1
+                        grams = trigrams(normalized)
+                        self.units[unit_id] = [language, source_sentence, normalized, target_sentence, len(grams), set()]
+                        postings = self.postings.setdefault(language, {})
+                        for gram in grams:
+                            postings.setdefault(gram, set()).add(unit_id)
+                    self.units[unit_id][5].add(email_id)
+                    ids.append(unit_id)
+        self.by_email[email_id] = ids
+
+    def remove_email(self, email_id):
+        for unit_id in self.by_email.pop(email_id, ()):
+            unit = self.units.get(unit_id)
+            if unit is None:
+                continue
+            unit[5].discard(email_id)
+            if unit[5]:
+                continue
+            language, source, normalized, target, size, emails = self.units.pop(unit_id)
+            del self.ids[(language, normalized, target)]
+            postings = self.postings[language]
+            for gram in trigrams(normalized):
+                posting = postings.get(gram)
+                if posting is not None:
+                    posting.discard(unit_id)
+                    if not posting:
+                        del postings[gram]
+
+    def load(self, rows):
+        '''
+        Fills the memory from (pk, email id, language, content) rows ordered by email.
+        '''
+        for email_id, translations in itertools.groupby(rows, key=lambda row: row[1]):
+            self.add_email(email_id, [(pk, language, content) for pk, email, language, content in translations])
+
+    def suggest(self, source, language, limit=LIMIT, exclude=None):
+        '''
+        [(sentence, [(similarity, source, target, email count)])] with the
+        closest sentences in the memory to each sentence of source, and how
+        they were translated into language.  Sentences only the email with
+        pk exclude uses are left out.
+        '''
+        with self.lock:
+            postings = self.postings.get(language, {})
+            return [(sentence, self.matches(sentence, postings, limit, exclude)) for sentence in sentences(source)]
+
+    def matches(self, sentence, postings, limit, exclude):
+        query = trigrams(normalize(sentence))
+        size = len(query)
+        rarest = sorted(query, key=lambda gram: len(postings.get(gram, ())))[:RARE_TRIGRAMS]
+        counts = collections.Counter()
+        for gram in rarest:
+            counts.update(postings.get(gram, ()))
+        found = []
+        for unit_id, count in counts.most_common(CANDIDATES):
+            language, source, normalized, target, grams, emails = self.units[unit_id]
+            if emails == {exclude}:
+                continue
+            similarity = 2 * len(query & trigrams(normalized)) / (size + grams)
+            if similarity >= MIN_SIMILARITY:
+                found.append((round(similarity, 3), source, target, len(emails)))
+        found.sort(key=lambda match: (-match[0], -match[3], match[1], match[2]))
+        return found[:limit]
+
+
+_memory = None
+_lock = threading.Lock()
+# Emails written by this process since the last lookup
+_pending = set()
+
+
+def rows(translations):
+    return (translations.filter(email__isnull=False).order_by('email_id', 'pk')
+        .values_list('pk', 'email_id', 'language', 'content'))
+
+
+def memory():
+    '''
+    This process's memory, built on first use, with the emails written here
+    since the last lookup read again, and caught up with the change log at
+    most every REFRESH_SECONDS.
+    '''
+    global _memory
+    with _lock:
+        if _memory is None:
+            built = Memory()
+            # Changes from here on are applied by refresh(); applying one twice does no harm
+            built.seq = changes.latest_seq()
+            built.load(rows(EmailTranslation.objects.all()).iterator())
+            built.checked = time.monotonic()
+            _memory = built
+            _pending.clear()
+        current = _memory
+        emails = set(_pending)
+        _pending.clear()
+    translations = set()
+    if time.monotonic() - current.checked >= getattr(settings, 'TRANSLATION_MEMORY_REFRESH_SECONDS', REFRESH_SECONDS):
+        current.checked = time.monotonic()
+        ids, current.seq = changes.touched(current.seq)
+        emails |= ids[Change.EMAIL]
+        translations = ids[Change.TRANSLATION]
+    if emails or translations:
+        refresh(current, emails, translations)
+    return current
+
+
+def refresh(current, emails, translations):
+    '''
+    Reads the translations of the emails again, and those of the emails the
+    translations with pks in translations belong (or belonged) to.
+    '''
+    emails = set(emails) | {current.emails[pk] for pk in translations if pk in current.emails}
+    if len(emails) + len(translations) > REBUILD_AFTER:
+        found = rows(EmailTranslation.objects.all())
+    else:
+        found = rows(EmailTranslation.objects.filter(Q(email_id__in=emails)
+            | Q(email_id__in=EmailTranslation.objects.filter(pk__in=translations).values('email_id'))))
+    found = {email_id: [(pk, language, content) for pk, email, language, content in group]
+        for email_id, group in itertools.groupby(found.iterator(), key=lambda row: row[1])}
+    with current.lock:
+        if len(emails) + len(translations) > REBUILD_AFTER:
+            emails = set(current.by_email)
+        for email_id in emails | set(found):
+            current.remove_email(email_id)
+            if email_id in found:
+                current.add_email(email_id, found[email_id])
+
+
+def written(email_ids):
+    '''
+    Marks emails whose translations this process changed; signals.py calls
+    it once the transaction commits.
+    '''
+    if _memory is not None:
+        with _lock:
+            _pending.update(email_ids)
+
+
+def forget():
+    '''
+    Drops this process's memory; the next lookup builds it again.
+    '''
+    global _memory
+    with _lock:
+        _memory = None
+        _pending.clear()
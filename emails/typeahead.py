@@ -0,0 +1,201 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+from . import changes
+from .models import Category, Change, Email
+
+'''
+Typeahead over email and category names.
+
+Each server process keeps a PrefixIndex in memory, built from the database
+the first time someone types (index()).  It holds two sorted lists: whole
+names, and the rest of each name from every later word on ("order shipped
+today" is also found as "shipped today" and "today").  A lookup is a binary
+search for the typed prefix in each list, names starting with it first, so
+it costs the same at 100 or 100 000 emails.  Matching ignores case and
+accents.
+
+signals.py updates the index of the process that saved or deleted an email
+or category once the transaction commits.  Other processes catch up from the
+change log (see changes.py), checked at most every TYPEAHEAD_REFRESH_SECONDS
+when someone types.
+'''
+
+LIMIT = 10
+MAX_LIMIT = 50
+REFRESH_SECONDS = 1
+SPACES = re.compile(r'\s+')
+WORD_START = re.compile(r'(?<=\s)\S')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return SPACES.sub(' ', text).strip()
+
+
+class PrefixIndex:
+    def __init__(self):
+        # Sorted (term, kind, pk); kind is Change.EMAIL or Change.CATEGORY
+        self.names = []
+        self.words = []
+        # (kind, pk): (label, detail, names terms, words terms)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.checked = 0
+
+    def add(self, kind, pk, label, detail=''):
+        names, words = set(), set()
+        for name in (label, detail):
+            name = normalize(name)
+            if name:
+                names.add(name)
+                words.update(name[match.start():] for match in WORD_START.finditer(name))
+        with self.lock:
+            self._remove(kind, pk)
+            self.entries[(kind, pk)] = (label, detail, names, words)
+            for term in names:
+                bisect.insort(self.names, (term, kind, pk))
+            for term in words:
+                bisect.insort(self.words, (term, kind, pk))
+
+    def remove(self, kind, pk):
+        with self.lock:
+            self._remove(kind, pk)
+
+    def _remove(self, kind, pk):
+        entry = self.entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for terms, rows in ((entry[2], self.names), (entry[3], self.words)):
+            for term in terms:
+                i = bisect.bisect_left(rows, (term, kind, pk))
+                if i < len(rows) and rows[i] == (term, kind, pk):
+                    del rows[i]
+
+    def load(self, emails, categories):
+        '''
+        Fills an empty index from (pk, name_eng, name_esp) and (pk, name) rows,
+        sorting once instead of inserting one by one.
+        '''
+        for kind, rows in ((Change.EMAIL, emails), (Change.CATEGORY, categories)):
+            for pk, label, *detail in rows:
+                detail = detail[0] if detail else ''
+                names = {normalize(name) for name in (label, detail)} - {''}
+                words = {name[match.start():] for name in names for match in WORD_START.finditer(name)}
+                self.entries[(kind, pk)] = (label, detail, names, words)
+                self.names.extend((term, kind, pk) for term in names)
+                self.words.extend((term, kind, pk) for term in words)
+        self.names.sort()
+        self.words.sort()
+
+    def search(self, query, limit=LIMIT, kinds=(Change.EMAIL, Change.CATEGORY)):
+        '''
+        [(kind, pk, label, detail)] of up to limit entries of the given kinds
+        with a name, or a word in a name, starting with query; whole names
+        first, each group in alphabetical order.
+        '''
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = {}
+        with self.lock:
+            for rows in (self.names, self.words):
+                i = bisect.bisect_left(rows, (prefix,))
+                while i < len(rows) and len(found) < limit and rows[i][0].startswith(prefix):
+                    term, kind, pk = rows[i]
+                    if kind in kinds and (kind, pk) not in found:
+                        label, detail = self.entries[(kind, pk)][:2]
+                        found[(kind, pk)] = (kind, pk, label, detail)
+                    i += 1
+        return list(found.values())
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def index():
+    '''
+    This process's index, built on first use and caught up with the change
+    log at most every REFRESH_SECONDS.
+    '''
+    global _index
+    with _lock:
+        if _index is None:
+            built = PrefixIndex()
+            # Changes from here on are applied by refresh(); applying one twice does no harm
+            built.seq = changes.latest_seq()
+            built.load(Email.objects.values_list('pk', 'name_eng', 'name_esp').iterator(),
+                Category.objects.values_list('pk', 'name').iterator())
+            built.checked = time.monotonic()
+            _index = built
+        current = _index
+    if time.monotonic() - current.checked >= getattr(settings, 'TYPEAHEAD_REFRESH_SECONDS', REFRESH_SECONDS):
+        refresh(current)
+    return current
+
+
+def refresh(current):
+    '''
+    Applies the changes to emails and categories logged since current.seq.
+    '''
+    current.checked = time.monotonic()
+    ids, current.seq = changes.touched(current.seq)
+    if ids[Change.EMAIL]:
+        rows = {pk: (eng, esp) for pk, eng, esp in
+            Email.objects.filter(pk__in=ids[Change.EMAIL]).values_list('pk', 'name_eng', 'name_esp')}
+        for pk in ids[Change.EMAIL]:
+            if pk in rows:
+                current.add(Change.EMAIL, pk, *rows[pk])
+            else:
+                current.remove(Change.EMAIL, pk)
+    if ids[Change.CATEGORY]:
+        rows = dict(Category.objects.filter(pk__in=ids[Change.CATEGORY]).values_list('pk', 'name'))
+        for pk in ids[Change.CATEGORY]:
+            if pk in rows:
+                current.add(Change.CATEGORY, pk, rows[pk])
+            else:
+                current.remove(Change.CATEGORY, pk)
+
+
+def row(instance):
+    '''
+    (pk, label, detail) of an email or category.
+    '''
+    if isinstance(instance, Email):
+        return instance.pk, instance.name_eng, instance.name_esp
+    return instance.pk, instance.name, ''
+
+
+def saved(kind, rows):
+    '''
+    Puts the row()s of saved emails or categories in this process's index,
+    if it has one.  signals.py calls it once the transaction commits.
+    '''
+    if _index is None:
+        return
+    for pk, label, detail in rows:
+        _index.add(kind, pk, label, detail)
+
+
+def deleted(kind, ids):
+    if _index is None:
+        return
+    for pk in ids:
+        _index.remove(kind, pk)
+
+
+def forget():
+    '''
+    Drops this process's index; the next lookup builds it again.
+    '''
+    global _index
+    with _lock:
+        _index = None
@@ -1,14 +1,35 @@
 from django.urls import path
-from . import views
+from . import views, api, async_api
 
 urlpatterns = [
     path('', views.index, name="index"),
     path('email/create/', views.EmailCreate.as_view(), name='email_create'),
     path('email/update/<int:pk>', views.email_update, name='email_update'),
+    path('email/<int:pk>/translations', views.translation_editor, name='translation_editor'),
+    path('email/<int:pk>/translation/<str:language>', views.translation_save, name='translation_save'),
     path('category/create/', views.CategoryCreate.as_view(), name='category_create'),
     path('category/update/<int:pk>', views.CategoryUpdate.as_view(), name='category_update'),
     path('all/', views.EmailListView.as_view(), name='all_emails'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('email/<int:pk>/history', views.email_history, name='email_history'),
+    path('email/<int:pk>/send', views.email_send, name='email_send'),
+    path('outbox/', views.outbox_status, name='outbox'),
+    path('coverage/', views.CoverageView.as_view(), name='coverage'),
+    path('coverage/export.csv', views.coverage_export, name='coverage_export'),
+    path('duplicates/', views.duplicates_report, name='duplicates'),
     path('allcategories/', views.CategoryList.as_view(), name='all_categories'),
     path('email/<int:pk>', views.EmailDetailView.as_view(), name='email_detail'),
     path('category/<int:pk>', views.CategoryDetailView.as_view(), name='category_detail'),
+    path('stats/queries/', views.query_stats, name='query_stats'),
+    path('api/emails/', api.email_batch, name='api_email_batch'),
+    path('api/emails/<int:pk>', api.email_detail, name='api_email_detail'),
+    path('api/emails/all', api.email_list, name='api_email_list'),
+    path('api/emails/<int:pk>/merge/<str:language>', api.email_merge, name='api_email_merge'),
+    path('api/autocomplete', api.autocomplete, name='api_autocomplete'),
+    path('api/changes', api.change_feed, name='api_changes'),
+    path('api/translation-memory', api.translation_suggestions, name='api_translation_memory'),
+    path('api/export/<str:file_format>', api.export_catalog, name='api_export'),
+    path('api/async/emails/', async_api.email_batch, name='api_async_email_batch'),
+    path('api/async/emails/<int:pk>', async_api.email_detail, name='api_async_email_detail'),
+    path('api/async/emails/all', async_api.email_list, name='api_async_email_list'),
 ]
\ No newline at end of file
@@ -1,40 +1,206 @@
+import calendar
+import csv
+import hashlib
+
 from django.shortcuts import render, get_object_or_404
 
-from .models import Email, EmailTranslation, Category
+from .models import Email, EmailTranslation, Category, OutboundMessage, TranslationRevision
 
-from django.forms.models import inlineformset_factory
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views import generic
 from django.urls import reverse, reverse_lazy
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import permission_required
+from django.views.decorators.http import require_http_methods
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import PermissionRequiredMixin
 
-from .forms import EmailForm
+from .forms import (CoverageFilterForm, DuplicatesForm, EmailForm, EmailFilterForm, EmailTranslationContentForm,
+    EmailTranslationFormSet, SearchForm, SendEmailForm)
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+from . import conditional, counters, coverage, duplicates, merge, outbox, querystats, revisions, search
 
 # VIEWS
 
 @login_required
 def index(request):
-    num_emails = Email.objects.all().count()
-    num_emailtranslations = EmailTranslation.objects.all().count()
-    return render(request, 'emails/index.html', 
-        {"num_emails":num_emails,
-        "num_emailtranslations":num_emailtranslations,
-        })
-
-class EmailDetailView(PermissionRequiredMixin, generic.DetailView):
+    return render(request, 'emails/index.html', counters.dashboard_stats())
+
+class ConditionalPageMixin:
+    '''
+    Answers GET with 304 Not Modified when the client's copy of the page is
+    still current, going by get_page_state() (see conditional.py).  Goes
+    after the permission mixins, so only users who may see the page get one.
+    '''
+    def get_page_state(self):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        state = self.get_page_state()
+        if state is None:
+            # Nothing to show; the view answers 404
+            return super().dispatch(request, *args, **kwargs)
+        etag = conditional.etag(request, state)
+        last_modified = conditional.last_modified(state)
+        timestamp = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # The page depends on who is looking; browsers ask again every time
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class EmailDetailView(PermissionRequiredMixin, ConditionalPageMixin, generic.DetailView):
     permission_required = 'emails.view_email'
-    model = Email
+    queryset = Email.objects.select_related('category')
     template_name = 'email_detail.html'
 
-class EmailListView(LoginRequiredMixin, generic.ListView):
+    def get_page_state(self):
+        return conditional.email_state(self.kwargs['pk'])
+
+class KeysetPageMixin:
+    '''
+    Links to the pages before and after self.page, keeping the other query parameters.
+    '''
+    def page_url(self, param, cursor):
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        query[param] = cursor
+        return '?' + query.urlencode()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page'] = self.page
+        if self.page.has_next():
+            context['next_url'] = self.page_url('after', self.page.next_cursor)
+        if self.page.has_previous():
+            context['previous_url'] = self.page_url('before', self.page.previous_cursor)
+        return context
+
+class EmailListView(LoginRequiredMixin, ConditionalPageMixin, KeysetPageMixin, generic.ListView):
     model = Email
     template_name = 'email_list.html'
+    context_object_name = 'email_list'
+    page_size = 50
+    ordering_keys = ('name_eng', 'id')
+
+    def get_page_state(self):
+        # Categories too, for the badges and the filter's choices
+        return conditional.table_state(Email, Category)
+
+    def get_queryset(self):
+        queryset = Email.objects.select_related('category')
+        self.filter_form = EmailFilterForm(self.request.GET)
+        if self.filter_form.is_valid():
+            name = self.filter_form.cleaned_data['name']
+            category = self.filter_form.cleaned_data['category']
+            if name:
+                queryset = queryset.filter(Q(name_eng__icontains=name) | Q(name_esp__icontains=name))
+            if category:
+                queryset = queryset.filter(category=category)
+        self.page = keyset_paginate(queryset, self.ordering_keys,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+            per_page=self.page_size)
+        return self.page.object_list
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        return context
+
+class CoverageView(PermissionRequiredMixin, KeysetPageMixin, generic.TemplateView):
+    '''
+    Which languages each email is translated into, a page at a time, with
+    completion per category and language.  See coverage.py.
+    '''
+    permission_required = 'emails.view_email'
+    template_name = 'emails/coverage.html'
+    page_size = 50
+    ordering_keys = ('name_eng', 'id')
+
+    def get_context_data(self, **kwargs):
+        self.filter_form = CoverageFilterForm(self.request.GET)
+        queryset = coverage.matrix(Email.objects.select_related('category'))
+        category, missing = None, False
+        if self.filter_form.is_valid():
+            category = self.filter_form.cleaned_data['category']
+            missing = self.filter_form.cleaned_data['missing']
+        if category:
+            queryset = queryset.filter(category=category)
+        if missing:
+            queryset = coverage.missing_only(queryset)
+
+        # Cache keys come from the decoded cursors, hashed, so junk in the query
+        # string neither fills the cache nor makes a key the backend refuses
+        after, before = [encode_cursor(values) if values is not None else ''
+            for values in (decode_cursor(self.request.GET.get(name), Email, self.ordering_keys)
+                for name in ('after', 'before'))]
+        cursors = hashlib.sha1(('%s:%s' % (after, before)).encode()).hexdigest()
+        key = 'page:%s:%d:%s' % (category.pk if category else '', missing, cursors)
+        self.page = coverage.cached(key, lambda: keyset_paginate(queryset, self.ordering_keys,
+            after=after, before=before, per_page=self.page_size))
+        categories, overall = coverage.cached('summary', coverage.summary)
+
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        context['languages'] = coverage.LANGUAGES
+        context['rows'] = [(email, coverage.flags(email)) for email in self.page.object_list]
+        context['categories'] = categories
+        context['overall'] = overall
+        return context
+
+@permission_required('emails.view_email')
+def coverage_export(request):
+    response = StreamingHttpResponse(coverage.export_csv(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="coverage.csv"'
+    return response
+
+class SearchView(PermissionRequiredMixin, generic.TemplateView):
+    permission_required = 'emails.view_email'
+    template_name = 'emails/search.html'
+    page_size = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = SearchForm(self.request.GET or None)
+        context['form'] = form
+        if form.is_valid():
+            try:
+                page = max(1, int(self.request.GET.get('page', 1)))
+            except ValueError:
+                page = 1
+            # Fetch one extra to know if there is a next page
+            results = search.search(form.cleaned_data['q'], form.cleaned_data['lang'],
+                limit=self.page_size + 1, offset=(page - 1) * self.page_size)
+            query = self.request.GET.copy()
+            if len(results) > self.page_size:
+                query['page'] = page + 1
+                context['next_url'] = '?' + query.urlencode()
+            if page > 1:
+                query['page'] = page - 1
+                context['previous_url'] = '?' + query.urlencode()
+            context['results'] = results[:self.page_size]
+        return context
+
+# Somebody else added one of the languages (in the translation editor, say) since we looked
+TRANSLATION_CONFLICT = 'A translation in one of these languages was added in the meantime. Reload the page to edit it.'
 
 class EmailCreate(PermissionRequiredMixin, generic.TemplateView):
     template_name = 'emails/email_create.html'
@@ -42,7 +208,6 @@ class EmailCreate(PermissionRequiredMixin, generic.TemplateView):
 
     def get(self, request, *args, **kwargs):
         email_form = EmailForm()
-        EmailTranslationFormSet = inlineformset_factory(Email, EmailTranslation, fields=('language', 'content',))
         formset = EmailTranslationFormSet()
 
         context = {"form":email_form, "formset":formset}
@@ -50,36 +215,96 @@ class EmailCreate(PermissionRequiredMixin, generic.TemplateView):
 
     def post(self, request, *args, **kwargs):
         email_form = EmailForm(data=request.POST)
-        EmailTranslationFormSet = inlineformset_factory(Email, EmailTranslation, fields=('language', 'content',))
         formset = EmailTranslationFormSet(data=request.POST)
+        status = 200
         if email_form.is_valid() and formset.is_valid():
-            email = email_form.save()
-            emailtranslations = formset.save(commit=False)
-            for emailtranslation in emailtranslations:
-                emailtranslation.email = email 
-                emailtranslation.save()
-            return HttpResponseRedirect(reverse('email_detail', args=[str(email.id)]))
+            try:
+                with transaction.atomic():
+                    email = email_form.save()
+                    formset.instance = email
+                    formset.save_translations()
+                return HttpResponseRedirect(reverse('email_detail', args=[str(email.id)]))
+            except IntegrityError:
+                formset.non_form_errors().append(TRANSLATION_CONFLICT)
+                status = 409
         context = {"form":email_form, "formset":formset}
-        return self.render_to_response(context)
+        return self.render_to_response(context, status=status)
 
 @permission_required('emails.change_email')
 def email_update(request, pk):
     obj = get_object_or_404(Email, pk=pk)
     email_form = EmailForm(request.POST or None, instance = obj)
-
-    EmailTranslationFormSet = inlineformset_factory(Email, EmailTranslation, fields=('language', 'content',))
     formset = EmailTranslationFormSet(request.POST or None, instance = obj)
 
+    status = 200
     if email_form.is_valid() and formset.is_valid():
-        email = email_form.save()
-        emailtranslations = formset.save(commit=False)
-        for emailtranslation in emailtranslations:
-                emailtranslation.email = email 
-                emailtranslation.save()
-        return HttpResponseRedirect(reverse('email_detail', args=[str(email.id)]))
+        try:
+            with transaction.atomic():
+                if email_form.has_changed():
+                    email_form.save()
+                formset.save_translations()
+            return HttpResponseRedirect(reverse('email_detail', args=[str(obj.id)]))
+        except IntegrityError:
+            formset.non_form_errors().append(TRANSLATION_CONFLICT)
+            status = 409
 
     context = {'form': email_form, "formset":formset}
-    return render(request, 'emails/email_update.html', context)
+    return render(request, 'emails/email_update.html', context, status=status)
+
+def translation_form(email, language, translation=None, data=None):
+    instance = translation or EmailTranslation(email=email, language=language)
+    return EmailTranslationContentForm(data, instance=instance, prefix=language)
+
+@permission_required('emails.change_email')
+def translation_editor(request, pk):
+    email = get_object_or_404(Email, pk=pk)
+    existing = {translation.language: translation for translation in email.emailtranslation_set.all()}
+    forms = [(language, name, translation_form(email, language, existing.get(language)))
+        for language, name in EmailTranslation.LANGUAGES]
+    context = {'email': email, 'forms': forms}
+    return render(request, 'emails/translation_editor.html', context)
+
+@require_http_methods(['GET', 'POST'])
+@permission_required('emails.change_email')
+def translation_save(request, pk, language):
+    '''
+    Create or update the translation of one email into one language, and
+    answer with JSON (if asked for) or the re-rendered form fragment.
+    '''
+    language_names = dict(EmailTranslation.LANGUAGES)
+    if language not in language_names:
+        raise Http404('Unknown language')
+    email = get_object_or_404(Email, pk=pk)
+    try:
+        translation = email.emailtranslation_set.get(language=language)
+    except EmailTranslation.DoesNotExist:
+        translation = None
+    form = translation_form(email, language, translation, request.POST or None)
+
+    saved = False
+    status = 200 if request.method == 'GET' else 400
+    if request.method == 'POST' and form.is_valid():
+        try:
+            # save() runs in its own transaction (see TrackedModel)
+            if form.has_changed() or form.instance.pk is None:
+                form.save()
+            saved = True
+            status = 200
+        except IntegrityError:
+            # Somebody else added this language since we looked
+            form.add_error(None, 'A %s translation was added in the meantime. Reload the page to edit it.'
+                % language_names[language])
+            status = 409
+
+    if 'application/json' in request.META.get('HTTP_ACCEPT', ''):
+        return JsonResponse({
+            'language': language,
+            'saved': saved,
+            'content_html': form.instance.content_html if saved else '',
+            'errors': form.errors.get_json_data(),
+        }, status=status)
+    context = {'email': email, 'language': language, 'name': language_names[language], 'form': form, 'saved': saved}
+    return render(request, 'emails/translation_form.html', context, status=status)
 
 class CategoryCreate(PermissionRequiredMixin, CreateView):
     permission_required = 'emails.add_category'
@@ -94,13 +319,116 @@ class CategoryUpdate(PermissionRequiredMixin, UpdateView):
     template_name = 'emails/category_update.html'
     success_url = reverse_lazy('all_categories')
 
-class CategoryList(LoginRequiredMixin, generic.ListView):
-    model = Category
+class CategoryList(LoginRequiredMixin, ConditionalPageMixin, generic.ListView):
     template_name = 'category_list.html'
+    # Emails are counted distinct because of the join to their translations
+    queryset = Category.objects.annotate(
+        num_emails=Count('email', distinct=True),
+        num_translations=Count('email__emailtranslation'),
+    ).order_by('name', 'id')
 
-class CategoryDetailView(PermissionRequiredMixin, generic.DetailView):
+    def get_page_state(self):
+        return conditional.table_state(Category, Email, EmailTranslation)
+
+class CategoryDetailView(PermissionRequiredMixin, ConditionalPageMixin, KeysetPageMixin, generic.DetailView):
     permission_required = 'emails.view_category'
     model = Category
     template_name = 'category_detail.html'
+    page_size = 50
+    ordering_keys = ('name_eng', 'id')
+
+    def get_page_state(self):
+        return conditional.category_state(self.kwargs['pk'])
+
+    def get_context_data(self, **kwargs):
+        emails = coverage.matrix(Email.objects.filter(category=self.object).only('id', 'name_eng', 'name_esp'))
+        self.page = keyset_paginate(emails, self.ordering_keys,
+            after=self.request.GET.get('after'), before=self.request.GET.get('before'), per_page=self.page_size)
+        context = super().get_context_data(**kwargs)
+        context['languages'] = coverage.LANGUAGES
+        context['rows'] = [(email, coverage.flags(email)) for email in self.page.object_list]
+        return context
+
+@permission_required('emails.view_email')
+def duplicates_report(request):
+    '''
+    Groups of near-duplicate translations in one language, going by the
+    signatures the find_duplicates command keeps (see duplicates.py).
+    '''
+    language, threshold = EmailTranslation.LANGUAGES[0][0], duplicates.threshold_setting()
+    form = DuplicatesForm(request.GET or None, initial={'language': language, 'threshold': threshold})
+    if form.is_valid():
+        language = form.cleaned_data['language']
+        threshold = form.cleaned_data['threshold'] or threshold
+    groups = duplicates.find_groups(language, threshold)
+    context = {
+        'form': form,
+        'language': dict(EmailTranslation.LANGUAGES)[language],
+        'threshold': threshold,
+        'groups': duplicates.suggest(language, groups[:duplicates.REPORT_GROUPS]),
+        'total': len(groups),
+        'unsigned': duplicates.stale().count(),
+    }
+    return render(request, 'emails/duplicates.html', context)
+
+@permission_required('emails.view_email')
+def email_history(request, pk):
+    '''
+    The latest revisions of the email's translations, and the changes made
+    by one of them (?language=FR&revision=3).
+    '''
+    email = get_object_or_404(Email, pk=pk)
+    history = (TranslationRevision.objects.filter(email=email).defer('data')
+        .order_by('-created', '-number')[:100])
+    context = {'email': email, 'history': history}
+    language = request.GET.get('language', '')
+    try:
+        number = int(request.GET.get('revision', ''))
+    except ValueError:
+        number = None
+    if language and number:
+        context.update({'language': language, 'number': number,
+            'segments': revisions.diff(email.pk, language, number)})
+    return render(request, 'emails/email_history.html', context)
+
+@permission_required('emails.add_outboundmessage')
+def email_send(request, pk):
+    '''
+    Queues a personalised copy of one of the email's translations for every
+    recipient in an uploaded CSV.  The send_queued_emails command sends them.
+    '''
+    email = get_object_or_404(Email, pk=pk)
+    translations = list(email.emailtranslation_set.order_by('language'))
+    result = None
+    if request.method == 'POST':
+        form = SendEmailForm(translations, request.POST, request.FILES)
+        if form.is_valid():
+            translation = next(translation for translation in translations
+                if translation.pk == form.cleaned_data['translation'])
+            try:
+                result = outbox.enqueue(translation, form.cleaned_data['subject'],
+                    merge.read_csv(form.cleaned_data['recipients']))
+            except UnicodeDecodeError:
+                # Nothing was queued: enqueue() runs in one transaction
+                form.add_error('recipients', 'The file is not UTF-8 text. Save it as "CSV UTF-8" and try again.')
+            except (ValueError, csv.Error) as e:
+                form.add_error('recipients', 'Could not read the recipients: %s' % e)
+    else:
+        form = SendEmailForm(translations, initial={'subject': email.name_eng})
+    context = {'email': email, 'form': form, 'result': result, 'translations': translations}
+    return render(request, 'emails/email_send.html', context)
 
+@permission_required('emails.view_outboundmessage')
+def outbox_status(request):
+    failures = (OutboundMessage.objects.filter(status=OutboundMessage.FAILED)
+        .only('to_address', 'subject', 'attempts', 'last_error', 'next_attempt').order_by('-id')[:20])
+    context = {'counts': outbox.status_counts(), 'failures': failures}
+    return render(request, 'emails/outbox.html', context)
 
+@staff_member_required
+def query_stats(request):
+    order = request.GET.get('order', 'queries')
+    if order not in ('queries', 'max_queries', 'db_time', 'total_time', 'requests'):
+        order = 'queries'
+    context = {'stats': querystats.view_stats('-' + order), 'order': order, 'enabled': settings.QUERY_STATS}
+    return render(request, 'emails/query_stats.html', context)